@@ -0,0 +1,104 @@
+import importlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Optional AI backends by name -> module to import. Importing face_recognition
+# also loads its dlib models, which is most of the cold-start cost.
+BACKENDS = {
+    'numpy': 'numpy',
+    'cv2': 'cv2',
+    'PIL': 'PIL.Image',
+    'imagehash': 'imagehash',
+    'face_recognition': 'face_recognition',
+}
+
+
+class CapabilityRegistry:
+    """Imports each optional AI backend at most once per process.
+
+    The first `get()` of a backend imports it and records whether it is
+    available, how long the import took and why it failed; later calls,
+    including for a missing backend, return the cached outcome without
+    retrying the import. `preload()` probes every backend up front.
+    """
+
+    def __init__(self, backends=None):
+        self.backends = dict(backends or BACKENDS)
+        self._modules = {}
+        self._probes = {}
+        self._lock = threading.Lock()
+        self.preloaded_at = None
+
+    def get(self, name):
+        """The backend's module, or None if it is not installed / failed to load"""
+        if name in self._probes:
+            return self._modules.get(name)
+        with self._lock:
+            if name not in self._probes:
+                self._probe(name)
+        return self._modules.get(name)
+
+    def _probe(self, name):
+        started = time.perf_counter()
+        probe = {'available': False, 'error': None, 'version': None}
+        try:
+            module = importlib.import_module(self.backends[name])
+            self._modules[name] = module
+            probe['available'] = True
+            probe['version'] = getattr(module, '__version__', None)
+        except Exception as e:
+            # ImportError, or a broken native extension / model file
+            probe['error'] = f'{type(e).__name__}: {e}'
+            logger.info(f"AI backend {name} not available: {e}")
+        probe['load_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        self._probes[name] = probe
+
+    def require(self, *names):
+        """Modules for all of `names` in order, or None if any is unavailable"""
+        modules = tuple(self.get(name) for name in names)
+        return None if any(module is None for module in modules) else modules
+
+    def available(self, name):
+        return self.get(name) is not None
+
+    def preload(self, names=None):
+        """Probe the given backends (default: all) now; returns {name: available}"""
+        result = {name: self.available(name) for name in (names or self.backends)}
+        self.preloaded_at = time.time()
+        logger.info(f"AI backends preloaded: {result}")
+        return result
+
+    def preload_in_background(self, names=None):
+        """Run preload() on a daemon thread so startup is not delayed"""
+        thread = threading.Thread(target=self.preload, args=(names,), name='ai-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def report(self):
+        """Probe outcome of every backend; status is 'not_loaded' until first use"""
+        report = {}
+        for name in self.backends:
+            probe = self._probes.get(name)
+            if probe is None:
+                report[name] = {'status': 'not_loaded'}
+            else:
+                report[name] = {
+                    'status': 'available' if probe['available'] else 'unavailable',
+                    'version': probe['version'],
+                    'load_ms': probe['load_ms'],
+                    'error': probe['error']
+                }
+        return report
+
+
+# One registry per process (each verification pool worker has its own)
+ai_registry = CapabilityRegistry()
+
+
+def preload_enabled():
+    """AI_PRELOAD=0 leaves backends to load on first use instead of at startup"""
+    return os.getenv('AI_PRELOAD', '1').lower() not in ('0', 'false', 'no', 'off')
@@ -2,20 +2,29 @@ from flask import Flask, request, jsonify, session, redirect, url_for
 from flask_cors import CORS
 from flask import render_template
 from datetime import datetime, timedelta
-import io
 import base64
 from functools import wraps
+from lean_verifier import LeanVerifier
+from blob_store import to_data_url
+from uploads import UploadError, check_upload_size, read_image_upload, read_b64_image
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # Change this in production
 CORS(app, supports_credentials=True)
 
+# OpenCV does not fit the lambda; verification runs on PIL + numpy. Loading at
+# import puts the library import in the cold start instead of the first upload.
+verifier = LeanVerifier()
+verifier.load()
+
 # In-memory data
 students = []
 deleted_students = []
 data_log = []
 student_attendance = {}  # Track student attendance by date
 attendance_images = {}  # Store attendance images by date and roll number
+attendance_phashes = {}  # Perceptual hashes (signed 64-bit) of attendance images by date and roll number
+profile_phashes = {}  # Roll number -> phash of the student's profile picture, computed when it is added
 
 # Available classes (K-12)
 AVAILABLE_CLASSES = ['K', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
@@ -165,39 +174,34 @@ def _strip_data_url_prefix(data_url: str) -> str:
         return data_url.split(',', 1)[1]
     return data_url
 
-def _get_face_encoding_from_b64(b64_data: str):
-    """Simplified face encoding - just return a placeholder for now"""
-    # This is a placeholder since we're not using OpenCV in this version
-    return "placeholder_encoding"
+def _decode_image(image_data: str):
+    """Raw bytes of a base64 / data URL image, or None if it does not decode"""
+    try:
+        return base64.b64decode(_strip_data_url_prefix(image_data)) or None
+    except ValueError:
+        return None
 
-def _faces_match(profile_b64: str, capture_b64: str, threshold: float = 0.6):
-    """Simplified face matching - always return True for demo"""
-    # This is a placeholder since we're not using OpenCV in this version
-    return True
+def _previous_attendance_phashes(roll_number, limit=5):
+    """Phashes of a student's most recent earlier attendance photos"""
+    previous_phashes = []
+    for date in sorted(attendance_phashes, reverse=True):
+        if roll_number in attendance_phashes[date]:
+            previous_phashes.append(attendance_phashes[date][roll_number])
+            if len(previous_phashes) >= limit:
+                break
+    return previous_phashes
 
-def _enhanced_image_verification(image_data: str, roll_number: int):
-    """Simplified image verification without OpenCV"""
-    try:
-        # Basic validation - just check if image data exists
-        if not image_data or len(image_data) < 100:
-            return False, "Image data too small or invalid"
-        
-        # For demo purposes, always return success
-        return True, "Image verification successful (demo mode)"
-    except Exception as e:
-        return False, f"Image verification error: {str(e)}"
-
-def _ai_verify_attendance(image_data: str, roll_number: int):
-    """Simplified AI verification without OpenCV"""
-    try:
-        # Basic validation
-        if not image_data:
-            return False, "No image data provided"
-        
-        # For demo purposes, always return success
-        return True, "AI verification successful (demo mode)"
-    except Exception as e:
-        return False, f"AI verification error: {str(e)}"
+def _ai_verify_attendance(image_raw: bytes, roll_number: int):
+    """Verify an attendance photo with the PIL + numpy verifier.
+
+    Returns (result, image_phash); result is a dict with 'verified', 'method',
+    'reason' and 'timings_ms' keys.
+    """
+    return verifier.verify(
+        image_raw,
+        profile_phash=profile_phashes.get(roll_number),
+        previous_phashes=_previous_attendance_phashes(roll_number)
+    )
 
 def require_login(f):
     @wraps(f)
@@ -250,34 +254,102 @@ def student_login():
 @app.route('/api/student/attendance', methods=['POST'])
 @require_login
 def mark_attendance():
+    data = request.get_json() or {}
+    image_data = data.get('image_data') or data.get('image')
+    return _mark_attendance(lambda: read_b64_image(image_data))
+
+@app.route('/api/student/attendance/upload', methods=['POST'])
+@require_login
+def mark_attendance_upload():
+    """Attendance photo as multipart/form-data (field "image") or a raw image/jpeg body.
+
+    There is no job queue on the lambda; ?async=1 is ignored and the result is returned directly.
+    """
+    try:
+        check_upload_size(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return _mark_attendance(lambda: read_image_upload(request))
+
+def _mark_attendance(read_image):
+    """Shared body of the attendance routes; `read_image` returns the raw upload bytes"""
     if session['role'] != 'student':
         return jsonify({'error': 'Only students can mark attendance'}), 403
     
-    data = request.get_json()
-    image_data = data.get('image')
     roll_number = session.get('student_roll')
+    try:
+        image_raw = read_image()
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     
-    if not image_data:
-        return jsonify({'error': 'Image data required'}), 400
-    
-    # Simplified attendance marking without AI verification
     today = datetime.now().strftime('%Y-%m-%d')
     
+    verification_result, image_phash = _ai_verify_attendance(image_raw, roll_number)
+    if image_phash is not None:
+        attendance_phashes.setdefault(today, {})[roll_number] = image_phash
+    
+    if not verification_result['verified']:
+        return jsonify({
+            'success': True,
+            'auto_present': False,
+            'reason': verification_result['reason'],
+            'message': f'❌ Verification failed: {verification_result["reason"]}. Please retake the photo.'
+        })
+    
     if today not in student_attendance:
         student_attendance[today] = {}
     
     student_attendance[today][roll_number] = {
         'timestamp': nowstr(),
         'verified': True,
-        'method': 'manual'
+        'method': verification_result['method']
     }
     
     # Store image data
     if today not in attendance_images:
         attendance_images[today] = {}
-    attendance_images[today][roll_number] = image_data
+    attendance_images[today][roll_number] = to_data_url(image_raw)
+    
+    return jsonify({
+        'success': True,
+        'auto_present': True,
+        'message': f'✅ Attendance verified successfully by {verification_result["method"]}!'
+    })
+
+@app.route('/api/student/profile-picture/upload', methods=['POST'])
+@require_login
+def upload_profile_picture_binary():
+    """Profile picture as multipart/form-data (field "image") or a raw image/jpeg body"""
+    if session['role'] != 'student':
+        return jsonify({'error': 'Only students can upload profile pictures'}), 403
     
-    return jsonify({'success': True, 'message': 'Attendance marked successfully'})
+    roll_number = session.get('student_roll')
+    student = next((s for s in students if s['roll'] == roll_number), None)
+    if student is None:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    try:
+        image_raw = read_image_upload(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    # Only the phash is needed for verification here
+    profile_phash = verifier.phash_of(image_raw)
+    if profile_phash is not None:
+        profile_phashes[roll_number] = profile_phash
+    else:
+        profile_phashes.pop(roll_number, None)
+    student['has_profile_picture'] = True
+    
+    return jsonify({'success': True, 'message': 'Profile picture uploaded successfully'})
+
+@app.route('/api/verification/stats', methods=['GET'])
+@require_login
+def get_verification_stats():
+    """Verifier cold-start and per-stage timings (principal only)"""
+    if session['role'] != 'principal':
+        return jsonify({'error': 'Permission denied'}), 403
+    return jsonify(verifier.stats())
 
 @app.route('/api/student/attendance', methods=['GET'])
 @require_login
@@ -395,6 +467,15 @@ def add_student():
     }
     
     students.append(new_student)
+    
+    # Precompute the profile picture phash so attendance checks only hash the capture
+    profile_raw = _decode_image(data['profile_picture']) if data.get('profile_picture') else None
+    profile_phash = verifier.phash_of(profile_raw) if profile_raw else None
+    if profile_phash is not None:
+        profile_phashes[roll] = profile_phash
+    else:
+        profile_phashes.pop(roll, None)
+    
     data_log.insert(0, {
         'action': 'add',
         'student': new_student.copy(),
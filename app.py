@@ -2,20 +2,48 @@ from flask import Flask, request, jsonify, session, redirect, url_for
 from flask_cors import CORS
 from flask import render_template
 from datetime import datetime, timedelta
-import io
-import base64
 from functools import wraps
+from blob_store import decode_image_b64, to_data_url
+from image_ingest import IMAGE_SIZES, ingest_image, resolve_image
+from uploads import UploadError, check_upload_size, read_image_upload, read_b64_image
+from verification_executor import create_verification_executor
+from ai_capabilities import preload_enabled
+from phash_index import ReplayIndex
+from login_lookup import first_name_key, match_student_login
+from audit_log import wants_page, parse_log_query, page_entries
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # Change this in production
 CORS(app, supports_credentials=True)
 
+# Verification runs in warm worker processes (VERIFICATION_WORKERS, 0 = inline)
+verification_executor = create_verification_executor(
+    brightness_range=(30, 225), min_contrast=10, face_threshold=0.6, phash_match_threshold=8
+)
+
+@app.before_request
+def start_verification_executor():
+    """Start (and warm) the verification workers once this process serves requests.
+
+    Not done at import: verification workers import this module again and
+    must not start a pool of their own while they bootstrap.
+    """
+    verification_executor.start(preload=preload_enabled())
+
+# Today's submitted photo phashes, for spotting one photo reused by several students
+replay_index = ReplayIndex(lambda date: attendance_phashes.get(date, {}).items())
+
 # In-memory data
 students = []
 deleted_students = []
 data_log = []
+data_log_by_id = {}  # Log entry id -> entry, for undo by id
+next_log_id = 1
 student_attendance = {}  # Track student attendance by date
-attendance_images = {}  # Store attendance images by date and roll number
+attendance_images = {}  # Blob store hashes of attendance images by date and roll number
+students_by_first_name = {}  # Lowercase first name -> active students, for student login
+face_embeddings = {}  # Roll number -> (profile picture it was computed from, float32 face embedding)
+attendance_phashes = {}  # Perceptual hashes (signed 64-bit) of attendance images by date and roll number
 
 # Available classes (K-12)
 AVAILABLE_CLASSES = ['K', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
@@ -151,6 +179,15 @@ USERS = {
 def nowstr():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+def add_log_entry(entry):
+    """Give a log entry the next id and put it at the head of the newest-first log"""
+    global next_log_id
+    entry['id'] = next_log_id
+    next_log_id += 1
+    data_log.insert(0, entry)
+    data_log_by_id[entry['id']] = entry
+    return entry
+
 def calculate_grade(marks):
     """Calculate grade based on marks (0-100)"""
     if marks >= 97:
@@ -180,6 +217,42 @@ def calculate_grade(marks):
     else:
         return 'F'
 
+# Longest range the attendance calendar serves in one response (one academic year)
+MAX_CALENDAR_MONTHS = 12
+
+def get_calendar_months(year, month, months=1):
+    """List (year, month, start_date, end_date) for consecutive months.
+
+    `month` is 0-based to match the calendar UI.
+    """
+    from calendar import monthrange
+    result = []
+    for offset in range(months):
+        y, m = divmod(month + offset, 12)
+        y += year
+        _, days_in_month = monthrange(y, m + 1)  # monthrange uses 1-based months
+        result.append((y, m, f"{y}-{m+1:02d}-01", f"{y}-{m+1:02d}-{days_in_month:02d}"))
+    return result
+
+def index_student(student):
+    """Add a student to the first-name login index"""
+    students_by_first_name.setdefault(first_name_key(student['name']), []).append(student)
+
+def unindex_student(student):
+    """Remove a student from the first-name login index"""
+    key = first_name_key(student['name'])
+    bucket = [s for s in students_by_first_name.get(key, []) if s is not student]
+    if bucket:
+        students_by_first_name[key] = bucket
+    else:
+        students_by_first_name.pop(key, None)
+
+def rebuild_student_index():
+    """Rebuild the first-name login index from the active students list"""
+    students_by_first_name.clear()
+    for student in students:
+        index_student(student)
+
 def get_teacher_class(username):
     """Get the class assigned to a teacher"""
     for teacher in teachers:
@@ -188,203 +261,38 @@ def get_teacher_class(username):
     return None
 
 
-def _strip_data_url_prefix(data_url: str) -> str:
-    """Strip data URL prefix from base64 image data"""
-    if data_url.startswith('data:image/'):
-        return data_url.split('base64,', 1)[1]
-    return data_url
+def _store_face_embedding(student):
+    """Compute and keep the face embedding of a student's profile picture.
 
-
-def _get_face_encoding_from_b64(b64_data: str):
-    """Return one face encoding from a base64 image, or None.
-    Tries to import face_recognition lazily.
+    Returns the float32 embedding, or None if no face was found or AI is unavailable.
     """
     try:
-        import face_recognition  # type: ignore
-    except Exception:
-        return None
+        encoding = verification_executor.face_embedding(decode_image_b64(student['profile_picture']))
+    except ValueError:
+        encoding = None
+    if encoding is not None:
+        face_embeddings[student['roll']] = (student['profile_picture'], encoding)
+    else:
+        face_embeddings.pop(student['roll'], None)
+    return encoding
 
-    try:
-        raw = base64.b64decode(_strip_data_url_prefix(b64_data))
-        image = face_recognition.load_image_file(io.BytesIO(raw))
-        encodings = face_recognition.face_encodings(image)
-        if not encodings:
-            return None
-        return encodings[0]
-    except Exception:
-        return None
 
+def _previous_attendance_phashes(roll_number, limit=5):
+    """Stored phashes of a student's previous attendance images (from in-memory storage)"""
+    previous_phashes = []
+    for date in attendance_phashes:
+        if roll_number in attendance_phashes[date]:
+            previous_phashes.append(attendance_phashes[date][roll_number])
+            if len(previous_phashes) >= limit:
+                break
+    return previous_phashes
 
-def _faces_match(profile_b64: str, capture_b64: str, threshold: float = 0.6):
-    """Compare two base64 images via face_recognition when available.
 
-    Returns True/False if computed, or None if AI lib unavailable.
-    """
-    try:
-        import face_recognition  # type: ignore
-    except Exception:
-        # Try a weak fallback using perceptual hash if PIL+imagehash exist
-        try:
-            from PIL import Image  # type: ignore
-            import imagehash  # type: ignore
-            prof_raw = base64.b64decode(_strip_data_url_prefix(profile_b64))
-            cap_raw = base64.b64decode(_strip_data_url_prefix(capture_b64))
-            prof_img = Image.open(io.BytesIO(prof_raw)).convert('L').resize((256, 256))
-            cap_img = Image.open(io.BytesIO(cap_raw)).convert('L').resize((256, 256))
-            h1 = imagehash.phash(prof_img)
-            h2 = imagehash.phash(cap_img)
-            # Smaller distance implies higher similarity; threshold chosen conservatively
-            return (h1 - h2) <= 8
-        except Exception:
-            return None
-
-    enc_profile = _get_face_encoding_from_b64(profile_b64)
-    enc_capture = _get_face_encoding_from_b64(capture_b64)
-    if enc_profile is None or enc_capture is None:
-        return False
-    distance = face_recognition.face_distance([enc_profile], enc_capture)[0]
-    return bool(distance <= threshold)
-
-
-def _enhanced_image_verification(image_data: str, roll_number: int):
-    """Enhanced image verification using multiple AI techniques when face recognition is unavailable.
-    
-    Returns a dict with 'verified' (bool), 'method' (str), and 'reason' (str) keys.
-    """
-    try:
-        import cv2
-        import numpy as np
-        from PIL import Image
-        import imagehash
-    except ImportError:
-        return {
-            'verified': False,
-            'method': 'none',
-            'reason': 'ai_libraries_unavailable'
-        }
+def _ai_verify_attendance(image_raw, roll_number: int, date=None):
+    """AI-powered attendance verification of raw upload bytes using multiple techniques.
     
-    try:
-        # Decode base64 image
-        raw_data = base64.b64decode(_strip_data_url_prefix(image_data))
-        image = Image.open(io.BytesIO(raw_data))
-        
-        # Convert to OpenCV format for analysis
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        
-        # Method 1: Face detection using OpenCV
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) > 0:
-            # Face detected - this is likely a valid attendance photo
-            return {
-                'verified': True,
-                'method': 'opencv_face_detection',
-                'reason': 'face_detected'
-            }
-        
-        # Method 2: Image quality and content analysis
-        # Check if image has reasonable size and quality
-        height, width = gray.shape
-        if height < 100 or width < 100:
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'image_too_small'
-            }
-        
-        # Check image brightness and contrast
-        mean_brightness = np.mean(gray)
-        std_brightness = np.std(gray)
-        
-        if mean_brightness < 30 or mean_brightness > 225:
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'poor_lighting'
-            }
-        
-        if std_brightness < 10:
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'low_contrast'
-            }
-        
-        # Method 3: Check if image appears to be a selfie/portrait
-        # Look for skin tone detection and reasonable aspect ratio
-        aspect_ratio = width / height
-        if 0.5 <= aspect_ratio <= 2.0:  # Reasonable portrait/selfie ratio
-            # Convert to HSV for skin tone detection
-            hsv = cv2.cvtColor(cv_image, cv2.COLOR_BGR2HSV)
-            
-            # Define skin tone range
-            lower_skin = np.array([0, 20, 70], dtype=np.uint8)
-            upper_skin = np.array([20, 255, 255], dtype=np.uint8)
-            
-            skin_mask = cv2.inRange(hsv, lower_skin, upper_skin)
-            skin_pixels = cv2.countNonZero(skin_mask)
-            total_pixels = height * width
-            skin_percentage = (skin_pixels / total_pixels) * 100
-            
-            if skin_percentage > 5:  # At least 5% of image contains skin tones
-                return {
-                    'verified': True,
-                    'method': 'skin_tone_analysis',
-                    'reason': 'likely_human_photo'
-                }
-        
-        # Method 4: Perceptual hash comparison with previous attendance images
-        # This is a fallback that checks if the image is similar to previous attendance photos
-        try:
-            # Get previous attendance images for this student (from in-memory storage)
-            previous_images = []
-            for date in attendance_images:
-                if roll_number in attendance_images[date]:
-                    previous_images.append(attendance_images[date][roll_number])
-                    if len(previous_images) >= 5:  # Limit to 5 previous images
-                        break
-            
-            if previous_images:
-                current_hash = imagehash.phash(image)
-                
-                for prev_image_data in previous_images:
-                    if prev_image_data:
-                        prev_raw = base64.b64decode(_strip_data_url_prefix(prev_image_data))
-                        prev_image = Image.open(io.BytesIO(prev_raw))
-                        prev_hash = imagehash.phash(prev_image)
-                        
-                        # Check similarity
-                        hash_distance = current_hash - prev_hash
-                        if hash_distance <= 15:  # Similar image threshold
-                            return {
-                                'verified': True,
-                                'method': 'perceptual_hash_comparison',
-                                'reason': 'similar_to_previous_attendance'
-                            }
-        except Exception:
-            pass  # Skip this method if it fails
-        
-        # If all methods fail, require manual verification
-        return {
-            'verified': False,
-            'method': 'enhanced_verification',
-            'reason': 'no_verification_criteria_met'
-        }
-        
-    except Exception as e:
-        return {
-            'verified': False,
-            'method': 'enhanced_verification',
-            'reason': f'verification_error: {str(e)}'
-        }
-
-
-def _ai_verify_attendance(image_data: str, roll_number: int):
-    """AI-powered attendance verification using multiple techniques.
-    
-    Returns a dict with 'verified' (bool), 'method' (str), and 'reason' (str) keys.
+    Returns (result, image_phash); result is a dict with 'verified' (bool),
+    'method' (str), and 'reason' (str) keys.
     """
     # First, try to find student profile picture for face recognition
     student = None
@@ -393,29 +301,42 @@ def _ai_verify_attendance(image_data: str, roll_number: int):
             student = s
             break
     
-    if student and student.get('profile_picture'):
-        # Try face recognition first
-        match = _faces_match(student['profile_picture'], image_data)
-        if match is True:
-            return {
-                'verified': True,
-                'method': 'ai_face_recognition',
-                'reason': 'face_match_success'
-            }
-        elif match is False:
-            return {
-                'verified': False,
-                'method': 'ai_face_recognition',
-                'reason': 'face_mismatch'
-            }
-        # match is None -> AI unavailable: fall through to enhanced verification
-    
-    # If no profile picture or face recognition failed, try enhanced verification
-    if not student or not student.get('profile_picture'):
-        return _enhanced_image_verification(image_data, roll_number)
+    has_profile_picture = bool(student and student.get('profile_picture'))
+    profile_encoding = None
+    profile_image = None
+    if has_profile_picture:
+        # Compare against the embedding stored when the picture was added
+        cached = face_embeddings.get(roll_number)
+        if cached and cached[0] is student['profile_picture']:
+            profile_encoding = cached[1]
+        else:
+            try:
+                profile_image = decode_image_b64(student['profile_picture'])
+            except ValueError:
+                profile_image = None
+    
+    outcome = verification_executor.verify(
+        image_raw,
+        has_profile_picture=has_profile_picture,
+        profile_encoding=profile_encoding,
+        profile_image=profile_image,
+        previous_phashes=_previous_attendance_phashes(roll_number)
+    )
+    if outcome['profile_encoding'] is not None:
+        face_embeddings[roll_number] = (student['profile_picture'], outcome['profile_encoding'])
+    
+    # A near-identical photo already submitted today by another student is a replay
+    image_phash = outcome['image_phash']
+    replay = replay_index.find_replay(date, roll_number, image_phash) if date else None
+    if replay:
+        return {
+            'verified': False,
+            'method': 'replay_detection',
+            'reason': 'duplicate_of_another_submission',
+            'matched_roll': replay['student_roll']
+        }, image_phash
     
-    # Fallback to enhanced verification when face recognition is unavailable
-    return _enhanced_image_verification(image_data, roll_number)
+    return outcome['result'], image_phash
 
 def require_login(f):
     from functools import wraps
@@ -457,15 +378,19 @@ def student_login():
     data = request.get_json()
     first_name = data.get('first_name')
     password = data.get('password')
+    roll = data.get('roll')  # Optional, disambiguates students sharing a first name
     
-    # Find student by first name (case-insensitive)
-    student = None
-    for s in students:
-        if s['name'].split()[0].lower() == first_name.lower():
-            student = s
-            break
+    # Find student by first name (case-insensitive) via the login index
+    candidates = students_by_first_name.get(first_name_key(first_name), [])
+    student, reason = match_student_login(candidates, password, roll)
     
-    if student and student.get('password') == password:
+    if reason == 'ambiguous_first_name':
+        return jsonify({
+            'error': 'More than one student matches this first name and password. Please also enter your roll number.',
+            'reason': reason
+        }), 409
+    
+    if student:
         session['user'] = f"student_{student['roll']}"
         session['role'] = 'student'
         session['student_roll'] = student['roll']
@@ -485,7 +410,26 @@ def student_login():
 @app.route('/api/student/attendance', methods=['POST'])
 @require_login
 def mark_attendance():
-    """Upload student attendance image for today with AI-powered automatic verification"""
+    """Upload student attendance image (base64 JSON) for today with AI-powered automatic verification"""
+    data = request.get_json() or {}
+    image_data = data.get('image_data')  # Base64 encoded image
+    return _mark_attendance(lambda: read_b64_image(image_data))
+
+@app.route('/api/student/attendance/upload', methods=['POST'])
+@require_login
+def mark_attendance_upload():
+    """Upload student attendance image as multipart/form-data (field "image") or a raw image/jpeg body.
+
+    Verification always runs in the request here; ?async=1 is accepted and ignored.
+    """
+    try:
+        check_upload_size(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return _mark_attendance(lambda: read_image_upload(request))
+
+def _mark_attendance(read_image):
+    """Shared body of the attendance upload routes; `read_image` returns the raw upload bytes"""
     if session['role'] != 'student':
         return jsonify({'error': 'Permission denied. Only students can upload attendance.'}), 403
     
@@ -499,15 +443,18 @@ def mark_attendance():
     if today in attendance_images and roll_number in attendance_images[today]:
         return jsonify({'error': 'Attendance image already uploaded for today'}), 400
     
-    # Get image data from request
-    data = request.get_json()
-    image_data = data.get('image_data')  # Base64 encoded image
-    
-    if not image_data:
-        return jsonify({'error': 'Image data is required'}), 400
+    try:
+        image_raw = read_image()
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     
     # AI-powered automatic attendance verification
-    verification_result = _ai_verify_attendance(image_data, roll_number)
+    verification_result, image_phash = _ai_verify_attendance(image_raw, roll_number, today)
+    
+    # Keep the upload's phash for later comparisons and replay detection
+    if image_phash is not None:
+        attendance_phashes.setdefault(today, {})[roll_number] = image_phash
+        replay_index.add(today, roll_number, image_phash)
     
     if verification_result['verified']:
         # AI successfully verified the student - mark as present automatically
@@ -519,7 +466,7 @@ def mark_attendance():
         # Store the image
         if today not in attendance_images:
             attendance_images[today] = {}
-        attendance_images[today][roll_number] = image_data
+        attendance_images[today][roll_number] = ingest_image(image_raw)[0]
         
         # Log the action
         log_entry = {
@@ -530,7 +477,7 @@ def mark_attendance():
             'method': verification_result['method'],
             'when': nowstr()
         }
-        data_log.insert(0, log_entry)
+        add_log_entry(log_entry)
         
         return jsonify({
             'success': True, 
@@ -541,7 +488,7 @@ def mark_attendance():
         # AI verification failed - store image and require manual verification
         if today not in attendance_images:
             attendance_images[today] = {}
-        attendance_images[today][roll_number] = image_data
+        attendance_images[today][roll_number] = ingest_image(image_raw)[0]
         
         # Log the action
         log_entry = {
@@ -552,7 +499,7 @@ def mark_attendance():
             'note': verification_result.get('reason', 'manual_verification_required'),
             'when': nowstr()
         }
-        data_log.insert(0, log_entry)
+        add_log_entry(log_entry)
         
         msg = '📸 Attendance image uploaded. Waiting for teacher verification.'
         if verification_result.get('reason') == 'no_profile_picture':
@@ -562,6 +509,36 @@ def mark_attendance():
         
         return jsonify({'success': True, 'message': msg})
 
+@app.route('/api/student/profile-picture/upload', methods=['POST'])
+@require_login
+def upload_profile_picture_binary():
+    """Upload student's profile picture as multipart/form-data (field "image") or a raw image/jpeg body"""
+    if session['role'] != 'student':
+        return jsonify({'error': 'Permission denied. Only students can upload profile pictures.'}), 403
+    
+    roll_number = session.get('student_roll')
+    student = next((s for s in students if s['roll'] == roll_number), None)
+    if student is None:
+        return jsonify({'error': 'Student not found'}), 404
+    
+    try:
+        image_raw = read_image_upload(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    # Kept as a data URL like pictures added with the student, with its face embedding
+    student['profile_picture'] = to_data_url(image_raw)
+    student['has_profile_picture'] = True
+    _store_face_embedding(student)
+    
+    add_log_entry({
+        'action': 'upload_profile_picture',
+        'student_roll': roll_number,
+        'who': session['user'],
+        'when': nowstr()
+    })
+    return jsonify({'success': True, 'message': 'Profile picture uploaded successfully'})
+
 @app.route('/api/student/attendance', methods=['GET'])
 @require_login
 def get_student_attendance():
@@ -761,7 +738,7 @@ def verify_attendance(roll_number):
         'who': session['user'],
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'message': 'Attendance verified successfully'})
 
@@ -777,6 +754,7 @@ def request_new_attendance_image(roll_number):
     # Remove existing image and attendance
     if today in attendance_images and roll_number in attendance_images[today]:
         del attendance_images[today][roll_number]
+        attendance_phashes.get(today, {}).pop(roll_number, None)
     
     if today in student_attendance and roll_number in student_attendance[today]:
         student_attendance[today].remove(roll_number)
@@ -789,7 +767,7 @@ def request_new_attendance_image(roll_number):
         'who': session['user'],
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'message': 'New image requested successfully'})
 
@@ -800,10 +778,14 @@ def get_attendance_image(date, roll_number):
     if session['role'] not in ['teacher', 'principal']:
         return jsonify({'error': 'Permission denied. Only teachers and principals can view attendance images.'}), 403
     
+    size = request.args.get('size', 'full')
+    if size not in IMAGE_SIZES:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
     # Check if image exists
     if date in attendance_images and roll_number in attendance_images[date]:
         return jsonify({
-            'image_data': attendance_images[date][roll_number],
+            'image_data': resolve_image(None, attendance_images[date][roll_number], size),
             'date': date,
             'roll_number': roll_number
         })
@@ -853,7 +835,7 @@ def update_student_marks(idx):
         'who': session['user'],
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'message': 'Marks updated successfully'})
 
@@ -906,7 +888,7 @@ def add_teacher():
         'who': session['user'], 
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'teacher': new_teacher})
 
@@ -951,7 +933,7 @@ def change_teacher_password(username):
         'who': session['user'],
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'message': f'Password changed for {username}'})
 
@@ -982,7 +964,7 @@ def delete_teacher(username):
         'who': session['user'],
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     
     return jsonify({'success': True, 'message': f'Teacher {username} deleted'})
 
@@ -1022,8 +1004,13 @@ def add_student():
         'timestamp': nowstr()
     }
     students.append(student)
+    index_student(student)
+    if profile_picture:
+        _store_face_embedding(student)
+    else:
+        face_embeddings.pop(student['roll'], None)
     log_entry = {'action': 'add', 'student': student.copy(), 'who': role, 'when': nowstr()}
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     print(f"Added student to students list. Total students: {len(students)}")
     print(f"Added log entry. Total log entries: {len(data_log)}")
     print(f"Log entry: {log_entry}")
@@ -1050,6 +1037,7 @@ def edit_student(idx):
     
     data = request.json
     print(f"Edit data received: {data}")
+    unindex_student(student)
     student.update({
         'name': data['name'],
         'age': data['age'],
@@ -1062,6 +1050,7 @@ def edit_student(idx):
             'english': data.get('marks', {}).get('english', 0)
         }
     })
+    index_student(student)
     
     # Store both original and updated data in log
     log_entry = {
@@ -1071,7 +1060,7 @@ def edit_student(idx):
         'who': role, 
         'when': nowstr()
     }
-    data_log.insert(0, log_entry)
+    add_log_entry(log_entry)
     print(f"Edit log entry created. Total log entries: {len(data_log)}")
     print(f"Log entry: {log_entry}")
     return jsonify({'success': True})
@@ -1087,10 +1076,11 @@ def delete_student(idx):
     if role != 'principal' and not (role == 'teacher' and student['addedBy'] == 'teacher'):
         return jsonify({'error': 'Permission denied'}), 403
     deleted = students.pop(idx)
+    unindex_student(deleted)
     deleted['deletedBy'] = role
     deleted['deletedAt'] = nowstr()
     deleted_students.append(deleted)
-    data_log.insert(0, {'action': 'delete', 'student': deleted.copy(), 'who': role, 'when': nowstr()})
+    add_log_entry({'action': 'delete', 'student': deleted.copy(), 'who': role, 'when': nowstr()})
     return jsonify({'success': True})
 
 # --- Deleted students endpoints ---
@@ -1114,7 +1104,8 @@ def recover_student(idx):
     recovered.pop('deletedBy', None)
     recovered.pop('deletedAt', None)
     students.append(recovered)
-    data_log.insert(0, {'action': 'recover', 'student': recovered.copy(), 'who': role, 'when': nowstr()})
+    index_student(recovered)
+    add_log_entry({'action': 'recover', 'student': recovered.copy(), 'who': role, 'when': nowstr()})
     return jsonify({'success': True})
 
 @app.route('/api/deleted_students/<int:idx>', methods=['DELETE'])
@@ -1128,7 +1119,7 @@ def permadelete_student(idx):
     # Only principal can permadelete if deleted by principal
     if student['deletedBy'] == 'principal' and role != 'principal':
         return jsonify({'error': 'Permission denied'}), 403
-    data_log.insert(0, {'action': 'permadelete', 'student': student.copy(), 'who': role, 'when': nowstr()})
+    add_log_entry({'action': 'permadelete', 'student': student.copy(), 'who': role, 'when': nowstr()})
     deleted_students.pop(idx)
     return jsonify({'success': True})
 
@@ -1136,9 +1127,23 @@ def permadelete_student(idx):
 @app.route('/api/log', methods=['GET'])
 @require_login
 def get_log():
+    """Data log, newest first.
+    
+    Without query parameters this returns the full list the dashboard
+    expects. Any of limit, cursor, action, actor, roll, start_date, end_date
+    or compact switches to pages: {'entries': [...], 'next_cursor': ...}.
+    """
     print(f"Log endpoint called. Total log entries: {len(data_log)}")
-    print(f"Log entries: {data_log}")
-    return jsonify(data_log)
+    if not wants_page(request.args):
+        return jsonify(data_log)
+    
+    try:
+        query = parse_log_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    entries, next_cursor = page_entries(data_log, query)
+    return jsonify({'entries': entries, 'next_cursor': next_cursor})
 
 # --- Clear all / recover all ---
 cleared_students = None
@@ -1155,9 +1160,10 @@ def clear_all():
         'deleted_students': deleted_students.copy()
     }
     clear_log = {'clearedBy': role, 'clearedAt': nowstr()}
-    data_log.insert(0, {'action': 'clear', 'who': role, 'when': nowstr()})
+    add_log_entry({'action': 'clear', 'who': role, 'when': nowstr()})
     students.clear()
     deleted_students.clear()
+    students_by_first_name.clear()
     return jsonify({'success': True})
 
 @app.route('/api/clear_log', methods=['GET'])
@@ -1181,6 +1187,7 @@ def clear_data_log():
     
     # Clear the data log
     data_log.clear()
+    data_log_by_id.clear()
     print(f"Data log cleared, now has {len(data_log)} entries")
     
     return jsonify({'success': True})
@@ -1196,8 +1203,9 @@ def recover_all():
     if clear_log and clear_log['clearedBy'] == 'principal' and role != 'principal':
         return jsonify({'error': 'Permission denied'}), 403
     students.extend(cleared_students['students'])
+    rebuild_student_index()
     deleted_students.extend(cleared_students['deleted_students'])
-    data_log.insert(0, {'action': 'recoverall', 'who': role, 'when': nowstr()})
+    add_log_entry({'action': 'recoverall', 'who': role, 'when': nowstr()})
     cleared_students = None
     clear_log = None
     return jsonify({'success': True})
@@ -1205,13 +1213,24 @@ def recover_all():
 @app.route('/api/undo_edit/<int:log_idx>', methods=['POST'])
 @require_login
 def undo_edit(log_idx):
-    username = session['user']
-    role = session['role']
-    
     if log_idx < 0 or log_idx >= len(data_log):
         return jsonify({'error': 'Log entry not found'}), 404
     
-    log_entry = data_log[log_idx]
+    return _undo_edit(data_log[log_idx])
+
+@app.route('/api/undo_edit/by-id/<int:log_id>', methods=['POST'])
+@require_login
+def undo_edit_by_id(log_id):
+    log_entry = data_log_by_id.get(log_id)
+    if not log_entry:
+        return jsonify({'error': 'Log entry not found'}), 404
+    
+    return _undo_edit(log_entry)
+
+def _undo_edit(log_entry):
+    """Revert the student an edit log entry changed"""
+    role = session['role']
+    
     if log_entry['action'] != 'edit':
         return jsonify({'error': 'Not an edit action'}), 400
     
@@ -1235,6 +1254,7 @@ def undo_edit(log_idx):
     
     # Revert to original data
     original_data = log_entry['original_student']
+    unindex_student(students[student_idx])
     students[student_idx].update({
         'name': original_data['name'],
         'age': original_data['age'],
@@ -1242,9 +1262,10 @@ def undo_edit(log_idx):
         'roll': original_data['roll'],
         'marks': original_data['marks']
     })
+    index_student(students[student_idx])
     
     # Add undo action to log
-    data_log.insert(0, {
+    add_log_entry({
         'action': 'undo_edit',
         'student': students[student_idx].copy(),
         'who': role,
@@ -1266,30 +1287,42 @@ def get_student_attendance_calendar(roll_number):
     if year is None or month is None:
         return jsonify({'error': 'Year and month parameters are required'}), 400
     
-    # Get all dates in the specified month
-    from calendar import monthrange
-    _, days_in_month = monthrange(year, month + 1)  # month + 1 because monthrange uses 1-based months
-    
-    present_dates = []
-    uploaded_dates = []
-    
-    # Check each day of the month
-    for day in range(1, days_in_month + 1):
-        date_str = f"{year}-{month+1:02d}-{day:02d}"
-        
-        # Check if student was present on this date
-        if date_str in student_attendance and roll_number in student_attendance[date_str]:
-            present_dates.append(date_str)
-        # Check if student uploaded image on this date
-        elif date_str in attendance_images and roll_number in attendance_images[date_str]:
-            uploaded_dates.append(date_str)
+    months = request.args.get('months', 1, type=int)
+    if months < 1 or months > MAX_CALENDAR_MONTHS:
+        return jsonify({'error': f'months must be between 1 and {MAX_CALENDAR_MONTHS}'}), 400
+    
+    calendar_months = get_calendar_months(year, month, months)
+    range_start = calendar_months[0][2]
+    range_end = calendar_months[-1][3]
+    
+    # Collect only the dates that have data instead of probing every day
+    calendar_days = {}
+    for date_str, rolls in attendance_images.items():
+        if range_start <= date_str <= range_end and roll_number in rolls:
+            calendar_days[date_str] = 'uploaded'
+    for date_str, rolls in student_attendance.items():
+        if range_start <= date_str <= range_end and roll_number in rolls:
+            calendar_days[date_str] = 'present'
+    
+    month_entries = []
+    for entry_year, entry_month, start_date, end_date in calendar_months:
+        days = sorted(d for d in calendar_days if start_date <= d <= end_date)
+        month_entries.append({
+            'year': entry_year,
+            'month': entry_month,
+            'present_dates': [d for d in days if calendar_days[d] == 'present'],
+            'uploaded_dates': [d for d in days if calendar_days[d] == 'uploaded']
+        })
     
-    return jsonify({
-        'present_dates': present_dates,
-        'uploaded_dates': uploaded_dates,
+    response = {
+        'present_dates': [d for entry in month_entries for d in entry['present_dates']],
+        'uploaded_dates': [d for entry in month_entries for d in entry['uploaded_dates']],
         'year': year,
         'month': month
-    })
+    }
+    if months > 1:
+        response['months'] = month_entries
+    return jsonify(response)
 
 @app.route('/')
 def index():
@@ -1,12 +1,24 @@
-from flask import Flask, request, jsonify, session, redirect, url_for
+from flask import Flask, request, jsonify, session, redirect, url_for, Response
 from flask_cors import CORS
 from flask import render_template
 from datetime import datetime, timedelta
+import hashlib
 import os
-import base64
-import io
 from dotenv import load_dotenv
-from database import db
+from database import db, STUDENT_COLUMNS
+from async_database import async_db, run_async
+from login_lookup import match_student_login
+from audit_log import wants_page, parse_log_query, encode_cursor
+from log_writer import audit_log_writer
+from attendance_jobs import create_attendance_job_runner, new_job_id
+from blob_store import blob_store, guess_mimetype, decode_image_b64
+from uploads import UploadError, check_upload_size, read_image_upload, read_image_uploads, read_b64_image
+from image_ingest import IMAGE_SIZES, THUMB, ingest_image, get_thumbnail, normalize_image, store_normalized
+from verification_engine import encode_embedding, decode_embedding
+from verification_executor import create_verification_executor
+from ai_capabilities import ai_registry, preload_enabled
+from phash_index import ReplayIndex
+from cache import QueryCache
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +27,35 @@ app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'supersecretkey')  # Use environment variable
 CORS(app, supports_credentials=True)
 
+# Verification runs in warm worker processes (VERIFICATION_WORKERS, 0 = inline)
+verification_executor = create_verification_executor(
+    brightness_range=(20, 235), min_contrast=5, face_threshold=0.7, phash_match_threshold=20
+)
+
+@app.before_request
+def start_background_workers():
+    """Start the audit log writer and (warm) verification workers once this process serves requests.
+
+    Not done at import: verification workers import this module again and
+    must neither start a pool while they bootstrap nor replay audit log spills.
+    """
+    audit_log_writer.start()
+    verification_executor.start(preload=preload_enabled())
+
+# The web process itself only needs numpy (face embeddings, class galleries)
+if preload_enabled():
+    ai_registry.preload_in_background(['numpy'])
+
+# Today's submitted photo phashes, for spotting one photo reused by several students
+replay_index = ReplayIndex(db.get_attendance_phashes)
+
+# Background threads for asynchronous attendance uploads (?async=1)
+attendance_jobs = create_attendance_job_runner(db.update_attendance_job)
+
+# Rejections by (roll, date, SHA-256 of the uploaded bytes), so a retry with the
+# same photo gets the earlier verdict without another attempt; kept until midnight
+verification_results = QueryCache({}, max_entries=int(os.getenv('VERIFICATION_CACHE_MAX_ENTRIES', '2048')))
+
 # Available classes (K-12)
 AVAILABLE_CLASSES = ['K', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
 
@@ -22,6 +63,9 @@ AVAILABLE_CLASSES = ['K', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11
 @app.after_request
 def add_cache_headers(response):
     """Add cache-busting headers to prevent caching issues"""
+    if request.path.startswith('/api/images/'):
+        # Content-addressed images never change
+        return response
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -64,212 +108,32 @@ def calculate_grade(marks):
 
 # -------- Face matching helpers (optional AI) --------
 
-def _strip_data_url_prefix(data_url: str) -> str:
-    """Remove any data URL prefix from a base64 image string."""
-    if not data_url:
-        return data_url
-    prefix_sep = 'base64,'
-    if prefix_sep in data_url:
-        return data_url.split(prefix_sep, 1)[1]
-    return data_url
-
+def _profile_face_embedding(image_raw):
+    """Encoded face embedding for new profile picture bytes, or None (no face / AI unavailable)"""
+    encoding = verification_executor.face_embedding(image_raw)
+    return encode_embedding(encoding) if encoding is not None else None
 
-def _get_face_encoding_from_b64(b64_data: str):
-    """Return one face encoding from a base64 image, or None.
-    Tries to import face_recognition lazily.
-    """
-    try:
-        import face_recognition  # type: ignore
-    except Exception as e:
-        print(f"Face recognition library not available: {e}")
-        return None
+def _requested_image_size():
+    """The ?size= of an image request: 'full' (default) or 'thumb'; None if invalid"""
+    size = request.args.get('size', 'full')
+    return size if size in IMAGE_SIZES else None
 
-    try:
-        raw = base64.b64decode(_strip_data_url_prefix(b64_data))
-        image = face_recognition.load_image_file(io.BytesIO(raw))
-        encodings = face_recognition.face_encodings(image)
-        if not encodings:
-            print("No faces detected in image")
-            return None
-        print(f"Found {len(encodings)} face(s) in image")
-        return encodings[0]
-    except Exception as e:
-        print(f"Error getting face encoding: {e}")
-        return None
+# Longest range the attendance calendar serves in one response (one academic year)
+MAX_CALENDAR_MONTHS = 12
 
+def get_calendar_months(year, month, months=1):
+    """List (year, month, start_date, end_date) for consecutive months.
 
-def _faces_match(profile_b64: str, capture_b64: str, threshold: float = 0.7):
-    """Compare two base64 images via face_recognition when available.
-
-    Returns True/False if computed, or None if AI lib unavailable.
+    `month` is 0-based to match the calendar UI.
     """
-    try:
-        import face_recognition  # type: ignore
-    except Exception:
-        # Try a weak fallback using perceptual hash if PIL+imagehash exist
-        try:
-            from PIL import Image  # type: ignore
-            import imagehash  # type: ignore
-            prof_raw = base64.b64decode(_strip_data_url_prefix(profile_b64))
-            cap_raw = base64.b64decode(_strip_data_url_prefix(capture_b64))
-            prof_img = Image.open(io.BytesIO(prof_raw)).convert('L').resize((256, 256))
-            cap_img = Image.open(io.BytesIO(cap_raw)).convert('L').resize((256, 256))
-            h1 = imagehash.phash(prof_img)
-            h2 = imagehash.phash(cap_img)
-            # Smaller distance implies higher similarity; threshold chosen conservatively
-            hash_distance = h1 - h2
-            print(f"Perceptual hash distance: {hash_distance}")
-            return hash_distance <= 20  # Much more lenient threshold
-        except Exception as e:
-            print(f"Perceptual hash fallback failed: {e}")
-            return None
-
-    enc_profile = _get_face_encoding_from_b64(profile_b64)
-    enc_capture = _get_face_encoding_from_b64(capture_b64)
-    
-    if enc_profile is None:
-        print("No face detected in profile picture")
-        return False
-    if enc_capture is None:
-        print("No face detected in captured image")
-        return False
-        
-    distance = face_recognition.face_distance([enc_profile], enc_capture)[0]
-    print(f"Face recognition distance: {distance}, threshold: {threshold}")
-    return bool(distance <= threshold)
-
-
-def _enhanced_image_verification(image_data: str, roll_number: int):
-    """Enhanced image verification using multiple AI techniques when face recognition is unavailable.
-    
-    Returns a dict with 'verified' (bool), 'method' (str), and 'reason' (str) keys.
-    """
-    try:
-        import cv2
-        import numpy as np
-        from PIL import Image
-        import imagehash
-    except ImportError:
-        return {
-            'verified': False,
-            'method': 'none',
-            'reason': 'ai_libraries_unavailable'
-        }
-    
-    try:
-        # Decode base64 image
-        raw_data = base64.b64decode(_strip_data_url_prefix(image_data))
-        image = Image.open(io.BytesIO(raw_data))
-        
-        # Convert to OpenCV format for analysis
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        
-        # Method 1: Face detection using OpenCV
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        if len(faces) > 0:
-            # Face detected - this is likely a valid attendance photo
-            print(f"OpenCV detected {len(faces)} face(s)")
-            return {
-                'verified': True,
-                'method': 'opencv_face_detection',
-                'reason': 'face_detected'
-            }
-        
-        # Method 2: Image quality and content analysis
-        # Check if image has reasonable size and quality
-        height, width = gray.shape
-        if height < 100 or width < 100:
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'image_too_small'
-            }
-        
-        # Check image brightness and contrast
-        mean_brightness = np.mean(gray)
-        std_brightness = np.std(gray)
-        
-        print(f"Image brightness: {mean_brightness:.1f}, contrast: {std_brightness:.1f}")
-        
-        if mean_brightness < 20 or mean_brightness > 235:  # More lenient brightness range
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'poor_lighting'
-            }
-        
-        if std_brightness < 5:  # More lenient contrast requirement
-            return {
-                'verified': False,
-                'method': 'image_quality_check',
-                'reason': 'low_contrast'
-            }
-        
-        # Method 3: Check if image appears to be a selfie/portrait
-        # Look for skin tone detection and reasonable aspect ratio
-        aspect_ratio = width / height
-        if 0.5 <= aspect_ratio <= 2.0:  # Reasonable portrait/selfie ratio
-            # Convert to HSV for skin tone detection
-            hsv = cv2.cvtColor(cv_image, cv2.COLOR_BGR2HSV)
-            
-            # Define skin tone range
-            lower_skin = np.array([0, 20, 70], dtype=np.uint8)
-            upper_skin = np.array([20, 255, 255], dtype=np.uint8)
-            
-            skin_mask = cv2.inRange(hsv, lower_skin, upper_skin)
-            skin_pixels = cv2.countNonZero(skin_mask)
-            total_pixels = height * width
-            skin_percentage = (skin_pixels / total_pixels) * 100
-            
-            if skin_percentage > 5:  # At least 5% of image contains skin tones
-                return {
-                    'verified': True,
-                    'method': 'skin_tone_analysis',
-                    'reason': 'likely_human_photo'
-                }
-        
-        # Method 4: Perceptual hash comparison with previous attendance images
-        # This is a fallback that checks if the image is similar to previous attendance photos
-        try:
-            # Get previous attendance images for this student
-            previous_images = db.get_student_attendance_images(roll_number, limit=5)
-            
-            if previous_images:
-                current_hash = imagehash.phash(image)
-                
-                for prev_image_data in previous_images:
-                    if prev_image_data:
-                        prev_raw = base64.b64decode(_strip_data_url_prefix(prev_image_data))
-                        prev_image = Image.open(io.BytesIO(prev_raw))
-                        prev_hash = imagehash.phash(prev_image)
-                        
-                        # Check similarity
-                        hash_distance = current_hash - prev_hash
-                        if hash_distance <= 15:  # Similar image threshold
-                            return {
-                                'verified': True,
-                                'method': 'perceptual_hash_comparison',
-                                'reason': 'similar_to_previous_attendance'
-                            }
-        except Exception:
-            pass  # Skip this method if it fails
-        
-        # If all methods fail, require manual verification
-        return {
-            'verified': False,
-            'method': 'enhanced_verification',
-            'reason': 'no_verification_criteria_met'
-        }
-        
-    except Exception as e:
-        return {
-            'verified': False,
-            'method': 'enhanced_verification',
-            'reason': f'verification_error: {str(e)}'
-        }
+    from calendar import monthrange
+    result = []
+    for offset in range(months):
+        y, m = divmod(month + offset, 12)
+        y += year
+        _, days_in_month = monthrange(y, m + 1)  # monthrange uses 1-based months
+        result.append((y, m, f"{y}-{m+1:02d}-01", f"{y}-{m+1:02d}-{days_in_month:02d}"))
+    return result
 
 def get_teacher_class(username):
     """Get the class assigned to a teacher"""
@@ -286,25 +150,33 @@ def require_login(f):
     return decorated
 
 def convert_db_student_to_app_format(db_student):
-    """Convert database student format to app format"""
-    return {
+    """Convert database student format to app format.
+
+    Works with any STUDENT_COLUMNS projection: unselected columns come back
+    as None, except password and profile_picture, which are left out.
+    """
+    app_student = {
         'id': db_student['id'],
         'name': db_student['name'],
-        'age': db_student['age'],
+        'age': db_student.get('age'),
         'class': db_student['class'],
         'roll': db_student['roll'],
-        'password': db_student['password'],
         'marks': {
-            'math': db_student['math_marks'],
-            'science': db_student['science_marks'],
-            'history': db_student['history_marks'],
-            'english': db_student['english_marks']
+            'math': db_student.get('math_marks'),
+            'science': db_student.get('science_marks'),
+            'history': db_student.get('history_marks'),
+            'english': db_student.get('english_marks')
         },
-        'profile_picture': db_student.get('profile_picture'),
         'has_profile_picture': db_student.get('has_profile_picture', False),
-        'addedBy': db_student['added_by'],
-        'timestamp': db_student['timestamp']
+        'addedBy': db_student.get('added_by'),
+        'timestamp': db_student.get('timestamp')
     }
+    # Only present in the 'auth' / 'full' projections
+    if 'password' in db_student:
+        app_student['password'] = db_student['password']
+    if 'profile_picture' in db_student:
+        app_student['profile_picture'] = db_student['profile_picture']
+    return app_student
 
 def convert_app_student_to_db_format(app_student):
     """Convert app student format to database format"""
@@ -354,18 +226,22 @@ def student_login():
     data = request.get_json()
     first_name = data.get('first_name')
     password = data.get('password')
+    roll = data.get('roll')  # Optional, disambiguates students sharing a first name
     
     print(f"Student login attempt: {first_name}")
     
-    # Get all students and find by first name (case-insensitive)
-    students = db.get_students()
-    student = None
-    for s in students:
-        if s['name'].split()[0].lower() == first_name.lower():
-            student = s
-            break
+    # Indexed lookup on first_name_lower (case-insensitive)
+    candidates = db.get_students_by_first_name(first_name or '')
+    student, reason = match_student_login(candidates, password, roll)
     
-    if student and student.get('password') == password:
+    if reason == 'ambiguous_first_name':
+        print(f"Ambiguous student login for: {first_name}")
+        return jsonify({
+            'error': 'More than one student matches this first name and password. Please also enter your roll number.',
+            'reason': reason
+        }), 409
+    
+    if student:
         print(f"Student found: {student['name']} (Roll: {student['roll']})")
         session['user'] = f"student_{student['roll']}"
         session['role'] = 'student'
@@ -389,7 +265,30 @@ def student_login():
 @app.route('/api/student/attendance', methods=['POST'])
 @require_login
 def mark_attendance():
-    """Upload student attendance image with AI verification - 3 attempts max"""
+    """Upload student attendance image (base64 JSON) with AI verification - 3 attempts max"""
+    data = request.get_json() or {}
+    image_data = data.get('image_data')  # Base64 encoded image
+    async_mode = request.args.get('async') == '1' or bool(data.get('async'))
+    return _mark_attendance(lambda: read_b64_image(image_data), async_mode)
+
+
+@app.route('/api/student/attendance/upload', methods=['POST'])
+@require_login
+def mark_attendance_upload():
+    """Upload student attendance image as multipart/form-data (field "image") or a raw image/jpeg body"""
+    try:
+        check_upload_size(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return _mark_attendance(lambda: read_image_upload(request), request.args.get('async') == '1')
+
+
+def _mark_attendance(read_image, async_mode=False):
+    """Shared body of the attendance upload routes.
+
+    `read_image` returns the raw upload bytes (raising UploadError); it is
+    called only once the student is known to have attempts left.
+    """
     if session['role'] != 'student':
         return jsonify({'error': 'Permission denied. Only students can upload attendance.'}), 403
     
@@ -399,15 +298,11 @@ def mark_attendance():
     
     today = datetime.now().strftime('%Y-%m-%d')
     
-    # Get image data from request
-    data = request.get_json()
-    image_data = data.get('image_data')  # Base64 encoded image
-    
-    if not image_data:
-        return jsonify({'error': 'Image data is required'}), 400
+    # Fetch today's attendance, attempts and profile picture concurrently
+    context = run_async(async_db.gather_student_context(roll_number, today))
     
     # Check if student already has attendance for today
-    existing_attendance = db.get_student_attendance(roll_number, today, today)
+    existing_attendance = context['attendance']
     
     if existing_attendance and existing_attendance[0]['is_present']:
         return jsonify({
@@ -417,7 +312,7 @@ def mark_attendance():
         }), 400
     
     # Check attempts remaining
-    attempts_info = db.get_attendance_attempts(roll_number, today)
+    attempts_info = context['attempts']
     attempts_remaining = 3
     if attempts_info and attempts_info.get('attempts_remaining') is not None:
         attempts_remaining = attempts_info['attempts_remaining']
@@ -429,78 +324,244 @@ def mark_attendance():
             'message': '❌ You have used all 3 attempts for today. Please contact your principal for manual attendance marking.'
         }), 400
     
+    try:
+        image_raw = read_image()
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    # The exact same photo as an earlier attempt today gets that attempt's verdict
+    upload_digest = hashlib.sha256(image_raw).hexdigest()
+    found, cached_result = verification_results.get(('verification', roll_number, today, upload_digest))
+    if found:
+        return jsonify(_cached_attendance_response(roll_number, today, cached_result, attempts_remaining))
+    
+    if async_mode:
+        return _submit_attendance_job(roll_number, today, image_raw, context, upload_digest)
+    
+    # Normalize once; verification sees the same upright, size-capped image that is stored
+    image_hash, image_raw = ingest_image(image_raw)
+    result = _verify_attendance_upload(roll_number, today, image_raw, image_hash, context, session['user'], upload_digest)
+    if result is None:
+        return jsonify({'error': 'Failed to record attendance attempt'}), 500
+    return jsonify(result)
+
+
+def _submit_attendance_job(roll_number, today, image_raw, context, upload_digest=None):
+    """Store the upload, queue its verification and answer 202 with the job id.
+
+    One job per student per day may be queued or running, so an attempt is
+    only counted (by the worker, through record_attendance_attempt) after
+    the previous upload has been verified.
+    """
+    db.expire_attendance_jobs(roll_number, today, attendance_jobs.stale_before())
+    active_job = db.get_active_attendance_job(roll_number, today)
+    if active_job:
+        return jsonify({
+            'success': False,
+            'reason': 'verification_in_progress',
+            'job_id': active_job['id'],
+            'message': '⏳ Your previous photo is still being verified.'
+        }), 409
+    
+    job_id = new_job_id()
+    image_hash, image_raw = ingest_image(image_raw)
+    if not db.create_attendance_job(job_id, roll_number, today, image_hash, session['user']):
+        return jsonify({'error': 'Failed to queue attendance verification'}), 500
+    
+    attendance_jobs.submit(job_id, _run_attendance_job, job_id, roll_number, today, image_raw, image_hash, context, session['user'], upload_digest)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/student/attendance/status/{job_id}',
+        'message': '⏳ Photo received. Verifying your attendance...'
+    }), 202
+
+
+def _run_attendance_job(job_id, roll_number, today, image_raw, image_hash, context, who, upload_digest=None):
+    """Background body of an attendance job; its return value is the job result"""
+    result = _verify_attendance_upload(roll_number, today, image_raw, image_hash, context, who, upload_digest, job_id)
+    if result is None:
+        raise RuntimeError('Failed to record attendance attempt')
+    return result
+
+
+def _verify_attendance_upload(roll_number, today, image_raw, image_hash, context, who, upload_digest=None, job_id=None):
+    """Verify a stored upload, record the attempt and log it.
+
+    `upload_digest` (SHA-256 of the bytes as uploaded) keys the verdict in
+    verification_results. For an asynchronous upload `job_id` is its job:
+    if that was expired as abandoned meanwhile, nothing is recorded.
+    Returns the response body for the student, or None if the attempt
+    could not be recorded.
+    """
     # Perform AI verification
-    verification_result = _perform_attendance_verification(image_data, roll_number)
+    verification_result, image_phash = _perform_attendance_verification(
+        image_raw, roll_number, context['profile'], today, context['previous_phashes']
+    )
+    
+    # The student was already told an expired job failed and may have retried
+    if job_id and not db.renew_attendance_job(job_id):
+        raise RuntimeError('Job expired before its attempt was recorded')
     
     # Record the attempt
-    attempt_result = db.record_attendance_attempt(roll_number, today, image_data, verification_result)
+    attempt_result = db.record_stored_attendance_attempt(roll_number, today, image_hash, verification_result, image_phash)
     
     if not attempt_result:
-        return jsonify({'error': 'Failed to record attendance attempt'}), 500
+        return None
+    replay_index.add(today, roll_number, image_phash)
     
-    # Get updated attempts info
-    updated_attempts = db.get_attendance_attempts(roll_number, today)
-    remaining_after_attempt = updated_attempts.get('attempts_remaining', 0) if updated_attempts else 0
+    # Only rejections are reused: a verified photo already marked the student
+    # present, and "try later" verdicts (pool busy / timed out) say nothing
+    # about the photo
+    if (upload_digest and not verification_result['verified']
+            and verification_result.get('reason') != 'manual_verification_required'):
+        verification_results.set(('verification', roll_number, today, upload_digest), verification_result,
+                                 ttl=_seconds_until_midnight())
+    
+    # The written row already carries the updated attempt count
+    remaining_after_attempt = attempt_result.get('attempts_remaining', 0)
     
     # Log the attempt
-    db.add_log_entry('attendance_attempt', {
+    audit_log_writer.log('attendance_attempt', {
         'student_roll': roll_number,
         'date': today,
         'verification_result': verification_result,
         'attempts_remaining': remaining_after_attempt
+    }, who)
+    
+    return _attendance_response(verification_result, remaining_after_attempt)
+
+
+def _cached_attendance_response(roll_number, today, verification_result, attempts_remaining):
+    """Answer a retry with an already rejected photo: no new attempt, flagged as cached"""
+    audit_log_writer.log('attendance_attempt', {
+        'student_roll': roll_number,
+        'date': today,
+        'verification_result': verification_result,
+        'attempts_remaining': attempts_remaining,
+        'cached': True
     }, session['user'])
     
+    result = _attendance_response(verification_result, attempts_remaining)
+    result['cached'] = True
+    result['message'] = (f'❌ Verification failed: {verification_result["reason"]}. This photo was already checked, '
+                         f'so no attempt was used. Please take a new photo. {attempts_remaining} attempts remaining.')
+    return result
+
+
+def _attendance_response(verification_result, attempts_remaining):
+    """Response body for an attendance upload once it has been verified"""
     if verification_result['verified']:
         # AI verification succeeded
-        return jsonify({
+        return {
             'success': True,
             'auto_present': True,
-            'attempts_remaining': remaining_after_attempt,
+            'attempts_remaining': attempts_remaining,
             'message': f'✅ Attendance verified successfully by {verification_result["method"]}!'
-        })
+        }
+    
+    # AI verification failed
+    if attempts_remaining <= 0:
+        message = f'❌ Verification failed: {verification_result["reason"]}. You have used all 3 attempts. Please contact your principal.'
     else:
-        # AI verification failed
-        if remaining_after_attempt <= 0:
-            message = f'❌ Verification failed: {verification_result["reason"]}. You have used all 3 attempts. Please contact your principal.'
-        else:
-            message = f'❌ Verification failed: {verification_result["reason"]}. {remaining_after_attempt} attempts remaining.'
-        
+        message = f'❌ Verification failed: {verification_result["reason"]}. {attempts_remaining} attempts remaining.'
+    
+    return {
+        'success': True,
+        'auto_present': False,
+        'attempts_remaining': attempts_remaining,
+        'reason': verification_result.get('reason', 'verification_failed'),
+        'message': message
+    }
+
+
+def _seconds_until_midnight():
+    now = datetime.now()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+@app.route('/api/student/attendance/status/<job_id>', methods=['GET'])
+@require_login
+def get_attendance_job_status(job_id):
+    """Poll an asynchronous attendance upload.
+
+    While the job is queued or running this answers 202; once it is done
+    the body is what the synchronous upload would have returned.
+    """
+    job = db.get_attendance_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if session['role'] == 'student' and job['student_roll'] != session.get('student_roll'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    if job['status'] in ('queued', 'running') and db.expire_attendance_jobs(job['student_roll'], job['date'], attendance_jobs.stale_before()):
+        job = db.get_attendance_job(job_id)
+    
+    if job['status'] == 'done':
+        return jsonify({'job_id': job_id, 'status': 'done', **(job.get('result') or {})})
+    if job['status'] == 'failed':
         return jsonify({
-            'success': True,
-            'auto_present': False,
-            'attempts_remaining': remaining_after_attempt,
-            'reason': verification_result.get('reason', 'verification_failed'),
-            'message': message
-        }), 200
+            'job_id': job_id,
+            'status': 'failed',
+            'success': False,
+            'reason': 'verification_failed',
+            'message': '❌ Your photo could not be verified. Please try again.'
+        })
+    return jsonify({'job_id': job_id, 'status': job['status']}), 202
 
 
-def _perform_attendance_verification(image_data, roll_number):
-    """Perform comprehensive attendance verification"""
+def _perform_attendance_verification(image_raw, roll_number, profile_info=None, date=None, previous_phashes=None):
+    """Perform comprehensive attendance verification of raw upload bytes.
+
+    Returns (verification_result, image_phash).
+    """
     # Check if student has a saved profile picture for AI verification
-    profile_info = db.get_profile_picture(roll_number)
-    profile_b64 = None
-    if profile_info and profile_info.get('has_profile_picture'):
-        profile_b64 = profile_info.get('profile_picture')
-
-    # AI-powered automatic attendance verification
-    if profile_b64:
-        match = _faces_match(profile_b64, image_data)
-        if match is True:
-            return {
-                'verified': True,
-                'method': 'ai_face_recognition',
-                'reason': 'face_match_success'
-            }
-        elif match is False:
-            return {
-                'verified': False,
-                'method': 'ai_face_recognition',
-                'reason': 'face_mismatch'
-            }
-        # match is None -> AI unavailable: fall through to enhanced verification
-
-    # Enhanced verification when AI is unavailable or no profile picture
-    return _enhanced_image_verification(image_data, roll_number)
+    if profile_info is None:
+        profile_info = db.get_student_by_roll(roll_number, columns='face')
+    has_profile_picture = bool(profile_info and profile_info.get('has_profile_picture'))
+
+    profile_encoding = None
+    profile_image = None
+    profile_hash = None
+    if has_profile_picture:
+        profile_encoding = decode_embedding(profile_info.get('face_embedding'))
+        if profile_encoding is None:
+            # No stored embedding yet (picture predates embeddings, or no AI
+            # when it was uploaded): the worker computes it and we keep it
+            profile_data = db.get_profile_picture(roll_number)
+            if profile_data and profile_data.get('profile_picture'):
+                profile_image = decode_image_b64(profile_data['profile_picture'])
+                profile_hash = profile_data.get('profile_picture_hash')
+
+    if previous_phashes is None:
+        previous_phashes = db.get_student_attendance_phashes(roll_number, limit=5)
+
+    outcome = verification_executor.verify(
+        image_raw,
+        has_profile_picture=has_profile_picture,
+        profile_encoding=profile_encoding,
+        profile_image=profile_image,
+        previous_phashes=previous_phashes
+    )
+    if outcome['profile_encoding'] is not None:
+        # Skipped by the database if the picture was replaced while verifying
+        db.update_face_embedding(roll_number, encode_embedding(outcome['profile_encoding']), profile_hash)
+
+    # A near-identical photo already submitted today by another student is a replay
+    image_phash = outcome['image_phash']
+    replay = replay_index.find_replay(date, roll_number, image_phash) if date else None
+    if replay:
+        print(f"Replay detected: roll {roll_number} photo matches roll {replay['student_roll']} (distance {replay['distance']})")
+        return {
+            'verified': False,
+            'method': 'replay_detection',
+            'reason': 'duplicate_of_another_submission',
+            'matched_roll': replay['student_roll']
+        }, image_phash
+
+    return outcome['result'], image_phash
 
 @app.route('/api/student/attendance', methods=['GET'])
 @require_login
@@ -528,9 +589,9 @@ def get_student_attendance():
         attendance_history.append({
             'date': record['date'],
             'attended': record['is_present'],
-            'uploaded': record['image_data'] is not None
+            'uploaded': db.has_image(record)
         })
-        print(f"Record: {record['date']} - Present: {record['is_present']} - Has Image: {record['image_data'] is not None}")
+        print(f"Record: {record['date']} - Present: {record['is_present']} - Has Image: {db.has_image(record)}")
     
     return jsonify(attendance_history)
 
@@ -546,7 +607,7 @@ def get_student_grades():
         return jsonify({'error': 'Student roll number not found'}), 400
     
     # Find the student
-    student = db.get_student_by_roll(roll_number)
+    student = db.get_student_by_roll(roll_number, columns='grades')
     
     if not student:
         return jsonify({'error': 'Student not found'}), 404
@@ -594,7 +655,11 @@ def get_profile_picture_status():
     if not roll_number:
         return jsonify({'error': 'Student roll number not found'}), 400
     
-    profile_data = db.get_profile_picture(roll_number)
+    size = _requested_image_size()
+    if size is None:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
+    profile_data = db.get_profile_picture(roll_number, size)
     
     if profile_data:
         return jsonify({
@@ -607,7 +672,26 @@ def get_profile_picture_status():
 @app.route('/api/student/profile-picture', methods=['POST'])
 @require_login
 def upload_profile_picture():
-    """Upload student's profile picture"""
+    """Upload student's profile picture (base64 JSON)"""
+    data = request.json
+    
+    if not data or 'profile_picture' not in data:
+        return jsonify({'error': 'Profile picture data is required'}), 400
+    
+    return _upload_profile_picture(lambda: read_b64_image(data['profile_picture']))
+
+@app.route('/api/student/profile-picture/upload', methods=['POST'])
+@require_login
+def upload_profile_picture_binary():
+    """Upload student's profile picture as multipart/form-data (field "image") or a raw image/jpeg body"""
+    try:
+        check_upload_size(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return _upload_profile_picture(lambda: read_image_upload(request))
+
+def _upload_profile_picture(read_image):
+    """Shared body of the profile picture upload routes"""
     if session['role'] != 'student':
         return jsonify({'error': 'Permission denied. Only students can upload profile pictures.'}), 403
     
@@ -615,19 +699,19 @@ def upload_profile_picture():
     if not roll_number:
         return jsonify({'error': 'Student roll number not found'}), 400
     
-    data = request.json
-    
-    if not data or 'profile_picture' not in data:
-        return jsonify({'error': 'Profile picture data is required'}), 400
-    
-    profile_picture = data['profile_picture']
+    try:
+        image_raw = read_image()
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     
-    # Update profile picture
-    result = db.update_profile_picture(roll_number, profile_picture)
+    # Update profile picture, with its face embedding so verification only encodes captures
+    # Stored upright and size-capped, with a thumbnail; the embedding is computed from what is stored
+    image_hash, image_raw = ingest_image(image_raw)
+    result = db.update_stored_profile_picture(roll_number, image_hash, _profile_face_embedding(image_raw))
     
     if result:
         # Log the action
-        db.add_log_entry('upload_profile_picture', {
+        audit_log_writer.log('upload_profile_picture', {
             'student_roll': roll_number
         }, f'student_{roll_number}')
         
@@ -641,7 +725,11 @@ def get_student_profile_picture(roll_number):
     if session['role'] not in ['teacher', 'principal']:
         return jsonify({'error': 'Permission denied. Only teachers and principals can view profile pictures.'}), 403
     
-    profile_data = db.get_profile_picture(roll_number)
+    size = _requested_image_size()
+    if size is None:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
+    profile_data = db.get_profile_picture(roll_number, size)
     
     if profile_data and profile_data['has_profile_picture']:
         return jsonify({
@@ -670,14 +758,14 @@ def get_teacher_students():
     if not teacher_class:
         return jsonify({'error': 'Teacher class not found'}), 404
     
-    # Get all students and filter by teacher's class
-    all_students = db.get_students()
-    class_students = [s for s in all_students if s['class'] == teacher_class]
+    # Fetch the roster and its attendance window in two queries
+    today = datetime.now().strftime('%Y-%m-%d')
+    roster = db.get_class_roster(teacher_class, today)
     
     # Convert to app format and add grades
     result_students = []
-    for student in class_students:
-        app_student = convert_db_student_to_app_format(student)
+    for entry in roster:
+        app_student = convert_db_student_to_app_format(entry['student'])
         
         # Add grades
         app_student['grades'] = {
@@ -697,53 +785,13 @@ def get_teacher_students():
             app_student['average_marks'] = None
             app_student['overall_grade'] = 'N/A'
         
-        # Add attendance data
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_attendance = db.get_student_attendance(student['roll'], today, today)
-        
-        if today_attendance:
-            app_student['attendance_today'] = today_attendance[0]['is_present']
-            app_student['has_attendance_image'] = today_attendance[0]['image_data'] is not None
-            app_student['attendance_verified'] = today_attendance[0]['verified_by'] is not None
-            app_student['attendance_date'] = today_attendance[0]['date']
-        else:
-            # Check for any unverified attendance images in the last 7 days
-            end_date = datetime.now().strftime('%Y-%m-%d')
-            start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-            recent_attendance = db.get_student_attendance(student['roll'], start_date, end_date)
-            
-            unverified_with_image = [a for a in recent_attendance if a['image_data'] and not a['verified_by']]
-            
-            if unverified_with_image:
-                # Use the most recent unverified attendance
-                latest_unverified = unverified_with_image[0]
-                app_student['attendance_today'] = False
-                app_student['has_attendance_image'] = True
-                app_student['attendance_verified'] = False
-                app_student['attendance_date'] = latest_unverified['date']
-            else:
-                app_student['attendance_today'] = False
-                app_student['has_attendance_image'] = False
-                app_student['attendance_verified'] = False
-                app_student['attendance_date'] = None
+        # Add attendance data (today, recent unverified image, 30-day percentage)
+        app_student.update(entry['attendance'])
         
         # Add simplified attendance status for compatibility
         app_student['attendance_attempts'] = 3  # Default for old schema
         app_student['attendance_status'] = 'present' if app_student['attendance_today'] else 'pending'
         
-        # Calculate attendance percentage for last 30 days
-        end_date = datetime.now().strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        attendance_records = db.get_student_attendance(student['roll'], start_date, end_date)
-        
-        present_count = sum(1 for record in attendance_records if record['is_present'])
-        total_days = len(attendance_records)
-        
-        if total_days > 0:
-            app_student['attendance_percentage'] = round((present_count / total_days) * 100, 1)
-        else:
-            app_student['attendance_percentage'] = 0
-        
         result_students.append(app_student)
     
     return jsonify(result_students)
@@ -762,7 +810,7 @@ def verify_attendance(roll_number):
     
     if result:
         # Log the action
-        db.add_log_entry('verify_attendance', {
+        audit_log_writer.log('verify_attendance', {
             'student_roll': roll_number,
             'date': today
         }, session['user'])
@@ -791,7 +839,7 @@ def override_attendance(roll_number):
     
     if result:
         # Log the action
-        db.add_log_entry('override_attendance', {
+        audit_log_writer.log('override_attendance', {
             'student_roll': roll_number,
             'date': date,
             'new_status': new_status,
@@ -806,6 +854,109 @@ def override_attendance(roll_number):
         return jsonify({'error': 'Failed to override attendance status'}), 500
 
 
+@app.route('/api/teacher/attendance/class-checkin', methods=['POST'])
+@require_login
+def class_checkin():
+    """Mark a class present from one to a few group photos (teachers and principals).
+
+    Multipart field "image" (repeatable). Every face is matched one-to-one
+    against the class's stored face embeddings; pass ?mark=0 to only report
+    matches. Students already present that day are listed in already_present
+    and their rows left as they are. Attempt counters are not touched.
+    """
+    if session['role'] not in ['teacher', 'principal']:
+        return jsonify({'error': 'Permission denied. Only teachers and principals can check in a class.'}), 403
+
+    if session['role'] == 'teacher':
+        class_name = get_teacher_class(session['user'])
+        if not class_name:
+            return jsonify({'error': 'Teacher class not found'}), 404
+    else:
+        class_name = request.args.get('class') or request.form.get('class')
+        if not class_name:
+            return jsonify({'error': 'class is required'}), 400
+
+    try:
+        uploads = read_image_uploads(request)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+    students = []
+    embeddings = []
+    without_embedding = []
+    for student in db.get_class_students(class_name, columns='gallery'):
+        encoding = decode_embedding(student.get('face_embedding'))
+        if encoding is None:
+            without_embedding.append(student['roll'])
+        else:
+            students.append(student)
+            embeddings.append(encoding)
+    if not students:
+        return jsonify({'error': 'No student in this class has a profile picture with a detectable face'}), 404
+
+    np = ai_registry.get('numpy')
+    if np is None:
+        return jsonify({'error': 'Face recognition is not available on this server'}), 503
+
+    # Matched upright and size-capped like any attendance photo, but only
+    # stored once a row is marked with it
+    normalized = [normalize_image(raw) for raw in uploads]
+    frames = [image for image, _ in normalized]
+    outcome = verification_executor.match_class(frames, np.stack(embeddings).astype(np.float32))
+    if outcome is None:
+        return jsonify({'error': 'Class check-in timed out. Please try again with fewer photos.'}), 503
+    if not outcome['available']:
+        return jsonify({'error': 'Face recognition is not available on this server'}), 503
+
+    matched = []
+    for gallery_index, match in sorted(outcome['matches'].items()):
+        student = students[gallery_index]
+        matched.append({
+            'roll': student['roll'],
+            'name': student['name'],
+            'frame': match['frame'],
+            'distance': round(match['distance'], 4)
+        })
+    matched_rolls = {entry['roll'] for entry in matched}
+
+    marked = []
+    already_present = []
+    if matched and request.args.get('mark', '1') != '0':
+        today = datetime.now().strftime('%Y-%m-%d')
+        # Students already present keep their own photo; their frames need not be stored
+        present = {row['student_roll'] for row in db.get_attendance_for_rolls(matched_rolls, today, today) if row['is_present']}
+        already_present = sorted(present & matched_rolls)
+        to_mark = [entry for entry in matched if entry['roll'] not in present]
+        frame_hashes = {frame: store_normalized(*normalized[frame]) for frame in {entry['frame'] for entry in to_mark}}
+        rows = db.mark_attendance_batch(
+            [entry['roll'] for entry in to_mark], today, session['user'],
+            {entry['roll']: frame_hashes[entry['frame']] for entry in to_mark}
+        )
+        marked = sorted(row['student_roll'] for row in rows)
+        audit_log_writer.log('class_checkin', {
+            'class': class_name,
+            'date': today,
+            'frames': len(frames),
+            'faces_detected': outcome['faces'],
+            'unmatched_faces': outcome['unmatched_faces'],
+            'marked': marked,
+            'already_present': already_present
+        }, session['user'])
+
+    return jsonify({
+        'success': True,
+        'class': class_name,
+        'frames': len(frames),
+        'faces_detected': outcome['faces'],
+        'matched': matched,
+        'unmatched_faces': outcome['unmatched_faces'],
+        'students_without_embedding': without_embedding,
+        'not_seen': [student['roll'] for student in students if student['roll'] not in matched_rolls],
+        'marked': marked,
+        'already_present': already_present
+    })
+
+
 @app.route('/api/attendance/attempts/<int:roll_number>', methods=['GET'])
 @require_login
 def get_attendance_attempts(roll_number):
@@ -814,9 +965,10 @@ def get_attendance_attempts(roll_number):
         return jsonify({'error': 'Permission denied. Only teachers and principals can view attendance attempts.'}), 403
     
     date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    include_images = request.args.get('include_images', 'false').lower() == 'true'
     
-    # Get attendance attempts
-    attempts = db.get_attendance_attempts(roll_number, date)
+    # Get attendance attempts (metadata only unless images are requested)
+    attempts = db.get_attendance_attempts(roll_number, date, include_images=include_images)
     
     if attempts:
         return jsonify(attempts)
@@ -829,6 +981,31 @@ def get_attendance_attempts(roll_number):
             'attempt_history': []
         })
 
+@app.route('/api/attendance/attempts/<int:roll_number>/<int:attempt_number>/image', methods=['GET'])
+@require_login
+def get_attendance_attempt_image(roll_number, attempt_number):
+    """Get the image submitted with one attendance attempt (for teachers and principals)"""
+    if session['role'] not in ['teacher', 'principal']:
+        return jsonify({'error': 'Permission denied. Only teachers and principals can view attendance images.'}), 403
+    
+    date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    
+    size = _requested_image_size()
+    if size is None:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
+    image_data = db.get_attempt_image(roll_number, date, attempt_number, size)
+    
+    if image_data:
+        return jsonify({
+            'image_data': image_data,
+            'date': date,
+            'roll_number': roll_number,
+            'attempt_number': attempt_number
+        })
+    else:
+        return jsonify({'error': 'Attempt image not found'}), 404
+
 @app.route('/api/attendance/request-new/<int:roll_number>', methods=['POST'])
 @require_login
 def request_new_attendance_image(roll_number):
@@ -843,7 +1020,7 @@ def request_new_attendance_image(roll_number):
     
     if result:
         # Log the action
-        db.add_log_entry('request_new_image', {
+        audit_log_writer.log('request_new_image', {
             'student_roll': roll_number,
             'date': today
         }, session['user'])
@@ -859,8 +1036,12 @@ def get_attendance_image(date, roll_number):
     if session['role'] not in ['teacher', 'principal']:
         return jsonify({'error': 'Permission denied. Only teachers and principals can view attendance images.'}), 403
     
+    size = _requested_image_size()
+    if size is None:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
     # Get attendance image
-    image_data = db.get_attendance_image(roll_number, date)
+    image_data = db.get_attendance_image(roll_number, date, size)
     
     if image_data:
         return jsonify({
@@ -871,6 +1052,25 @@ def get_attendance_image(date, roll_number):
     else:
         return jsonify({'error': 'Attendance image not found'}), 404
 
+@app.route('/api/images/<digest>', methods=['GET'])
+@require_login
+def get_image_blob(digest):
+    """Serve a stored image (or with ?size=thumb its thumbnail) as raw bytes by its SHA-256 hash"""
+    size = _requested_image_size()
+    if size is None:
+        return jsonify({'error': 'size must be full or thumb'}), 400
+    
+    raw = get_thumbnail(digest) if size == THUMB else None
+    if raw is None:
+        raw = blob_store.get(digest)
+    if raw is None:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    response = Response(raw, mimetype=guess_mimetype(raw))
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    response.headers['ETag'] = f'{digest}-{size}'
+    return response
+
 @app.route('/api/teacher/students/<int:idx>', methods=['PUT'])
 @require_login
 def update_student_marks(idx):
@@ -883,12 +1083,31 @@ def update_student_marks(idx):
         return jsonify({'error': 'Teacher class not found'}), 404
     
     # Get all students and find by index
-    all_students = db.get_students()
+    all_students = db.get_students(columns='grades')
     if idx < 0 or idx >= len(all_students):
         return jsonify({'error': 'Student not found'}), 404
     
-    student = all_students[idx]
+    return _update_student_marks(all_students[idx], teacher_class)
+
+@app.route('/api/teacher/students/by-id/<int:student_id>', methods=['PUT'])
+@require_login
+def update_student_marks_by_id(student_id):
+    """Allow teachers to update marks for a student in their class, addressed by id"""
+    if session['role'] != 'teacher':
+        return jsonify({'error': 'Permission denied. Only teachers can update marks.'}), 403
     
+    teacher_class = get_teacher_class(session['user'])
+    if not teacher_class:
+        return jsonify({'error': 'Teacher class not found'}), 404
+    
+    student = db.get_student_by_id(student_id, columns='grades')
+    if not student or student.get('is_deleted'):
+        return jsonify({'error': 'Student not found'}), 404
+    
+    return _update_student_marks(student, teacher_class)
+
+def _update_student_marks(student, teacher_class):
+    """Update marks for a student row"""
     # Check if student is in teacher's class
     if student['class'] != teacher_class:
         return jsonify({'error': 'Permission denied. You can only update students in your class.'}), 403
@@ -925,7 +1144,7 @@ def update_student_marks(idx):
     
     if result:
         # Log the action
-        db.add_log_entry('update_marks', {
+        audit_log_writer.log('update_marks', {
             'student': convert_db_student_to_app_format(result),
             'original_marks': original_marks,
             'updated_marks': new_marks
@@ -974,7 +1193,7 @@ def add_teacher():
     
     if result:
         # Log the action
-        db.add_log_entry('add_teacher', {
+        audit_log_writer.log('add_teacher', {
             'teacher': result
         }, session['user'])
         
@@ -1007,7 +1226,7 @@ def change_teacher_password(username):
     
     if result:
         # Log the action
-        db.add_log_entry('change_teacher_password', {
+        audit_log_writer.log('change_teacher_password', {
             'teacher_username': username,
             'old_password': old_password,
             'new_password': new_password
@@ -1033,7 +1252,7 @@ def delete_teacher(username):
     
     if result:
         # Log the action
-        db.add_log_entry('delete_teacher', {
+        audit_log_writer.log('delete_teacher', {
             'teacher': teacher
         }, session['user'])
         
@@ -1045,7 +1264,12 @@ def delete_teacher(username):
 @app.route('/api/students', methods=['GET'])
 @require_login
 def get_students():
-    students = db.get_students()
+    # Column set to return; 'grades' covers the student list view
+    fields = request.args.get('fields', 'grades')
+    if fields not in STUDENT_COLUMNS:
+        return jsonify({'error': f'fields must be one of: {", ".join(STUDENT_COLUMNS)}'}), 400
+    
+    students = db.get_students(columns=fields)
     # Convert to app format
     app_students = [convert_db_student_to_app_format(s) for s in students]
     return jsonify(app_students)
@@ -1060,6 +1284,13 @@ def add_student():
     
     # Extract profile picture if provided
     profile_picture = data.get('profile_picture')
+    image_hash = None
+    if profile_picture:
+        # Stored upright and size-capped; the embedding is computed from what is stored
+        try:
+            image_hash, image_raw = ingest_image(read_b64_image(profile_picture))
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
     
     # Convert to database format
     db_student = convert_app_student_to_db_format(data)
@@ -1070,16 +1301,16 @@ def add_student():
     
     if result:
         # If profile picture was provided, update it
-        if profile_picture:
+        if image_hash:
             roll_number = db_student['roll']
-            db.update_profile_picture(roll_number, profile_picture)
+            db.update_stored_profile_picture(roll_number, image_hash, _profile_face_embedding(image_raw))
             print(f"Profile picture uploaded for student roll {roll_number}")
         
         # Convert back to app format for logging
         app_student = convert_db_student_to_app_format(result)
         
         # Log the action
-        db.add_log_entry('add', {
+        audit_log_writer.log('add', {
             'student': app_student,
             'has_profile_picture': bool(profile_picture)
         }, role)
@@ -1097,11 +1328,26 @@ def edit_student(idx):
     print(f"Edit student called for index {idx} by {username} ({role})")
     
     # Get all students and find by index
-    all_students = db.get_students()
+    all_students = db.get_students(columns='grades')
     if idx < 0 or idx >= len(all_students):
         return jsonify({'error': 'Not found'}), 404
     
-    student = all_students[idx]
+    return _edit_student(all_students[idx])
+
+@app.route('/api/students/by-id/<int:student_id>', methods=['PUT'])
+@require_login
+def edit_student_by_id(student_id):
+    print(f"Edit student called for id {student_id} by {session['user']} ({session['role']})")
+    
+    student = db.get_student_by_id(student_id, columns='grades')
+    if not student or student.get('is_deleted'):
+        return jsonify({'error': 'Not found'}), 404
+    
+    return _edit_student(student)
+
+def _edit_student(student):
+    """Apply the request's edits to a student row"""
+    role = session['role']
     
     # Only principal or teacher who added can edit
     if role != 'principal' and not (role == 'teacher' and student['added_by'] == 'teacher'):
@@ -1116,6 +1362,16 @@ def edit_student(idx):
     # Convert to database format
     update_data = convert_app_student_to_db_format(data)
     
+    # A replaced profile picture gets its embedding now, like a direct upload
+    if data.get('profile_picture'):
+        try:
+            image_hash, image_raw = ingest_image(read_b64_image(data['profile_picture']))
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
+        update_data['profile_picture_hash'] = image_hash
+        update_data['face_embedding'] = _profile_face_embedding(image_raw)
+        update_data['has_profile_picture'] = True
+    
     result = db.update_student(student['id'], update_data)
     
     if result:
@@ -1123,7 +1379,7 @@ def edit_student(idx):
         updated_student = convert_db_student_to_app_format(result)
         
         # Log the action
-        db.add_log_entry('edit', {
+        audit_log_writer.log('edit', {
             'student': updated_student,
             'original_student': original_student
         }, role)
@@ -1136,15 +1392,25 @@ def edit_student(idx):
 @app.route('/api/students/<int:idx>', methods=['DELETE'])
 @require_login
 def delete_student(idx):
-    username = session['user']
-    role = session['role']
-    
     # Get all students and find by index
-    all_students = db.get_students()
+    all_students = db.get_students(columns='grades')
     if idx < 0 or idx >= len(all_students):
         return jsonify({'error': 'Not found'}), 404
     
-    student = all_students[idx]
+    return _delete_student(all_students[idx])
+
+@app.route('/api/students/by-id/<int:student_id>', methods=['DELETE'])
+@require_login
+def delete_student_by_id(student_id):
+    student = db.get_student_by_id(student_id, columns='grades')
+    if not student or student.get('is_deleted'):
+        return jsonify({'error': 'Not found'}), 404
+    
+    return _delete_student(student)
+
+def _delete_student(student):
+    """Soft delete a student row"""
+    role = session['role']
     
     if role != 'principal' and not (role == 'teacher' and student['added_by'] == 'teacher'):
         return jsonify({'error': 'Permission denied'}), 403
@@ -1159,7 +1425,7 @@ def delete_student(idx):
         deleted_student['deletedAt'] = nowstr()
         
         # Log the action
-        db.add_log_entry('delete', {
+        audit_log_writer.log('delete', {
             'student': deleted_student
         }, role)
         
@@ -1171,7 +1437,7 @@ def delete_student(idx):
 @app.route('/api/deleted_students', methods=['GET'])
 @require_login
 def get_deleted_students():
-    deleted_students = db.get_deleted_students()
+    deleted_students = db.get_deleted_students(columns='grades')
     # Convert to app format
     app_students = []
     for s in deleted_students:
@@ -1184,15 +1450,25 @@ def get_deleted_students():
 @app.route('/api/deleted_students/<int:idx>/recover', methods=['POST'])
 @require_login
 def recover_student(idx):
-    username = session['user']
-    role = session['role']
-    
     # Get all deleted students and find by index
-    deleted_students = db.get_deleted_students()
+    deleted_students = db.get_deleted_students(columns='summary')
     if idx < 0 or idx >= len(deleted_students):
         return jsonify({'error': 'Not found'}), 404
     
-    student = deleted_students[idx]
+    return _recover_student(deleted_students[idx])
+
+@app.route('/api/deleted_students/by-id/<int:student_id>/recover', methods=['POST'])
+@require_login
+def recover_student_by_id(student_id):
+    student = db.get_student_by_id(student_id, columns='summary')
+    if not student or not student.get('is_deleted'):
+        return jsonify({'error': 'Not found'}), 404
+    
+    return _recover_student(student)
+
+def _recover_student(student):
+    """Recover a soft-deleted student row"""
+    role = session['role']
     
     # Permission: anyone can recover if deleted by teacher, only principal if deleted by principal
     if student['deleted_by'] == 'principal' and role != 'principal':
@@ -1206,7 +1482,7 @@ def recover_student(idx):
         recovered_student = convert_db_student_to_app_format(result)
         
         # Log the action
-        db.add_log_entry('recover', {
+        audit_log_writer.log('recover', {
             'student': recovered_student
         }, role)
         
@@ -1217,15 +1493,25 @@ def recover_student(idx):
 @app.route('/api/deleted_students/<int:idx>', methods=['DELETE'])
 @require_login
 def permadelete_student(idx):
-    username = session['user']
-    role = session['role']
-    
     # Get all deleted students and find by index
-    deleted_students = db.get_deleted_students()
+    deleted_students = db.get_deleted_students(columns='grades')
     if idx < 0 or idx >= len(deleted_students):
         return jsonify({'error': 'Not found'}), 404
     
-    student = deleted_students[idx]
+    return _permadelete_student(deleted_students[idx])
+
+@app.route('/api/deleted_students/by-id/<int:student_id>', methods=['DELETE'])
+@require_login
+def permadelete_student_by_id(student_id):
+    student = db.get_student_by_id(student_id, columns='grades')
+    if not student or not student.get('is_deleted'):
+        return jsonify({'error': 'Not found'}), 404
+    
+    return _permadelete_student(student)
+
+def _permadelete_student(student):
+    """Permanently delete a soft-deleted student row"""
+    role = session['role']
     
     # Only principal can permadelete if deleted by principal
     if student['deleted_by'] == 'principal' and role != 'principal':
@@ -1235,7 +1521,7 @@ def permadelete_student(idx):
     app_student = convert_db_student_to_app_format(student)
     
     # Log the action before permanent deletion
-    db.add_log_entry('permadelete', {
+    audit_log_writer.log('permadelete', {
         'student': app_student
     }, role)
     
@@ -1249,45 +1535,73 @@ def permadelete_student(idx):
         return jsonify({'error': 'Failed to permanently delete student'}), 500
 
 # --- Data log endpoint ---
+def convert_log_entry_to_app_format(entry):
+    """Convert a data_log row (full or compact projection) to app format"""
+    app_entry = {
+        'id': entry['id'],
+        'action': entry['action'],
+        'who': entry['who'],
+        'when': entry['when_timestamp']
+    }
+    
+    if 'details' not in entry:
+        # Compact projection: identifying fields only
+        roll = entry.get('student_roll') or entry.get('attempt_roll')
+        if roll is not None:
+            app_entry['student_roll'] = int(roll)
+            app_entry['student_name'] = entry.get('student_name')
+        if entry.get('teacher_username'):
+            app_entry['teacher_username'] = entry['teacher_username']
+        return app_entry
+    
+    # Add details based on action type
+    details = entry.get('details') or {}
+    if entry['action'] == 'add' and 'student' in details:
+        app_entry['student'] = details['student']
+    elif entry['action'] == 'edit' and 'student' in details:
+        app_entry['student'] = details['student']
+        app_entry['original_student'] = details.get('original_student')
+    elif entry['action'] == 'delete' and 'student' in details:
+        app_entry['student'] = details['student']
+    elif entry['action'] == 'recover' and 'student' in details:
+        app_entry['student'] = details['student']
+    elif entry['action'] == 'add_teacher' and 'teacher' in details:
+        app_entry['teacher'] = details['teacher']
+    elif entry['action'] == 'delete_teacher' and 'teacher' in details:
+        app_entry['teacher'] = details['teacher']
+    elif entry['action'] == 'change_teacher_password':
+        app_entry['teacher_username'] = details.get('teacher_username')
+    elif entry['action'] == 'update_marks' and 'student' in details:
+        app_entry['student'] = details['student']
+    
+    return app_entry
+
 @app.route('/api/log', methods=['GET'])
 @require_login
 def get_log():
-    log_entries = db.get_log_entries()
-    print(f"Log endpoint called. Total log entries: {len(log_entries)}")
+    """Data log, newest first.
     
-    # Convert to the expected format
-    app_log_entries = []
-    for entry in log_entries:
-        app_entry = {
-            'action': entry['action'],
-            'who': entry['who'],
-            'when': entry['when_timestamp']
-        }
-        
-        # Add details based on action type
-        details = entry.get('details', {})
-        if entry['action'] == 'add' and 'student' in details:
-            app_entry['student'] = details['student']
-        elif entry['action'] == 'edit' and 'student' in details:
-            app_entry['student'] = details['student']
-            app_entry['original_student'] = details.get('original_student')
-        elif entry['action'] == 'delete' and 'student' in details:
-            app_entry['student'] = details['student']
-        elif entry['action'] == 'recover' and 'student' in details:
-            app_entry['student'] = details['student']
-        elif entry['action'] == 'add_teacher' and 'teacher' in details:
-            app_entry['teacher'] = details['teacher']
-        elif entry['action'] == 'delete_teacher' and 'teacher' in details:
-            app_entry['teacher'] = details['teacher']
-        elif entry['action'] == 'change_teacher_password':
-            app_entry['teacher_username'] = details.get('teacher_username')
-        elif entry['action'] == 'update_marks' and 'student' in details:
-            app_entry['student'] = details['student']
-        
-        app_log_entries.append(app_entry)
+    Without query parameters this returns the full list the dashboard
+    expects. Any of limit, cursor, action, actor, roll, start_date, end_date
+    or compact switches to pages: {'entries': [...], 'next_cursor': ...}.
+    """
+    # Make entries still queued in the write-behind writer visible
+    audit_log_writer.flush()
     
-    print(f"Converted log entries: {app_log_entries}")
-    return jsonify(app_log_entries)
+    if not wants_page(request.args):
+        log_entries = db.get_log_entries()
+        print(f"Log endpoint called. Total log entries: {len(log_entries)}")
+        return jsonify([convert_log_entry_to_app_format(entry) for entry in log_entries])
+    
+    try:
+        query = parse_log_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    log_entries, has_more = db.get_log_page(**query)
+    entries = [convert_log_entry_to_app_format(entry) for entry in log_entries]
+    next_cursor = encode_cursor(log_entries[-1]['when_timestamp'], log_entries[-1]['id']) if has_more else None
+    return jsonify({'entries': entries, 'next_cursor': next_cursor})
 
 # --- Clear all / recover all ---
 @app.route('/api/clear_all', methods=['POST'])
@@ -1298,7 +1612,7 @@ def clear_all():
     
     # This would require implementing clear_all functionality in the database manager
     # For now, we'll just log the action
-    db.add_log_entry('clear', {}, role)
+    audit_log_writer.log('clear', {}, role)
     
     return jsonify({'success': True})
 
@@ -1318,6 +1632,8 @@ def clear_data_log():
     if role != 'principal':
         return jsonify({'error': 'Permission denied. Only principal can clear data log.'}), 403
     
+    # Queued entries belong to the log being cleared
+    audit_log_writer.flush()
     result = db.clear_log(role)
     
     if result:
@@ -1334,22 +1650,36 @@ def recover_all():
     
     # This would require implementing recover_all functionality in the database manager
     # For now, we'll just log the action
-    db.add_log_entry('recoverall', {}, role)
+    audit_log_writer.log('recoverall', {}, role)
     
     return jsonify({'success': True})
 
 @app.route('/api/undo_edit/<int:log_idx>', methods=['POST'])
 @require_login
 def undo_edit(log_idx):
-    username = session['user']
-    role = session['role']
+    audit_log_writer.flush()
+    
+    # Fetch only the entry at this position of the newest-first log
+    log_entry = db.get_log_entry_at(log_idx) if log_idx >= 0 else None
+    if not log_entry:
+        return jsonify({'error': 'Log entry not found'}), 404
     
-    # Get log entries
-    log_entries = db.get_log_entries()
-    if log_idx < 0 or log_idx >= len(log_entries):
+    return _undo_edit(log_entry)
+
+@app.route('/api/undo_edit/by-id/<int:log_id>', methods=['POST'])
+@require_login
+def undo_edit_by_id(log_id):
+    audit_log_writer.flush()
+    log_entry = db.get_log_entry(log_id)
+    if not log_entry:
         return jsonify({'error': 'Log entry not found'}), 404
     
-    log_entry = log_entries[log_idx]
+    return _undo_edit(log_entry)
+
+def _undo_edit(log_entry):
+    """Revert the student an edit log entry changed"""
+    role = session['role']
+    
     if log_entry['action'] != 'edit':
         return jsonify({'error': 'Not an edit action'}), 400
     
@@ -1364,24 +1694,25 @@ def undo_edit(log_idx):
     if not original_student:
         return jsonify({'error': 'Original student data not found'}), 404
     
-    # Find the student by name and roll number
-    all_students = db.get_students()
-    student_id = None
-    for student in all_students:
-        if student['name'] == original_student['name'] and student['roll'] == original_student['roll']:
-            student_id = student['id']
-            break
+    # Find the student by id, falling back to name and roll number for older entries
+    student = None
+    if original_student.get('id') is not None:
+        student = db.get_student_by_id(original_student['id'], columns='summary')
+    else:
+        candidate = db.get_student_by_roll(original_student['roll'], columns='summary')
+        if candidate and candidate['name'] == original_student['name']:
+            student = candidate
     
-    if student_id is None:
+    if not student or student.get('is_deleted'):
         return jsonify({'error': 'Student not found'}), 404
     
     # Revert to original data
     update_data = convert_app_student_to_db_format(original_student)
-    result = db.update_student(student_id, update_data)
+    result = db.update_student(student['id'], update_data)
     
     if result:
         # Add undo action to log
-        db.add_log_entry('undo_edit', {
+        audit_log_writer.log('undo_edit', {
             'student': convert_db_student_to_app_format(result)
         }, role)
         
@@ -1389,6 +1720,43 @@ def undo_edit(log_idx):
     else:
         return jsonify({'error': 'Failed to undo edit'}), 500
 
+@app.route('/api/verification/stats', methods=['GET'])
+@require_login
+def get_verification_stats():
+    """Verification worker pool queue depth and timeout counters (principal only)"""
+    if session['role'] != 'principal':
+        return jsonify({'error': 'Permission denied. Only principal can view verification statistics.'}), 403
+    
+    return jsonify({
+        **verification_executor.stats(),
+        'attendance_jobs': attendance_jobs.stats(),
+        'result_cache': verification_results.stats()
+    })
+
+@app.route('/api/verification/capabilities', methods=['GET'])
+@require_login
+def get_verification_capabilities():
+    """Which AI backends are loaded, in the web process and a verification worker (principal only)"""
+    if session['role'] != 'principal':
+        return jsonify({'error': 'Permission denied. Only principal can view verification capabilities.'}), 403
+    
+    return jsonify({
+        'preload': preload_enabled(),
+        'inline': verification_executor.max_workers == 0,
+        'web': ai_registry.report(),
+        # None when no worker answered within the verification timeout
+        'worker': verification_executor.capabilities()
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+@require_login
+def get_cache_stats():
+    """Database read cache hit/miss counters (principal only)"""
+    if session['role'] != 'principal':
+        return jsonify({'error': 'Permission denied. Only principal can view cache statistics.'}), 403
+    
+    return jsonify(db.get_cache_stats())
+
 @app.route('/api/student/attendance/calendar/<int:roll_number>', methods=['GET'])
 @require_login
 def get_student_attendance_calendar(roll_number):
@@ -1402,33 +1770,34 @@ def get_student_attendance_calendar(roll_number):
     if year is None or month is None:
         return jsonify({'error': 'Year and month parameters are required'}), 400
     
-    # Get all dates in the specified month
-    from calendar import monthrange
-    _, days_in_month = monthrange(year, month + 1)  # month + 1 because monthrange uses 1-based months
+    months = request.args.get('months', 1, type=int)
+    if months < 1 or months > MAX_CALENDAR_MONTHS:
+        return jsonify({'error': f'months must be between 1 and {MAX_CALENDAR_MONTHS}'}), 400
     
-    present_dates = []
-    uploaded_dates = []
+    calendar_months = get_calendar_months(year, month, months)
     
-    # Check each day of the month
-    for day in range(1, days_in_month + 1):
-        date_str = f"{year}-{month+1:02d}-{day:02d}"
-        
-        # Get attendance for this date
-        attendance_records = db.get_student_attendance(roll_number, date_str, date_str)
-        
-        if attendance_records:
-            record = attendance_records[0]
-            if record['is_present']:
-                present_dates.append(date_str)
-            elif record['image_data']:
-                uploaded_dates.append(date_str)
+    # Fetch the whole range in one query
+    calendar_days = db.get_attendance_calendar(roll_number, calendar_months[0][2], calendar_months[-1][3])
     
-    return jsonify({
-        'present_dates': present_dates,
-        'uploaded_dates': uploaded_dates,
+    month_entries = []
+    for entry_year, entry_month, start_date, end_date in calendar_months:
+        days = sorted(d for d in calendar_days if start_date <= d <= end_date)
+        month_entries.append({
+            'year': entry_year,
+            'month': entry_month,
+            'present_dates': [d for d in days if calendar_days[d] == 'present'],
+            'uploaded_dates': [d for d in days if calendar_days[d] == 'uploaded']
+        })
+    
+    response = {
+        'present_dates': [d for entry in month_entries for d in entry['present_dates']],
+        'uploaded_dates': [d for entry in month_entries for d in entry['uploaded_dates']],
         'year': year,
         'month': month
-    })
+    }
+    if months > 1:
+        response['months'] = month_entries
+    return jsonify(response)
 
 @app.route('/')
 def index():
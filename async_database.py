@@ -0,0 +1,61 @@
+import asyncio
+import functools
+from database import db as sync_db
+
+
+class AsyncDatabaseManager:
+    """Asyncio facade over DatabaseManager.
+
+    Every public DatabaseManager method is available as a coroutine with the
+    same name and arguments. Calls run in worker threads against the shared
+    Supabase client (and read cache), so independent reads awaited together
+    with asyncio.gather are issued concurrently instead of one after another.
+    """
+
+    def __init__(self, manager=None):
+        self.manager = manager or sync_db
+
+    def __getattr__(self, name):
+        attr = getattr(self.manager, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return call
+
+    async def gather(self, *calls):
+        """Run several (method_name, args...) reads concurrently and return their results in order"""
+        return await asyncio.gather(*(getattr(self, name)(*args) for name, *args in calls))
+
+    async def gather_student_context(self, student_roll, date):
+        """Fetch what an attendance upload needs in one await.
+
+        Returns a dict with the student's attendance records for `date`,
+        their attempt info for `date`, their stored face embedding row (the
+        profile picture itself is only loaded if that row needs it) and the
+        phashes of their previous attendance photos.
+        """
+        attendance, attempts, profile, previous_phashes = await self.gather(
+            ('get_student_attendance', student_roll, date, date),
+            ('get_attendance_attempts', student_roll, date, False),
+            ('get_student_by_roll', student_roll, 'face'),
+            ('get_student_attendance_phashes', student_roll)
+        )
+        return {
+            'attendance': attendance,
+            'attempts': attempts,
+            'profile': profile,
+            'previous_phashes': previous_phashes
+        }
+
+
+def run_async(coro):
+    """Run a coroutine to completion from synchronous (Flask request) code"""
+    return asyncio.run(coro)
+
+
+# Global async database instance
+async_db = AsyncDatabaseManager()
@@ -0,0 +1,73 @@
+import atexit
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def new_job_id():
+    return str(uuid.uuid4())
+
+
+class AttendanceJobRunner:
+    """Runs asynchronous attendance verification jobs on background threads.
+
+    Job state lives in the attendance_jobs table through `update_job(job_id,
+    status, result=None, error=None)`, so a status poll can be answered by
+    any process. The threads mostly wait on the verification pool, which
+    does the CPU work. A job still queued or running `stale_after` seconds
+    after its last update belongs to a process that died; it is treated as
+    failed (see DatabaseManager.expire_attendance_jobs).
+    """
+
+    def __init__(self, update_job, max_workers=4, stale_after=300):
+        self.update_job = update_job
+        self.stale_after = stale_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='attendance-job')
+        self.submitted = 0
+        self.failed = 0
+
+    def submit(self, job_id, fn, *args):
+        """Run fn(*args) in the background; its return value becomes the job result"""
+        self.submitted += 1
+        return self._pool.submit(self._run, job_id, fn, args)
+
+    def _run(self, job_id, fn, args):
+        self.update_job(job_id, 'running')
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.failed += 1
+            logger.exception(f"Attendance job {job_id} failed")
+            self.update_job(job_id, 'failed', error=str(e))
+            return
+        self.update_job(job_id, 'done', result=result)
+
+    def stale_before(self):
+        """Cutoff timestamp: active jobs last updated before it are abandoned"""
+        return (datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)).isoformat()
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'failed': self.failed,
+            'stale_after': self.stale_after
+        }
+
+    def shutdown(self):
+        # Jobs not started yet are abandoned and expire; the student can retry
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_attendance_job_runner(update_job):
+    """Create the runner configured by the ATTENDANCE_JOB_* variables"""
+    runner = AttendanceJobRunner(
+        update_job,
+        max_workers=int(os.getenv('ATTENDANCE_JOB_WORKERS', '4')),
+        stale_after=int(os.getenv('ATTENDANCE_JOB_STALE_SECONDS', '300'))
+    )
+    atexit.register(runner.shutdown)
+    return runner
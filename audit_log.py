@@ -0,0 +1,140 @@
+import re
+from datetime import datetime
+
+# Page size for /api/log when the client asks for pages
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Query parameters that switch /api/log from the legacy full list to pages
+PAGE_PARAMS = ('limit', 'cursor', 'action', 'actor', 'roll', 'start_date', 'end_date', 'compact')
+
+# Entry keys holding full student / teacher snapshots, dropped in compact mode
+SNAPSHOT_KEYS = ('student', 'original_student', 'teacher')
+
+
+# Fractional seconds; Postgres drops trailing zeros, so there may be 1-6 digits
+_FRACTION = re.compile(r'\.(\d+)')
+
+
+def parse_timestamp(text):
+    """datetime of an ISO timestamp as Postgres or nowstr() writes it; raises ValueError.
+
+    datetime.fromisoformat on Python < 3.11 only takes 3 or 6 fraction digits
+    and no 'Z', so both are normalized first.
+    """
+    text = _FRACTION.sub(lambda m: '.' + m.group(1)[:6].ljust(6, '0'), text, count=1)
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    return datetime.fromisoformat(text)
+
+
+def encode_cursor(when, entry_id):
+    """Opaque keyset cursor for the entry a page ended on"""
+    return f"{parse_timestamp(when).isoformat(timespec='microseconds')}|{entry_id}"
+
+
+def decode_cursor(cursor):
+    """Split a cursor into (when, id) with `when` a datetime; raises ValueError if it is malformed.
+
+    Both parts are parsed, so nothing from the client reaches a query as text.
+    """
+    when, sep, entry_id = (cursor or '').rpartition('|')
+    try:
+        return parse_timestamp(when), int(entry_id)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+
+def wants_page(args):
+    """True when the request uses any pagination or filter parameter"""
+    return any(name in args for name in PAGE_PARAMS)
+
+
+def parse_log_query(args):
+    """Build log query options from request args.
+
+    Raises ValueError with a client-facing message for bad input.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+
+    roll = args.get('roll')
+    if roll is not None:
+        try:
+            roll = int(roll)
+        except ValueError:
+            raise ValueError('roll must be an integer')
+
+    for name in ('start_date', 'end_date'):
+        if args.get(name):
+            try:
+                datetime.strptime(args[name], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'{name} must be YYYY-MM-DD')
+
+    return {
+        'limit': min(limit, MAX_PAGE_SIZE),
+        'cursor': decode_cursor(args['cursor']) if args.get('cursor') else None,
+        'action': args.get('action') or None,
+        'actor': args.get('actor') or None,
+        'student_roll': roll,
+        'start_date': args.get('start_date') or None,
+        'end_date': args.get('end_date') or None,
+        'compact': args.get('compact', '').lower() in ('1', 'true', 'yes')
+    }
+
+
+def entry_roll(entry):
+    """Student roll of an app-format entry: from its student snapshot, or the
+    student_roll that attendance and profile picture entries carry"""
+    student = entry.get('student')
+    return student.get('roll') if student else entry.get('student_roll')
+
+
+def compact_entry(entry):
+    """Copy of an app-format entry with snapshots replaced by identifying fields"""
+    compact = {k: v for k, v in entry.items() if k not in SNAPSHOT_KEYS}
+    student = entry.get('student')
+    if student:
+        compact['student_roll'] = student.get('roll')
+        compact['student_name'] = student.get('name')
+    teacher = entry.get('teacher')
+    if teacher:
+        compact['teacher_username'] = teacher.get('username')
+    return compact
+
+
+def page_entries(entries, query):
+    """Filter and paginate an in-memory, newest-first list of app-format entries.
+
+    Returns (page, next_cursor); next_cursor is None on the last page.
+    """
+    start_date, end_date = query['start_date'], query['end_date']
+    matched = []
+    for entry in entries:
+        if query['cursor'] and (parse_timestamp(entry['when']), entry['id']) >= query['cursor']:
+            continue
+        if query['action'] and entry['action'] != query['action']:
+            continue
+        if query['actor'] and entry['who'] != query['actor']:
+            continue
+        # Rolls from JSON bodies may be strings; compare as text on both sides
+        if query['student_roll'] is not None and str(entry_roll(entry)) != str(query['student_roll']):
+            continue
+        if start_date and entry['when'][:10] < start_date:
+            continue
+        if end_date and entry['when'][:10] > end_date:
+            continue
+        matched.append(entry)
+        if len(matched) > query['limit']:
+            break
+
+    page = matched[:query['limit']]
+    next_cursor = encode_cursor(page[-1]['when'], page[-1]['id']) if len(matched) > query['limit'] else None
+    if query['compact']:
+        page = [compact_entry(entry) for entry in page]
+    return page, next_cursor
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Backfill students.face_embedding for profile pictures uploaded before
+embeddings were stored, so attendance verification only encodes the capture
+"""
+
+import argparse
+import os
+from supabase import create_client, Client
+from dotenv import load_dotenv
+import logging
+from blob_store import blob_store
+from verification_engine import VerificationInput, encode_embedding
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Student rows fetched per request while backfilling
+BATCH_SIZE = 20
+
+def backfill_face_embeddings(force=False):
+    """Compute and store face embeddings for students with a profile picture"""
+    try:
+        import face_recognition  # type: ignore
+    except ImportError:
+        raise SystemExit("face_recognition is required to compute embeddings (pip install face_recognition)")
+
+    try:
+        # Initialize Supabase client
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_KEY')
+
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+
+        supabase: Client = create_client(supabase_url, supabase_key)
+        logger.info("Supabase client initialized successfully")
+
+        stored = 0
+        no_face = 0
+        last_id = 0
+
+        while True:
+            # Keyset pagination on id so each batch is a bounded download
+            query = supabase.table('students').select('id, roll, profile_picture, profile_picture_hash').eq('has_profile_picture', True).gt('id', last_id)
+            if not force:
+                query = query.is_('face_embedding', 'null')
+            response = query.order('id').limit(BATCH_SIZE).execute()
+            if not response.data:
+                break
+
+            for record in response.data:
+                last_id = record['id']
+                if record.get('profile_picture_hash'):
+                    raw = blob_store.get(record['profile_picture_hash'])
+                    image = VerificationInput(raw) if raw is not None else None
+                elif record.get('profile_picture'):
+                    image = VerificationInput.from_b64(record['profile_picture'])
+                else:
+                    image = None
+                if image is None:
+                    logger.warning(f"Student {record['roll']}: profile picture not found")
+                    continue
+
+                encodings = face_recognition.face_encodings(image.rgb)
+                if not encodings:
+                    no_face += 1
+                    logger.warning(f"Student {record['roll']}: no face detected in profile picture")
+                    continue
+
+                supabase.table('students').update({
+                    'face_embedding': encode_embedding(encodings[0])
+                }).eq('id', record['id']).execute()
+                stored += 1
+
+        logger.info(f"✅ Stored {stored} face embeddings ({no_face} profile pictures without a detectable face)")
+
+    except Exception as e:
+        logger.error(f"Backfill failed: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--force', action='store_true',
+                        help='recompute embeddings that are already stored')
+    args = parser.parse_args()
+    backfill_face_embeddings(force=args.force)
@@ -0,0 +1,227 @@
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+def strip_data_url_prefix(data_url):
+    """Remove any data URL prefix from a base64 image string."""
+    if not data_url:
+        return data_url
+    prefix_sep = 'base64,'
+    if prefix_sep in data_url:
+        return data_url.split(prefix_sep, 1)[1]
+    return data_url
+
+
+def decode_image_b64(image_b64):
+    """Decode a base64 image string (with or without data URL prefix) to raw bytes"""
+    return base64.b64decode(strip_data_url_prefix(image_b64))
+
+
+def guess_mimetype(raw):
+    """Guess an image MIME type from its magic bytes"""
+    if raw.startswith(b'\x89PNG'):
+        return 'image/png'
+    if raw.startswith(b'GIF8'):
+        return 'image/gif'
+    if raw[:4] == b'RIFF' and raw[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def to_data_url(raw):
+    """Encode raw image bytes as a data URL, the format the browser sends and displays"""
+    return f"data:{guess_mimetype(raw)};base64,{base64.b64encode(raw).decode('ascii')}"
+
+
+def _check_digest(digest):
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        raise ValueError(f"Invalid blob digest: {digest!r}")
+    return digest
+
+
+def _check_variant(name):
+    if not name.isalnum():
+        raise ValueError(f"Invalid blob variant: {name!r}")
+    return name
+
+
+class BlobStore(ABC):
+    """Content-addressed image storage.
+
+    Blobs are raw bytes keyed by the SHA-256 hex digest of their content, so
+    storing the same image twice keeps a single copy.
+    """
+
+    @abstractmethod
+    def put(self, raw):
+        """Store bytes and return their SHA-256 hex digest"""
+
+    @abstractmethod
+    def get(self, digest):
+        """Return the bytes for a digest, or None"""
+
+    def exists(self, digest):
+        return self.get(digest) is not None
+
+    def put_b64(self, image_b64):
+        """Store a base64 / data URL image and return its digest (None for empty input)"""
+        if not image_b64:
+            return None
+        return self.put(decode_image_b64(image_b64))
+
+    def get_data_url(self, digest):
+        """Resolve a digest to a data URL string, or None"""
+        raw = self.get(digest) if digest else None
+        return to_data_url(raw) if raw is not None else None
+
+    @abstractmethod
+    def put_variant(self, digest, name, raw):
+        """Store a derived rendition (e.g. 'thumb') of the blob `digest`"""
+
+    @abstractmethod
+    def get_variant(self, digest, name):
+        """Return the bytes of a stored rendition, or None"""
+
+
+class LocalBlobStore(BlobStore):
+    """Blob store on the local filesystem under root/ab/cd/<digest>.
+
+    Only for a single host with a persistent disk: images are not shared
+    between instances and are lost with an ephemeral filesystem (Vercel,
+    most containers). Use BLOB_STORE=supabase there.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        _check_digest(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _variant_path(self, digest, name):
+        return f"{self._path(digest)}.{_check_variant(name)}"
+
+    def _write(self, path, raw):
+        # Write to a temp file and rename so readers never see partial blobs
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, raw):
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            self._write(path, raw)
+        return digest
+
+    def get(self, digest):
+        try:
+            return self._read(self._path(digest))
+        except ValueError:
+            return None
+
+    def put_variant(self, digest, name, raw):
+        self._write(self._variant_path(digest, name), raw)
+
+    def get_variant(self, digest, name):
+        try:
+            return self._read(self._variant_path(digest, name))
+        except ValueError:
+            return None
+
+    def exists(self, digest):
+        try:
+            return os.path.exists(self._path(digest))
+        except ValueError:
+            return False
+
+
+class SupabaseBlobStore(BlobStore):
+    """Blob store in a Supabase Storage bucket, shared by every instance.
+
+    Objects are named ab/<digest> (variants ab/<digest>.<name>). The bucket
+    must exist; it can stay private since the service reads it server-side.
+    """
+
+    def __init__(self, client, bucket):
+        self.bucket = client.storage.from_(bucket)
+
+    @staticmethod
+    def _key(digest):
+        _check_digest(digest)
+        return f"{digest[:2]}/{digest}"
+
+    def _upload(self, key, raw):
+        # Content-addressed, so overwriting an existing object is harmless
+        self.bucket.upload(key, raw, {'content-type': guess_mimetype(raw), 'x-upsert': 'true'})
+
+    def _download(self, key):
+        try:
+            return self.bucket.download(key)
+        except Exception as e:
+            logger.debug(f"Blob {key} not found: {e}")
+            return None
+
+    def put(self, raw):
+        digest = hashlib.sha256(raw).hexdigest()
+        self._upload(self._key(digest), raw)
+        return digest
+
+    def get(self, digest):
+        try:
+            return self._download(self._key(digest))
+        except ValueError:
+            return None
+
+    def put_variant(self, digest, name, raw):
+        self._upload(f"{self._key(digest)}.{_check_variant(name)}", raw)
+
+    def get_variant(self, digest, name):
+        try:
+            return self._download(f"{self._key(digest)}.{_check_variant(name)}")
+        except ValueError:
+            return None
+
+
+def create_blob_store():
+    """Create the blob store configured by BLOB_STORE ('local' or 'supabase').
+
+    'local' (BLOB_STORE_PATH) keeps images on this host's disk; deployments
+    with several instances or an ephemeral filesystem need 'supabase'
+    (bucket BLOB_STORE_BUCKET, credentials SUPABASE_URL / SUPABASE_KEY).
+    """
+    backend = os.getenv('BLOB_STORE', 'local')
+    if backend == 'local':
+        root = os.getenv('BLOB_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blob_store'))
+        logger.info(f"Using local blob store at {root}")
+        return LocalBlobStore(root)
+    if backend == 'supabase':
+        from supabase import create_client
+        bucket = os.getenv('BLOB_STORE_BUCKET', 'images')
+        logger.info(f"Using Supabase Storage blob store in bucket {bucket}")
+        return SupabaseBlobStore(create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY')), bucket)
+    raise ValueError(f"Unknown BLOB_STORE backend: {backend}")
+
+
+# Global blob store instance
+blob_store = create_blob_store()
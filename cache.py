@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-table TTLs for database reads.
+
+    Keys are tuples whose first element is the table name, e.g.
+    ('users', 'teacher_1') or ('students', 'class', '5'). The TTL for an
+    entry is looked up from `ttls` by that table name.
+    """
+
+    def __init__(self, ttls, max_entries=1024, default_ttl=60):
+        self.ttls = dict(ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return (True, value) for a live entry, or (False, None) on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries when full.
+
+        `ttl` (seconds) overrides the table TTL for this entry.
+        """
+        if ttl is None:
+            ttl = self.ttls.get(key[0], self.default_ttl)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, cache_empty=False):
+        """Read-through helper: return the cached value or call loader() and cache it.
+
+        Empty results (None, []) are not cached unless `cache_empty` is set,
+        so failed lookups are retried on the next call.
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        if value or cache_empty:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        """Drop specific keys"""
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def invalidate_if(self, table, predicate):
+        """Drop every entry of `table` whose (key, value) satisfies predicate"""
+        with self._lock:
+            matching = [key for key, (_, value) in self._entries.items()
+                        if key[0] == table and predicate(key, value)]
+            for key in matching:
+                del self._entries[key]
+            self.invalidations += len(matching)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttls': dict(self.ttls)
+            }
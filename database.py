@@ -1,8 +1,13 @@
 import os
+import hashlib
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import logging
+from cache import QueryCache
+from blob_store import blob_store
+from image_ingest import ingest_b64, resolve_image
+from login_lookup import first_name_key
 
 # Load environment variables
 load_dotenv()
@@ -11,6 +16,52 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read-through cache TTLs (seconds) per table. Users and the clear log change
+# rarely; student rows change on every edit but are invalidated on write.
+CACHE_TTLS = {
+    'users': 300,
+    'students': 60,
+    'clear_log': 300
+}
+
+# PostgREST "function not found in the schema cache" / Postgres undefined_function
+MISSING_FUNCTION_CODES = ('PGRST202', '42883')
+
+
+def _is_missing_function(error):
+    """True if an RPC failed because the SQL function is not installed"""
+    return getattr(error, 'code', None) in MISSING_FUNCTION_CODES
+
+
+# No unique index for ON CONFLICT / undefined column / column not in PostgREST's schema cache
+MISSING_LOG_UUID_CODES = ('42P10', '42703', 'PGRST204')
+
+
+# Named column sets for student reads. Rosters and lookups should pick the
+# narrowest set they need: 'full' also downloads the base64 profile picture.
+STUDENT_COLUMNS = {
+    'summary': 'id, name, age, class, roll, has_profile_picture, added_by, timestamp, is_deleted, deleted_by, deleted_at',
+    'grades': 'id, name, age, class, roll, has_profile_picture, added_by, timestamp, is_deleted, deleted_by, deleted_at, '
+              'math_marks, science_marks, history_marks, english_marks',
+    'auth': 'id, name, first_name_lower, age, class, roll, password, has_profile_picture',
+    'face': 'id, roll, has_profile_picture, face_embedding',
+    'gallery': 'id, name, roll, face_embedding',
+    'full': '*'
+}
+
+# Column sets for data_log reads. 'compact' pulls identifying fields out of
+# the details JSON instead of the embedded student / teacher snapshots.
+# Student roll of a log entry: student add/edit/delete entries carry the
+# student snapshot, attendance and profile picture entries only its roll
+LOG_ROLL_PATHS = ('details->student->>roll', 'details->>student_roll')
+
+LOG_COLUMNS = {
+    'compact': 'id, action, who, when_timestamp, student_roll:details->student->>roll, '
+               'attempt_roll:details->>student_roll, '
+               'student_name:details->student->>name, teacher_username:details->teacher->>username',
+    'full': '*'
+}
+
 class DatabaseManager:
     def __init__(self):
         """Initialize Supabase client"""
@@ -22,6 +73,57 @@ class DatabaseManager:
         
         self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
         logger.info("Supabase client initialized successfully")
+        
+        # Optional read-through cache (DB_CACHE_ENABLED=false disables it)
+        self.cache = None
+        if os.getenv('DB_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+            self.cache = QueryCache(CACHE_TTLS, max_entries=int(os.getenv('DB_CACHE_MAX_ENTRIES', '1024')))
+            logger.info("Database read cache enabled")
+        
+        # Cleared when data_log has no entry_uuid unique index (see add_log_entries)
+        self._log_upsert_supported = True
+    
+    # Cache helpers
+    def _cached(self, key, loader):
+        """Return loader() through the read cache when it is enabled"""
+        if not self.cache:
+            return loader()
+        return self.cache.get_or_load(key, loader)
+    
+    def _invalidate_user(self, username):
+        """Evict a cached user and the all-users list"""
+        if self.cache:
+            self.cache.invalidate(('users', username), ('users', '*'))
+    
+    def _invalidate_student(self, student_id=None, roll=None, class_name=None):
+        """Evict a cached student, its class roster and the lists that contain it"""
+        if not self.cache:
+            return
+        
+        # Keys are ('students', kind, [value,] columns); every projection is evicted
+        def affected(key, value):
+            if key[1] in ('all', 'deleted'):
+                return True
+            if key[1] == 'id' and student_id is not None and key[2] == student_id:
+                return True
+            if key[1] == 'roll' and roll is not None and key[2] == roll:
+                return True
+            if key[1] == 'class' and class_name is not None and key[2] == class_name:
+                return True
+            # Also catch the roster of a previous class or roll the student moved out of
+            rows = value if isinstance(value, list) else [value]
+            return any(
+                row and ((student_id is not None and row.get('id') == student_id) or
+                         (roll is not None and row.get('roll') == roll))
+                for row in rows
+            )
+        self.cache.invalidate_if('students', affected)
+    
+    def get_cache_stats(self):
+        """Get read cache hit/miss counters"""
+        if not self.cache:
+            return {'enabled': False}
+        return dict(self.cache.stats(), enabled=True)
     
     def init_database(self):
         """Initialize database tables if they don't exist"""
@@ -62,6 +164,7 @@ class DatabaseManager:
         CREATE TABLE IF NOT EXISTS students (
             id SERIAL PRIMARY KEY,
             name VARCHAR(255) NOT NULL,
+            first_name_lower VARCHAR(255),
             age INTEGER NOT NULL,
             class VARCHAR(10) NOT NULL,
             roll INTEGER NOT NULL,
@@ -71,6 +174,7 @@ class DatabaseManager:
             history_marks INTEGER,
             english_marks INTEGER,
             profile_picture TEXT,
+            profile_picture_hash VARCHAR(64),
             has_profile_picture BOOLEAN DEFAULT FALSE,
             added_by VARCHAR(255) NOT NULL,
             timestamp TIMESTAMP DEFAULT NOW(),
@@ -99,6 +203,7 @@ class DatabaseManager:
             date DATE NOT NULL,
             is_present BOOLEAN DEFAULT FALSE,
             image_data TEXT,
+            image_hash VARCHAR(64),
             verified_by VARCHAR(255),
             verified_at TIMESTAMP,
             attempts_remaining INTEGER DEFAULT 3,
@@ -138,6 +243,9 @@ class DatabaseManager:
     # User management methods
     def get_user(self, username):
         """Get user by username"""
+        return self._cached(('users', username), lambda: self._fetch_user(username))
+    
+    def _fetch_user(self, username):
         try:
             response = self.supabase.table('users').select('*').eq('username', username).execute()
             if response.data:
@@ -157,6 +265,7 @@ class DatabaseManager:
                 'class': class_name
             }
             response = self.supabase.table('users').insert(user_data).execute()
+            self._invalidate_user(username)
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error creating user {username}: {e}")
@@ -169,6 +278,7 @@ class DatabaseManager:
                 'password': new_password,
                 'last_password_change': datetime.now().isoformat()
             }).eq('username', username).execute()
+            self._invalidate_user(username)
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error updating password for {username}: {e}")
@@ -178,6 +288,7 @@ class DatabaseManager:
         """Delete a user"""
         try:
             response = self.supabase.table('users').delete().eq('username', username).execute()
+            self._invalidate_user(username)
             return True
         except Exception as e:
             logger.error(f"Error deleting user {username}: {e}")
@@ -185,6 +296,9 @@ class DatabaseManager:
     
     def get_all_users(self):
         """Get all users"""
+        return self._cached(('users', '*'), self._fetch_all_users)
+    
+    def _fetch_all_users(self):
         try:
             response = self.supabase.table('users').select('*').execute()
             return response.data
@@ -193,27 +307,77 @@ class DatabaseManager:
             return []
     
     # Student management methods
-    def get_students(self, include_deleted=False):
-        """Get all students"""
+    def get_students(self, include_deleted=False, columns='full'):
+        """Get all students, ordered by id.
+        
+        `columns` names a STUDENT_COLUMNS set; use the narrowest one the caller needs.
+        """
+        select = STUDENT_COLUMNS[columns]
+        return self._cached(('students', 'all', include_deleted, columns), lambda: self._fetch_students(include_deleted, select))
+    
+    def _fetch_students(self, include_deleted, select):
         try:
-            query = self.supabase.table('students').select('*')
+            query = self.supabase.table('students').select(select)
             if not include_deleted:
                 query = query.eq('is_deleted', False)
-            response = query.execute()
+            response = query.order('id').execute()
             return response.data
         except Exception as e:
             logger.error(f"Error getting students: {e}")
             return []
     
-    def get_student_by_roll(self, roll):
+    def get_class_students(self, class_name, columns='grades'):
+        """Get all non-deleted students in a class"""
+        select = STUDENT_COLUMNS[columns]
+        return self._cached(('students', 'class', class_name, columns), lambda: self._fetch_class_students(class_name, select))
+    
+    def _fetch_class_students(self, class_name, select):
+        try:
+            response = self.supabase.table('students').select(select).eq('class', class_name).eq('is_deleted', False).order('id').execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error getting students for class {class_name}: {e}")
+            return []
+    
+    def get_student_by_id(self, student_id, columns='full'):
+        """Get student by id, whether or not they are soft-deleted"""
+        select = STUDENT_COLUMNS[columns]
+        return self._cached(('students', 'id', student_id, columns), lambda: self._fetch_student_by_id(student_id, select))
+    
+    def _fetch_student_by_id(self, student_id, select):
+        try:
+            response = self.supabase.table('students').select(select).eq('id', student_id).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting student by id {student_id}: {e}")
+            return None
+    
+    def get_student_by_roll(self, roll, columns='full'):
         """Get student by roll number"""
+        select = STUDENT_COLUMNS[columns]
+        return self._cached(('students', 'roll', roll, columns), lambda: self._fetch_student_by_roll(roll, select))
+    
+    def _fetch_student_by_roll(self, roll, select):
         try:
-            response = self.supabase.table('students').select('*').eq('roll', roll).eq('is_deleted', False).execute()
+            response = self.supabase.table('students').select(select).eq('roll', roll).eq('is_deleted', False).execute()
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error getting student by roll {roll}: {e}")
             return None
     
+    def get_students_by_first_name(self, first_name):
+        """Get non-deleted students whose first name matches (case-insensitive).
+        
+        Uses the indexed first_name_lower column; returns every match so the
+        caller can handle students who share a first name.
+        """
+        try:
+            response = self.supabase.table('students').select(STUDENT_COLUMNS['auth']).eq('first_name_lower', first_name_key(first_name)).eq('is_deleted', False).order('id').execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error getting students by first name {first_name}: {e}")
+            return []
+    
     def create_student(self, student_data):
         """Create a new student"""
         try:
@@ -221,6 +385,7 @@ class DatabaseManager:
             marks = student_data.get('marks', {})
             db_student = {
                 'name': student_data['name'],
+                'first_name_lower': first_name_key(student_data['name']),
                 'age': student_data['age'],
                 'class': student_data['class'],
                 'roll': student_data['roll'],
@@ -235,6 +400,7 @@ class DatabaseManager:
             }
             
             response = self.supabase.table('students').insert(db_student).execute()
+            self._invalidate_student(roll=db_student['roll'], class_name=db_student['class'])
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error creating student: {e}")
@@ -247,6 +413,7 @@ class DatabaseManager:
             marks = student_data.get('marks', {})
             update_data = {
                 'name': student_data['name'],
+                'first_name_lower': first_name_key(student_data['name']),
                 'age': student_data['age'],
                 'class': student_data['class'],
                 'roll': student_data['roll'],
@@ -256,13 +423,17 @@ class DatabaseManager:
                 'english_marks': marks.get('english')
             }
             
-            # Add profile picture fields if provided
-            if 'profile_picture' in student_data:
-                update_data['profile_picture'] = student_data['profile_picture']
+            # A new profile picture, already ingested (image_ingest.ingest_image),
+            # with the face embedding computed from the stored image
+            if 'profile_picture_hash' in student_data:
+                update_data['profile_picture'] = None
+                update_data['profile_picture_hash'] = student_data['profile_picture_hash']
+                update_data['face_embedding'] = student_data.get('face_embedding')
             if 'has_profile_picture' in student_data:
                 update_data['has_profile_picture'] = student_data['has_profile_picture']
             
             response = self.supabase.table('students').update(update_data).eq('id', student_id).execute()
+            self._invalidate_student(student_id, update_data['roll'], update_data['class'])
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error updating student {student_id}: {e}")
@@ -276,6 +447,7 @@ class DatabaseManager:
                 'deleted_by': deleted_by,
                 'deleted_at': datetime.now().isoformat()
             }).eq('id', student_id).execute()
+            self._invalidate_student(student_id)
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error deleting student {student_id}: {e}")
@@ -289,15 +461,20 @@ class DatabaseManager:
                 'deleted_by': None,
                 'deleted_at': None
             }).eq('id', student_id).execute()
+            self._invalidate_student(student_id)
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error recovering student {student_id}: {e}")
             return None
     
-    def get_deleted_students(self):
-        """Get all deleted students"""
+    def get_deleted_students(self, columns='full'):
+        """Get all deleted students, ordered by id"""
+        select = STUDENT_COLUMNS[columns]
+        return self._cached(('students', 'deleted', columns), lambda: self._fetch_deleted_students(select))
+    
+    def _fetch_deleted_students(self, select):
         try:
-            response = self.supabase.table('students').select('*').eq('is_deleted', True).execute()
+            response = self.supabase.table('students').select(select).eq('is_deleted', True).order('id').execute()
             return response.data
         except Exception as e:
             logger.error(f"Error getting deleted students: {e}")
@@ -318,15 +495,91 @@ class DatabaseManager:
             logger.error(f"Error adding log entry: {e}")
             return None
     
+    def add_log_entries(self, entries):
+        """Insert a batch of prepared log entries in one request.
+        
+        Entries carry an entry_uuid, so re-sending a batch that was already
+        written (e.g. replayed from the writer's spill file) inserts nothing.
+        Without the entry_uuid column / unique index (section 13 of
+        supabase_setup.sql) it falls back to a plain insert, which loses
+        that guarantee. Returns True on success.
+        """
+        try:
+            if self._log_upsert_supported:
+                try:
+                    self.supabase.table('data_log').upsert(entries, on_conflict='entry_uuid', ignore_duplicates=True).execute()
+                    return True
+                except Exception as e:
+                    if getattr(e, 'code', None) not in MISSING_LOG_UUID_CODES:
+                        raise
+                    logger.warning(f"data_log.entry_uuid unavailable, inserting log entries without it: {e}")
+                    self._log_upsert_supported = False
+            rows = [{k: v for k, v in entry.items() if k != 'entry_uuid'} for entry in entries]
+            self.supabase.table('data_log').insert(rows).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error adding {len(entries)} log entries: {e}")
+            return False
+    
     def get_log_entries(self):
         """Get all log entries"""
         try:
-            response = self.supabase.table('data_log').select('*').order('when_timestamp', desc=True).execute()
+            response = self.supabase.table('data_log').select('*').order('when_timestamp', desc=True).order('id', desc=True).execute()
             return response.data
         except Exception as e:
             logger.error(f"Error getting log entries: {e}")
             return []
     
+    def get_log_page(self, limit, cursor=None, action=None, actor=None, student_roll=None,
+                     start_date=None, end_date=None, compact=False):
+        """Get one page of log entries, newest first.
+        
+        Keyset pagination on (when_timestamp, id): `cursor` is the
+        (when_timestamp as a datetime, id) of the last entry of the previous
+        page, re-serialized here so only parsed values reach the filter. Fetches
+        one extra row and returns (entries, has_more). Compact pages select
+        identifying fields out of the details JSON instead of the snapshots.
+        """
+        try:
+            query = self.supabase.table('data_log').select(LOG_COLUMNS['compact' if compact else 'full'])
+            if cursor:
+                when, entry_id = cursor[0].isoformat(), int(cursor[1])
+                query = query.or_(f'when_timestamp.lt."{when}",and(when_timestamp.eq."{when}",id.lt.{entry_id})')
+            if action:
+                query = query.eq('action', action)
+            if actor:
+                query = query.eq('who', actor)
+            if student_roll is not None:
+                query = query.or_(','.join(f'{path}.eq.{int(student_roll)}' for path in LOG_ROLL_PATHS))
+            if start_date:
+                query = query.gte('when_timestamp', start_date)
+            if end_date:
+                next_day = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+                query = query.lt('when_timestamp', next_day.strftime('%Y-%m-%d'))
+            response = query.order('when_timestamp', desc=True).order('id', desc=True).limit(limit + 1).execute()
+            return response.data[:limit], len(response.data) > limit
+        except Exception as e:
+            logger.error(f"Error getting log page: {e}")
+            return [], False
+    
+    def get_log_entry(self, log_id):
+        """Get a single log entry by id"""
+        try:
+            response = self.supabase.table('data_log').select('*').eq('id', log_id).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting log entry {log_id}: {e}")
+            return None
+    
+    def get_log_entry_at(self, index):
+        """Get the log entry at a position in the newest-first listing"""
+        try:
+            response = self.supabase.table('data_log').select('*').order('when_timestamp', desc=True).order('id', desc=True).range(index, index).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting log entry at {index}: {e}")
+            return None
+    
     def clear_log(self, cleared_by):
         """Clear all log entries"""
         try:
@@ -335,6 +588,8 @@ class DatabaseManager:
                 'cleared_by': cleared_by
             }
             self.supabase.table('clear_log').insert(clear_data).execute()
+            if self.cache:
+                self.cache.invalidate(('clear_log', 'last'))
             
             # Clear all log entries
             self.supabase.table('data_log').delete().neq('id', 0).execute()
@@ -345,6 +600,9 @@ class DatabaseManager:
     
     def get_clear_log(self):
         """Get the last clear log entry"""
+        return self._cached(('clear_log', 'last'), self._fetch_clear_log)
+    
+    def _fetch_clear_log(self):
         try:
             response = self.supabase.table('clear_log').select('*').order('cleared_at', desc=True).limit(1).execute()
             return response.data[0] if response.data else None
@@ -360,122 +618,261 @@ class DatabaseManager:
                 'student_roll': student_roll,
                 'date': date,
                 'is_present': is_present,
-                'image_data': image_data,
+                'image_data': None,
+                'image_hash': ingest_b64(image_data),
                 'verified_by': verified_by,
                 'verified_at': datetime.now().isoformat() if verified_by else None
             }
             
-            # First check if attendance record already exists
-            existing = self.supabase.table('attendance').select('*').eq('student_roll', student_roll).eq('date', date).execute()
-            
-            if existing.data:
-                # Update existing record
-                response = self.supabase.table('attendance').update(attendance_data).eq('student_roll', student_roll).eq('date', date).execute()
-            else:
-                # Insert new record
-                response = self.supabase.table('attendance').insert(attendance_data).execute()
-            
+            # Single insert-or-update keyed on UNIQUE(student_roll, date)
+            response = self.supabase.table('attendance').upsert(attendance_data, on_conflict='student_roll,date').execute()
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error marking attendance: {e}")
             return None
 
-    def record_attendance_attempt(self, student_roll, date, image_data, verification_result):
-        """Record an attendance attempt with verification result"""
+    def mark_attendance_batch(self, student_rolls, date, verified_by, image_hashes=None):
+        """Mark several students present in one upsert (class check-in).
+
+        `image_hashes` optionally maps a roll to the blob store hash of the
+        frame the student was recognised in. Students already present that
+        day are skipped, so their own photo and verifier stay on the row, and
+        a row's existing image_hash is never replaced. Attempt counters are
+        left as they are. Returns the written rows ([] on failure).
+        """
+        if not student_rolls:
+            return []
+        image_hashes = image_hashes or {}
+        verified_at = datetime.now().isoformat()
         try:
-            # Get existing attendance record
-            existing = self.supabase.table('attendance').select('*').eq('student_roll', student_roll).eq('date', date).execute()
+            response = self.supabase.table('attendance').select('student_roll, is_present, image_hash').eq('date', date).in_('student_roll', list(student_rolls)).execute()
+            existing = {row['student_roll']: row for row in response.data or []}
+            # Every row has the same keys: a bulk upsert nulls keys missing from a row
+            rows = [{
+                'student_roll': roll,
+                'date': date,
+                'is_present': True,
+                'verified_by': verified_by,
+                'verified_at': verified_at,
+                'final_status': 'present',
+                'image_hash': (existing.get(roll) or {}).get('image_hash') or image_hashes.get(roll)
+            } for roll in student_rolls if not (existing.get(roll) or {}).get('is_present')]
+            if not rows:
+                return []
+            response = self.supabase.table('attendance').upsert(rows, on_conflict='student_roll,date').execute()
+            return response.data or []
+        except Exception as e:
+            logger.error(f"Error marking class attendance: {e}")
+            return []
+
+    def record_attendance_attempt(self, student_roll, date, image_data, verification_result, image_phash=None):
+        """Record an attendance attempt with verification result.
+        
+        The image goes to the blob store; the row only keeps its hash (and its
+        perceptual hash `image_phash`, a signed 64-bit int). Uses the
+        record_attendance_attempt SQL function from supabase_setup.sql, which
+        counts the attempt and records it in one statement. Falls back to
+        select-then-write only when the function is not installed; any other
+        error is logged and None returned.
+        """
+        try:
+            image_hash = ingest_b64(image_data)
+        except Exception as e:
+            logger.error(f"Error storing attendance image: {e}")
+            return None
+        return self.record_stored_attendance_attempt(student_roll, date, image_hash, verification_result, image_phash)
+
+    def record_stored_attendance_attempt(self, student_roll, date, image_hash, verification_result, image_phash=None):
+        """Record an attendance attempt whose image is already in the blob store"""
+        try:
+            params = {
+                'p_student_roll': student_roll,
+                'p_date': date,
+                'p_image_hash': image_hash,
+                'p_verification_result': verification_result
+            }
+            if image_phash is not None:
+                params['p_image_phash'] = image_phash
+            response = self.supabase.rpc('record_attendance_attempt', params).execute()
+            data = response.data
+            if isinstance(data, list):
+                return data[0] if data else None
+            return data
+        except Exception as e:
+            if not _is_missing_function(e):
+                # Network errors and timeouts must not fall through to the non-atomic path
+                logger.error(f"Error recording attendance attempt: {e}")
+                return None
+            logger.warning(f"record_attendance_attempt RPC unavailable, using fallback: {e}")
+            return self._record_attendance_attempt_fallback(student_roll, date, image_hash, verification_result, image_phash)
+
+    def _record_attendance_attempt_fallback(self, student_roll, date, image_hash, verification_result, image_phash=None):
+        """Record an attendance attempt with separate select and write queries"""
+        try:
+            # Get existing attempt count
+            existing = self.supabase.table('attendance').select('attempts_remaining').eq('student_roll', student_roll).eq('date', date).execute()
             
-            if existing.data:
-                record = existing.data[0]
-                # Handle both old and new schema
-                attempts_remaining = record.get('attempts_remaining', 3)
-                attempt_history = record.get('attempt_history', [])
-                
-                # Create attempt record
-                attempt_record = {
-                    'timestamp': datetime.now().isoformat(),
-                    'image_data': image_data,
-                    'verification_result': verification_result,
-                    'attempt_number': 4 - attempts_remaining  # 1, 2, or 3
-                }
-                
-                # Add to history
-                attempt_history.append(attempt_record)
-                
-                # Update attempts remaining
-                attempts_remaining -= 1
-                
-                # Determine final status
-                final_status = 'present' if verification_result.get('verified', False) else 'pending'
-                if attempts_remaining <= 0 and not verification_result.get('verified', False):
-                    final_status = 'absent'
-                
-                # Update record
-                update_data = {
-                    'is_present': verification_result.get('verified', False),
-                    'image_data': image_data,
-                    'verified_by': 'ai_verification' if verification_result.get('verified', False) else None,
-                    'verified_at': datetime.now().isoformat() if verification_result.get('verified', False) else None,
-                    'attempts_remaining': attempts_remaining,
-                    'attempt_history': attempt_history,
-                    'final_status': final_status
-                }
-                
-                response = self.supabase.table('attendance').update(update_data).eq('student_roll', student_roll).eq('date', date).execute()
-                return response.data[0] if response.data else None
-            else:
-                # Create new record
-                attempt_record = {
-                    'timestamp': datetime.now().isoformat(),
-                    'image_data': image_data,
-                    'verification_result': verification_result,
-                    'attempt_number': 1
-                }
-                
-                # Create new attendance record with attempt tracking
-                attendance_data = {
-                    'student_roll': student_roll,
-                    'date': date,
-                    'is_present': verification_result.get('verified', False),
-                    'image_data': image_data,
-                    'verified_by': 'ai_verification' if verification_result.get('verified', False) else None,
-                    'verified_at': datetime.now().isoformat() if verification_result.get('verified', False) else None,
-                    'attempts_remaining': 2,  # 3 - 1 = 2 attempts remaining after first attempt
-                    'attempt_history': [attempt_record],
-                    'final_status': 'present' if verification_result.get('verified', False) else 'pending'
-                }
-                
-                response = self.supabase.table('attendance').insert(attendance_data).execute()
-                return response.data[0] if response.data else None
-                
+            # Handle both old and new schema
+            attempts_remaining = 3
+            if existing.data and existing.data[0].get('attempts_remaining') is not None:
+                attempts_remaining = existing.data[0]['attempts_remaining']
+            if attempts_remaining <= 0:
+                return None
+            
+            attempt_number = 4 - attempts_remaining  # 1, 2, or 3
+            attempts_remaining -= 1
+            verified = verification_result.get('verified', False)
+            
+            # Determine final status
+            final_status = 'present' if verified else 'pending'
+            if attempts_remaining <= 0 and not verified:
+                final_status = 'absent'
+            
+            attendance_data = {
+                'student_roll': student_roll,
+                'date': date,
+                'is_present': verified,
+                'image_data': None,
+                'image_hash': image_hash,
+                'verified_by': 'ai_verification' if verified else None,
+                'verified_at': datetime.now().isoformat() if verified else None,
+                'attempts_remaining': attempts_remaining,
+                'final_status': final_status
+            }
+            if image_phash is not None:
+                attendance_data['image_phash'] = image_phash
+            
+            response = self.supabase.table('attendance').upsert(attendance_data, on_conflict='student_roll,date').execute()
+            self._save_attempt(student_roll, date, attempt_number, image_hash, verification_result, image_phash=image_phash)
+            return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error recording attendance attempt: {e}")
             return None
 
-    def get_attendance_attempts(self, student_roll, date):
-        """Get attendance attempts for a student on a specific date"""
+    @staticmethod
+    def _image_ref(image_data):
+        """Reference for a legacy attempt_history image: SHA-256 hex of the stored string"""
+        return hashlib.sha256(image_data.encode('utf-8')).hexdigest() if image_data else None
+
+    @staticmethod
+    def has_image(record):
+        """Whether an attendance record has an image, stored inline or by hash"""
+        return bool(record.get('image_data') or record.get('image_hash'))
+
+    @staticmethod
+    def _resolve_image(image_data, image_hash, size='full'):
+        """Return an image as a data URL from its blob hash, or the legacy inline value.
+
+        size='thumb' returns the blob's thumbnail instead (see image_ingest).
+        """
+        return resolve_image(image_data, image_hash, size)
+
+    def _save_attempt(self, student_roll, date, attempt_number, image_ref, verification_result, attempted_at=None, image_phash=None):
+        """Insert one attendance_attempts row referencing a blob store image"""
+        attempt_data = {
+            'student_roll': student_roll,
+            'date': date,
+            'attempt_number': attempt_number,
+            'verification_result': verification_result,
+            'image_ref': image_ref
+        }
+        if attempted_at:
+            attempt_data['attempted_at'] = attempted_at
+        if image_phash is not None:
+            attempt_data['image_phash'] = image_phash
+        self.supabase.table('attendance_attempts').upsert(
+            attempt_data, on_conflict='student_roll,date,attempt_number', ignore_duplicates=True
+        ).execute()
+        return image_ref
+
+    def get_attendance_attempts(self, student_roll, date, include_history=True, include_images=False):
+        """Get attendance attempts for a student on a specific date.
+        
+        Attempt history carries metadata only (attempt_number, timestamp,
+        verification_result, image_ref); pass include_images=True to embed the
+        images, or fetch one lazily with get_attempt_image().
+        """
         try:
-            response = self.supabase.table('attendance').select('*').eq('student_roll', student_roll).eq('date', date).execute()
+            columns = 'student_roll, date, is_present, verified_by, verified_at, attempts_remaining, final_status'
+            if include_images:
+                columns += ', image_data, image_hash'
+            response = self.supabase.table('attendance').select(columns).eq('student_roll', student_roll).eq('date', date).execute()
             if response.data:
                 record = response.data[0]
                 # Provide defaults for missing columns
-                return {
+                result = {
                     'student_roll': record.get('student_roll'),
                     'date': record.get('date'),
                     'is_present': record.get('is_present', False),
-                    'image_data': record.get('image_data'),
                     'verified_by': record.get('verified_by'),
                     'verified_at': record.get('verified_at'),
                     'attempts_remaining': record.get('attempts_remaining', 3),
-                    'attempt_history': record.get('attempt_history', []),
                     'final_status': record.get('final_status', 'pending')
                 }
+                if include_images:
+                    result['image_data'] = self._resolve_image(record.get('image_data'), record.get('image_hash'))
+                if include_history:
+                    result['attempt_history'] = self._get_attempt_history(student_roll, date, include_images)
+                return result
             return None
         except Exception as e:
             logger.error(f"Error getting attendance attempts: {e}")
             return None
 
+    def _get_attempt_history(self, student_roll, date, include_images=False):
+        """Load attempt rows, falling back to the legacy attempt_history column"""
+        response = self.supabase.table('attendance_attempts').select('attempt_number, attempted_at, verification_result, image_ref').eq('student_roll', student_roll).eq('date', date).order('attempt_number').execute()
+        history = [{
+            'attempt_number': row['attempt_number'],
+            'timestamp': row['attempted_at'],
+            'verification_result': row['verification_result'],
+            'image_ref': row['image_ref'],
+            'has_image': row['image_ref'] is not None
+        } for row in response.data]
+        
+        if not history:
+            # Rows not yet backfilled by migrate_attendance_attempts.py
+            legacy = self.supabase.table('attendance').select('attempt_history').eq('student_roll', student_roll).eq('date', date).execute()
+            legacy_history = legacy.data[0].get('attempt_history') or [] if legacy.data else []
+            for attempt in legacy_history:
+                entry = {
+                    'attempt_number': attempt.get('attempt_number'),
+                    'timestamp': attempt.get('timestamp'),
+                    'verification_result': attempt.get('verification_result'),
+                    'image_ref': self._image_ref(attempt.get('image_data')),
+                    'has_image': bool(attempt.get('image_data'))
+                }
+                if include_images:
+                    entry['image_data'] = attempt.get('image_data')
+                history.append(entry)
+            return history
+        
+        if include_images:
+            for attempt in history:
+                attempt['image_data'] = self._get_attempt_image_by_ref(attempt['image_ref'])
+        return history
+
+    def _get_attempt_image_by_ref(self, image_ref, size='full'):
+        return resolve_image(None, image_ref, size) if image_ref else None
+
+    def get_attempt_image(self, student_roll, date, attempt_number, size='full'):
+        """Get the image submitted with one attendance attempt"""
+        try:
+            response = self.supabase.table('attendance_attempts').select('image_ref').eq('student_roll', student_roll).eq('date', date).eq('attempt_number', attempt_number).execute()
+            if response.data:
+                return self._get_attempt_image_by_ref(response.data[0]['image_ref'], size)
+            
+            # Rows not yet backfilled by migrate_attendance_attempts.py
+            legacy = self.supabase.table('attendance').select('attempt_history').eq('student_roll', student_roll).eq('date', date).execute()
+            if legacy.data:
+                for attempt in legacy.data[0].get('attempt_history') or []:
+                    if attempt.get('attempt_number') == attempt_number:
+                        return attempt.get('image_data')
+            return None
+        except Exception as e:
+            logger.error(f"Error getting attempt image: {e}")
+            return None
+
     def override_attendance_status(self, student_roll, date, new_status, overridden_by):
         """Override attendance status (only for principals)"""
         try:
@@ -514,47 +911,279 @@ class DatabaseManager:
             logger.error(f"Error getting student attendance: {e}")
             return []
     
-    def get_attendance_image(self, student_roll, date):
-        """Get attendance image for a specific date"""
+    def get_attendance_for_rolls(self, student_rolls, start_date=None, end_date=None):
+        """Get attendance records for several students in a single query"""
+        if not student_rolls:
+            return []
         try:
-            response = self.supabase.table('attendance').select('image_data').eq('student_roll', student_roll).eq('date', date).execute()
+            query = self.supabase.table('attendance').select('*').in_('student_roll', list(student_rolls))
+            
+            if start_date:
+                query = query.gte('date', start_date)
+            if end_date:
+                query = query.lte('date', end_date)
+            
+            response = query.order('date', desc=True).execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error getting attendance for rolls: {e}")
+            return []
+    
+    def get_class_roster(self, class_name, today=None, window_days=30, recent_days=7):
+        """Get a class roster with per-student attendance summaries.
+        
+        Fetches the students and one attendance range covering all of their
+        rolls (two queries in total), then derives each summary in memory.
+        Returns a list of {'student': row, 'attendance': summary} dicts.
+        """
+        today_dt = datetime.strptime(today, '%Y-%m-%d') if today else datetime.now()
+        today = today_dt.strftime('%Y-%m-%d')
+        window_start = (today_dt - timedelta(days=window_days)).strftime('%Y-%m-%d')
+        recent_start = (today_dt - timedelta(days=recent_days)).strftime('%Y-%m-%d')
+        
+        students = self.get_class_students(class_name)
+        records = self.get_attendance_for_rolls([s['roll'] for s in students], window_start, today)
+        
+        # Group records by roll; they arrive newest first and keep that order
+        records_by_roll = {}
+        for record in records:
+            records_by_roll.setdefault(record['student_roll'], []).append(record)
+        
+        roster = []
+        for student in students:
+            student_records = records_by_roll.get(student['roll'], [])
+            roster.append({
+                'student': student,
+                'attendance': self._summarize_attendance(student_records, today, recent_start)
+            })
+        return roster
+    
+    @staticmethod
+    def _summarize_attendance(records, today, recent_start):
+        """Build the teacher dashboard attendance summary from newest-first records"""
+        summary = {
+            'attendance_today': False,
+            'has_attendance_image': False,
+            'attendance_verified': False,
+            'attendance_date': None
+        }
+        
+        today_record = next((r for r in records if r['date'] == today), None)
+        if today_record:
+            summary['attendance_today'] = today_record['is_present']
+            summary['has_attendance_image'] = DatabaseManager.has_image(today_record)
+            summary['attendance_verified'] = today_record['verified_by'] is not None
+            summary['attendance_date'] = today_record['date']
+        else:
+            # Most recent unverified attendance image in the recent window
+            latest_unverified = next(
+                (r for r in records if r['date'] >= recent_start and DatabaseManager.has_image(r) and not r['verified_by']),
+                None
+            )
+            if latest_unverified:
+                summary['has_attendance_image'] = True
+                summary['attendance_date'] = latest_unverified['date']
+        
+        present_count = sum(1 for record in records if record['is_present'])
+        total_days = len(records)
+        summary['attendance_percentage'] = round((present_count / total_days) * 100, 1) if total_days > 0 else 0
+        return summary
+    
+    def get_attendance_calendar(self, student_roll, start_date, end_date):
+        """Get a student's attendance status per date over a range in a single query.
+        
+        Returns a dict mapping 'YYYY-MM-DD' to 'present' or 'uploaded'.
+        """
+        try:
+            response = self.supabase.table('attendance').select('date, is_present, image_data, image_hash').eq('student_roll', student_roll).gte('date', start_date).lte('date', end_date).execute()
+            calendar_days = {}
+            for record in response.data:
+                if record['is_present']:
+                    calendar_days[record['date']] = 'present'
+                elif self.has_image(record):
+                    calendar_days[record['date']] = 'uploaded'
+            return calendar_days
+        except Exception as e:
+            logger.error(f"Error getting attendance calendar for student {student_roll}: {e}")
+            return {}
+    
+    def get_attendance_image(self, student_roll, date, size='full'):
+        """Get attendance image for a specific date ('full' or 'thumb')"""
+        try:
+            response = self.supabase.table('attendance').select('image_data, image_hash').eq('student_roll', student_roll).eq('date', date).execute()
             if response.data:
-                return response.data[0]['image_data']
+                record = response.data[0]
+                return self._resolve_image(record.get('image_data'), record.get('image_hash'), size)
             return None
         except Exception as e:
             logger.error(f"Error getting attendance image: {e}")
             return None
 
-    def update_profile_picture(self, student_roll, profile_picture):
-        """Update student's profile picture"""
+    def update_profile_picture(self, student_roll, profile_picture, face_embedding=None):
+        """Update student's profile picture and the face embedding computed from it"""
+        try:
+            image_hash = ingest_b64(profile_picture)
+        except Exception as e:
+            logger.error(f"Error storing profile picture for student {student_roll}: {e}")
+            return None
+        return self.update_stored_profile_picture(student_roll, image_hash, face_embedding)
+
+    def update_stored_profile_picture(self, student_roll, image_hash, face_embedding=None):
+        """Point a student's profile picture at a blob store image"""
         try:
             response = self.supabase.table('students').update({
-                'profile_picture': profile_picture,
-                'has_profile_picture': True
+                'profile_picture': None,
+                'profile_picture_hash': image_hash,
+                'has_profile_picture': True,
+                'face_embedding': face_embedding
             }).eq('roll', student_roll).execute()
+            self._invalidate_student(roll=student_roll)
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error updating profile picture for student {student_roll}: {e}")
             return None
 
-    def get_profile_picture(self, student_roll):
-        """Get student's profile picture"""
+    def update_face_embedding(self, student_roll, face_embedding, picture_hash=None):
+        """Store the face embedding computed from the profile picture `picture_hash`.
+
+        Nothing is written if the picture has changed since (None stands for
+        a legacy inline picture, which has no hash).
+        """
         try:
-            response = self.supabase.table('students').select('profile_picture, has_profile_picture').eq('roll', student_roll).execute()
+            query = self.supabase.table('students').update({'face_embedding': face_embedding}).eq('roll', student_roll)
+            if picture_hash:
+                query = query.eq('profile_picture_hash', picture_hash)
+            else:
+                query = query.is_('profile_picture_hash', 'null')
+            query.execute()
+            self._invalidate_student(roll=student_roll)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating face embedding for student {student_roll}: {e}")
+            return False
+
+    def get_profile_picture(self, student_roll, size='full'):
+        """Get student's profile picture ('full' or 'thumb')"""
+        try:
+            response = self.supabase.table('students').select('profile_picture, profile_picture_hash, has_profile_picture').eq('roll', student_roll).execute()
             if response.data:
-                return response.data[0]
+                record = response.data[0]
+                record['profile_picture'] = self._resolve_image(record.get('profile_picture'), record.get('profile_picture_hash'), size)
+                return record
             return None
         except Exception as e:
             logger.error(f"Error getting profile picture for student {student_roll}: {e}")
             return None
 
+    # Attendance verification jobs
+    def create_attendance_job(self, job_id, student_roll, date, image_hash, submitted_by):
+        """Insert a queued verification job.
+
+        Returns the row, or None if it could not be written (including when
+        the student already has an active job for the date: the table allows
+        one queued/running job per student per day).
+        """
+        try:
+            response = self.supabase.table('attendance_jobs').insert({
+                'id': job_id,
+                'student_roll': student_roll,
+                'date': date,
+                'status': 'queued',
+                'image_hash': image_hash,
+                'submitted_by': submitted_by
+            }).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error creating attendance job: {e}")
+            return None
+
+    def update_attendance_job(self, job_id, status, result=None, error=None):
+        """Move a job to a new status, storing its result or error"""
+        try:
+            update_data = {'status': status, 'updated_at': datetime.now(timezone.utc).isoformat()}
+            if result is not None:
+                update_data['result'] = result
+            if error is not None:
+                update_data['error'] = error
+            response = self.supabase.table('attendance_jobs').update(update_data).eq('id', job_id).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error updating attendance job {job_id}: {e}")
+            return None
+
+    def renew_attendance_job(self, job_id):
+        """Refresh a running job's updated_at. False if it is no longer running
+        (expired by expire_attendance_jobs), in which case its result must be dropped.
+        """
+        try:
+            response = self.supabase.table('attendance_jobs').update({
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }).eq('id', job_id).eq('status', 'running').execute()
+            return bool(response.data)
+        except Exception as e:
+            logger.error(f"Error renewing attendance job {job_id}: {e}")
+            return False
+
+    def get_attendance_job(self, job_id):
+        try:
+            response = self.supabase.table('attendance_jobs').select('*').eq('id', job_id).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting attendance job {job_id}: {e}")
+            return None
+
+    def get_active_attendance_job(self, student_roll, date):
+        """The student's queued or running job for a date, if any"""
+        try:
+            query = self.supabase.table('attendance_jobs').select('*').eq('student_roll', student_roll).eq('date', date)
+            response = query.in_('status', ['queued', 'running']).limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error getting active attendance job: {e}")
+            return None
+
+    def expire_attendance_jobs(self, student_roll, date, stale_before):
+        """Fail the student's queued/running jobs last updated before `stale_before`.
+
+        Such a job's worker process is gone; failing it frees the student's
+        active-job slot. No attempt was recorded for it.
+        """
+        try:
+            query = self.supabase.table('attendance_jobs').update({
+                'status': 'failed',
+                'error': 'abandoned',
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }).eq('student_roll', student_roll).eq('date', date).in_('status', ['queued', 'running'])
+            response = query.lt('updated_at', stale_before).execute()
+            return len(response.data or [])
+        except Exception as e:
+            logger.error(f"Error expiring attendance jobs: {e}")
+            return 0
+
+    def get_student_attendance_phashes(self, student_roll, limit=5):
+        """Get the stored phashes of a student's previous attendance images"""
+        try:
+            response = self.supabase.table('attendance').select('image_phash').eq('student_roll', student_roll).not_.is_('image_phash', 'null').order('date', desc=True).limit(limit).execute()
+            return [record['image_phash'] for record in response.data]
+        except Exception as e:
+            logger.error(f"Error getting attendance phashes for student {student_roll}: {e}")
+            return []
+
+    def get_attendance_phashes(self, date):
+        """Get (student_roll, image_phash) for every attempt submitted on a date, school-wide"""
+        try:
+            response = self.supabase.table('attendance_attempts').select('student_roll, image_phash').eq('date', date).not_.is_('image_phash', 'null').execute()
+            return [(record['student_roll'], record['image_phash']) for record in response.data]
+        except Exception as e:
+            logger.error(f"Error getting attendance phashes for {date}: {e}")
+            return []
+
     def get_student_attendance_images(self, student_roll, limit=5):
         """Get previous attendance images for a student for AI comparison"""
         try:
-            response = self.supabase.table('attendance').select('image_data').eq('student_roll', student_roll).not_.is_('image_data', 'null').order('date', desc=True).limit(limit).execute()
-            if response.data:
-                return [record['image_data'] for record in response.data if record['image_data']]
-            return []
+            response = self.supabase.table('attendance').select('image_data, image_hash').eq('student_roll', student_roll).or_('image_data.not.is.null,image_hash.not.is.null').order('date', desc=True).limit(limit).execute()
+            images = [self._resolve_image(record.get('image_data'), record.get('image_hash')) for record in response.data]
+            return [image for image in images if image]
         except Exception as e:
             logger.error(f"Error getting attendance images for student {student_roll}: {e}")
             return []
@@ -0,0 +1,125 @@
+import io
+import logging
+import os
+
+from blob_store import blob_store, decode_image_b64, to_data_url
+
+logger = logging.getLogger(__name__)
+
+# Stored photos are re-encoded as JPEG no larger than this on either side
+MAX_IMAGE_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '1280'))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+
+# Review-grid rendition, stored next to the full image as its 'thumb' variant
+THUMB_SIDE = int(os.getenv('IMAGE_THUMB_SIDE', '160'))
+THUMB_QUALITY = int(os.getenv('IMAGE_THUMB_QUALITY', '70'))
+
+THUMB = 'thumb'
+IMAGE_SIZES = ('full', THUMB)
+
+ORIENTATION_TAG = 0x0112
+
+
+def _open_upright(raw, max_side):
+    """Decode an image, apply its EXIF orientation and convert to RGB.
+
+    Returns (image, normal): `normal` is True when the upload already is an
+    upright JPEG within max_side, so it can be stored as sent. (None, False)
+    if it cannot be read.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None, False
+    try:
+        image = Image.open(io.BytesIO(raw))
+        normal = (image.format == 'JPEG' and max(image.size) <= max_side
+                  and image.getexif().get(ORIENTATION_TAG, 1) == 1)
+        # JPEG decodes at a reduced scale directly when the target is much smaller
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        return image.convert('RGB'), normal
+    except Exception as e:
+        logger.warning(f"Could not decode image for normalization: {e}")
+        return None, False
+
+
+def _encode_jpeg(image, max_side, quality):
+    image = image.copy()
+    image.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def normalize_image(raw):
+    """Upright, resolution-capped JPEG of an upload, plus its thumbnail.
+
+    Returns (image, thumbnail). When PIL is not installed or the bytes do
+    not decode, the upload is kept as sent and thumbnail is None.
+    """
+    image, normal = _open_upright(raw, MAX_IMAGE_SIDE)
+    if image is None:
+        return raw, None
+    thumbnail = _encode_jpeg(image, THUMB_SIDE, THUMB_QUALITY)
+    if normal:
+        # Re-encoding a small upright JPEG would only lose quality
+        return raw, thumbnail
+    return _encode_jpeg(image, MAX_IMAGE_SIDE, IMAGE_QUALITY), thumbnail
+
+
+def ingest_image(raw):
+    """Normalize an upload and store it with its thumbnail.
+
+    Returns (digest, image): the blob store hash and the normalized bytes,
+    which are what verification should see.
+    """
+    image, thumbnail = normalize_image(raw)
+    return store_normalized(image, thumbnail), image
+
+
+def store_normalized(image, thumbnail):
+    """Store a normalize_image() result; returns the blob store hash"""
+    digest = blob_store.put(image)
+    if thumbnail is not None:
+        blob_store.put_variant(digest, THUMB, thumbnail)
+    return digest
+
+
+def ingest_b64(image_b64):
+    """ingest_image for a base64 / data URL upload; returns the digest (None for empty input)"""
+    if not image_b64:
+        return None
+    return ingest_image(decode_image_b64(image_b64))[0]
+
+
+def get_thumbnail(digest):
+    """Thumbnail bytes for a stored image, made and kept on first use for
+    images stored before ingest. None if the image is missing or unreadable.
+    """
+    thumbnail = blob_store.get_variant(digest, THUMB)
+    if thumbnail is not None:
+        return thumbnail
+    raw = blob_store.get(digest)
+    image = _open_upright(raw, THUMB_SIDE)[0] if raw is not None else None
+    if image is None:
+        return None
+    thumbnail = _encode_jpeg(image, THUMB_SIDE, THUMB_QUALITY)
+    blob_store.put_variant(digest, THUMB, thumbnail)
+    return thumbnail
+
+
+def resolve_image(image_data, image_hash, size='full'):
+    """An image as a data URL from its blob hash, or the legacy inline value.
+
+    With size='thumb' a blob-stored image resolves to its thumbnail (falling
+    back to the full image if none can be made); inline legacy images are
+    always returned full.
+    """
+    if image_hash:
+        if size == THUMB:
+            thumbnail = get_thumbnail(image_hash)
+            if thumbnail is not None:
+                return to_data_url(thumbnail)
+        return blob_store.get_data_url(image_hash)
+    return image_data
@@ -0,0 +1,206 @@
+import io
+import logging
+import threading
+import time
+
+from phash_index import hamming, from_signed64, to_signed64
+
+logger = logging.getLogger(__name__)
+
+# Images are analysed at this size; all checks are per-pixel ratios or
+# statistics, which a downsampled photo preserves
+ANALYSIS_SIDE = 256
+
+# Same cut-offs as VerificationEngine.enhanced_verification
+MIN_IMAGE_SIDE = 100
+PREVIOUS_PHASH_MAX_DISTANCE = 15
+MIN_SKIN_PERCENTAGE = 5
+
+# OpenCV's skin range H 0-20 (of 180), S >= 20, V >= 70 on PIL's 0-255 hue scale
+SKIN_MAX_HUE = 28
+SKIN_MIN_SATURATION = 20
+SKIN_MIN_VALUE = 70
+
+STAGES = ('decode', 'phash', 'profile', 'quality', 'skin', 'previous', 'total')
+
+
+class LeanVerifier:
+    """Attendance photo verification on PIL + numpy only.
+
+    For deployments that cannot ship OpenCV / face_recognition (the Vercel
+    lambda). Follows the ladder of VerificationEngine.enhanced_verification
+    without Haar detection: a precomputed profile phash match, quality
+    checks (size, lighting, contrast, sharpness), a vectorized skin-tone
+    ratio and a phash match against the student's previous photos. The
+    phash is computed with a numpy DCT and equals imagehash.phash, so values
+    are interchangeable with the other apps' image_phash.
+
+    Every result carries per-stage timings in ms; `stats()` aggregates them
+    with the cold-start (import) time.
+    """
+
+    def __init__(self, brightness_range=(30, 225), min_contrast=10, min_sharpness=10,
+                 profile_phash_threshold=20):
+        self.brightness_range = brightness_range
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.profile_phash_threshold = profile_phash_threshold
+        self._libs = None
+        self._dct = None
+        self.cold_start_ms = None
+        self._lock = threading.Lock()
+        self._timings = {stage: [0, 0.0, 0.0] for stage in STAGES}  # count, total, max
+
+    def load(self):
+        """Import PIL and numpy and build the DCT matrix; None if unavailable"""
+        if self._libs is None:
+            started = time.perf_counter()
+            try:
+                import numpy as np
+                from PIL import Image, ImageOps
+                self._libs = (np, Image, ImageOps)
+                n = np.arange(32)
+                # DCT-II basis: dct(x) == 2 * (C @ x) for scipy's unnormalized DCT
+                self._dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 64)
+            except ImportError as e:
+                logger.warning(f"Lean verifier unavailable: {e}")
+                self._libs = False
+            self.cold_start_ms = round((time.perf_counter() - started) * 1000, 2)
+            logger.info(f"Lean verifier loaded in {self.cold_start_ms} ms")
+        return self._libs or None
+
+    def _decode(self, raw):
+        np, Image, ImageOps = self._libs
+        image = Image.open(io.BytesIO(raw))
+        original_size = image.size
+        image.draft('RGB', (ANALYSIS_SIDE, ANALYSIS_SIDE))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+        return image, original_size
+
+    def image_phash(self, image):
+        """Unsigned 64-bit perceptual hash of a PIL image (imagehash.phash compatible)"""
+        np, Image = self._libs[0], self._libs[1]
+        pixels = np.asarray(image.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float64)
+        low = (self._dct @ pixels @ self._dct.T)[:8, :8]
+        bits = (low > np.median(low)).ravel()
+        return int(np.packbits(bits).view('>u8')[0])
+
+    def phash_of(self, raw):
+        """Signed phash of raw image bytes (as stored in image_phash), or None"""
+        if not self.load():
+            return None
+        try:
+            return to_signed64(self.image_phash(self._decode(raw)[0]))
+        except Exception as e:
+            logger.error(f"Could not hash image: {e}")
+            return None
+
+    def verify(self, raw, profile_phash=None, previous_phashes=()):
+        """Verify raw capture bytes.
+
+        `profile_phash` / `previous_phashes` are stored (signed) phashes.
+        Returns (result, image_phash): result has 'verified', 'method',
+        'reason' and 'timings_ms'; image_phash is the capture's signed phash.
+        """
+        timings = {}
+        started = time.perf_counter()
+        mark = [started]
+
+        def lap(stage):
+            now = time.perf_counter()
+            timings[stage] = round((now - mark[0]) * 1000, 2)
+            mark[0] = now
+
+        def finish(verified, method, reason, image_phash=None, stage=None):
+            if stage:
+                lap(stage)
+            timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+            self._record(timings)
+            return {
+                'verified': verified,
+                'method': method,
+                'reason': reason,
+                'timings_ms': timings
+            }, image_phash
+
+        if not self.load():
+            return finish(False, 'none', 'ai_libraries_unavailable')
+        np = self._libs[0]
+
+        try:
+            image, (width, height) = self._decode(raw)
+            lap('decode')
+
+            # Hashed up front: it is stored with the attempt whatever the outcome
+            current_hash = self.image_phash(image)
+            image_phash = to_signed64(current_hash)
+            lap('phash')
+
+            # Precomputed profile picture phash (weak identity check, as in
+            # VerificationEngine.faces_match without face_recognition)
+            if profile_phash is not None:
+                distance = hamming(current_hash, from_signed64(profile_phash))
+                lap('profile')
+                if distance <= self.profile_phash_threshold:
+                    return finish(True, 'profile_phash_comparison', 'similar_to_profile_picture', image_phash)
+
+            if height < MIN_IMAGE_SIDE or width < MIN_IMAGE_SIDE:
+                return finish(False, 'image_quality_check', 'image_too_small', image_phash, stage='quality')
+
+            gray = np.asarray(image.convert('L'), dtype=np.float32)
+            min_brightness, max_brightness = self.brightness_range
+            mean_brightness = float(gray.mean())
+            if mean_brightness < min_brightness or mean_brightness > max_brightness:
+                return finish(False, 'image_quality_check', 'poor_lighting', image_phash, stage='quality')
+            if float(gray.std()) < self.min_contrast:
+                return finish(False, 'image_quality_check', 'low_contrast', image_phash, stage='quality')
+
+            # Variance of the 4-neighbour Laplacian: low for blurred frames
+            laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1]
+                         - gray[1:-1, :-2] - gray[1:-1, 2:])
+            if float(laplacian.var()) < self.min_sharpness:
+                return finish(False, 'image_quality_check', 'blurry_image', image_phash, stage='quality')
+            lap('quality')
+
+            if 0.5 <= width / height <= 2.0:
+                hsv = np.asarray(image.convert('HSV'))
+                skin = ((hsv[..., 0] <= SKIN_MAX_HUE) & (hsv[..., 1] >= SKIN_MIN_SATURATION)
+                        & (hsv[..., 2] >= SKIN_MIN_VALUE))
+                skin_percentage = float(skin.mean()) * 100
+                lap('skin')
+                if skin_percentage > MIN_SKIN_PERCENTAGE:
+                    return finish(True, 'skin_tone_analysis', 'likely_human_photo', image_phash)
+
+            for previous in previous_phashes:
+                if previous is not None and hamming(current_hash, from_signed64(previous)) <= PREVIOUS_PHASH_MAX_DISTANCE:
+                    return finish(True, 'perceptual_hash_comparison', 'similar_to_previous_attendance', image_phash, stage='previous')
+
+            return finish(False, 'enhanced_verification', 'no_verification_criteria_met', image_phash, stage='previous')
+        except Exception as e:
+            return finish(False, 'enhanced_verification', f'verification_error: {str(e)}')
+
+    def _record(self, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                entry = self._timings[stage]
+                entry[0] += 1
+                entry[1] += ms
+                entry[2] = max(entry[2], ms)
+
+    def stats(self):
+        """Cold-start time and per-stage call count / mean / max in ms"""
+        with self._lock:
+            stages = {
+                stage: {
+                    'calls': count,
+                    'mean_ms': round(total / count, 2) if count else None,
+                    'max_ms': round(worst, 2) if count else None
+                }
+                for stage, (count, total, worst) in self._timings.items()
+            }
+        return {
+            'available': bool(self._libs),
+            'cold_start_ms': self.cold_start_ms,
+            'stages': stages
+        }
@@ -0,0 +1,277 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter:
+    """Write-behind queue for data_log entries.
+
+    `log()` stamps an entry, appends it to a local spill file and returns;
+    a background thread inserts queued entries in batches once `batch_size`
+    are waiting or every `flush_interval` seconds. The spill file holds
+    every entry not yet confirmed by the database, so entries queued before
+    a crash are replayed on the next start. Each entry carries an
+    entry_uuid, which makes a replayed insert a no-op.
+
+    Each process spills to its own file (`<spill_path stem>.<pid>.jsonl`);
+    on start a writer also takes over the files of processes that are no
+    longer running. At most `max_queue` entries wait; later ones are
+    dropped (and counted) until the database catches up. A batch that
+    fails `max_batch_failures` times in a row is retried one entry at a
+    time, and entries that fail on their own while others go through are
+    moved to `<spill file>.rejected` so they stop blocking the queue.
+    """
+
+    def __init__(self, insert_batch, spill_path, batch_size=50, flush_interval=2.0,
+                 max_queue=10000, max_batch_failures=3):
+        self.insert_batch = insert_batch
+        self.spill_root, self.spill_ext = os.path.splitext(spill_path)
+        self.spill_ext = self.spill_ext or '.jsonl'
+        self.shared_spill_path = spill_path
+        self.spill_path = f"{self.spill_root}.{os.getpid()}{self.spill_ext}"
+        self.rejected_path = f"{self.spill_path}.rejected"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_batch_failures = max_batch_failures
+        self._queue = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._spill = None
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._batch_failures = 0
+
+    def start(self):
+        """Replay this and dead processes' spilled entries and start the background flusher"""
+        with self._lock:
+            if self._thread:
+                return
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            self._queue = self._read_spill(self.spill_path)
+            claimed = self._claim_orphan_spills()
+            if self._queue:
+                logger.info(f"Replaying {len(self._queue)} spilled audit log entries")
+            # Own file first, then the claimed ones can go
+            self._rewrite_spill()
+            for path in claimed:
+                os.remove(path)
+            self._spill = open(self.spill_path, 'a', encoding='utf-8')
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def log(self, action, details, who):
+        """Queue a log entry; the insert happens off the request path.
+
+        Starts the writer if the app has not done so yet.
+        """
+        entry = {
+            'entry_uuid': str(uuid.uuid4()),
+            'action': action,
+            'details': details,
+            'who': who,
+            # Event time, not flush time, so the log keeps request order
+            'when_timestamp': datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        }
+        try:
+            line = json.dumps(entry)
+        except (TypeError, ValueError):
+            # Values JSON cannot hold (dates, sets, ...) are logged as their str()
+            line = json.dumps(entry, default=str)
+            entry = json.loads(line)
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.error(f"Audit log queue full ({self.max_queue}); dropped {self.dropped} entries so far")
+                return entry
+            # Flushed to the OS so the entry survives a process crash
+            self._spill.write(line + '\n')
+            self._spill.flush()
+            self._queue.append(entry)
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.set()
+        return entry
+
+    def flush(self):
+        """Insert everything queued so far. Returns False if an insert failed."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._queue[:self.batch_size]
+                if not batch:
+                    return True
+                if self.insert_batch(batch):
+                    self._batch_failures = 0
+                    self._done(batch)
+                    continue
+                self.failed_flushes += 1
+                self._batch_failures += 1
+                if self._batch_failures < self.max_batch_failures or not self._isolate_rejected(batch):
+                    return False
+                self._batch_failures = 0
+
+    def _done(self, batch, rejected=()):
+        """Drop written (and rejected) entries from the queue and the spill file"""
+        finished = {entry['entry_uuid'] for entry in batch}
+        with self._lock:
+            self._queue = [entry for entry in self._queue if entry['entry_uuid'] not in finished]
+            self._rewrite_spill()
+        self.flushed += len(batch) - len(rejected)
+
+    def _isolate_rejected(self, batch):
+        """Insert a failing batch entry by entry and set aside the entries that fail.
+
+        Returns False, keeping everything queued, when no entry goes through
+        (the database is down rather than the entries being bad).
+        """
+        rejected = [entry for entry in batch if not self.insert_batch([entry])]
+        if len(rejected) == len(batch):
+            return False
+        with open(self.rejected_path, 'a', encoding='utf-8') as f:
+            for entry in rejected:
+                f.write(json.dumps(entry) + '\n')
+        self.rejected += len(rejected)
+        logger.error(f"Set aside {len(rejected)} audit log entries the database refuses in {self.rejected_path}")
+        self._done(batch, rejected)
+        return True
+
+    def close(self):
+        """Stop the background thread and flush what is left (shutdown hook)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval * 2)
+        if not self.flush():
+            logger.warning(f"{self.pending()} audit log entries left in {self.spill_path} for the next start")
+        with self._lock:
+            if self._spill:
+                self._spill.close()
+                self._spill = None
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'flushed': self.flushed,
+            'failed_flushes': self.failed_flushes,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Audit log flush failed: {e}")
+
+    def _claim_orphan_spills(self):
+        """Queue the entries of spill files left by processes that are gone.
+
+        Each file is renamed before it is read, so when several workers
+        start together only one of them replays it. Returns the claimed
+        paths, to remove once this process's spill file holds the entries.
+        """
+        claimed = []
+        # '<stem>.<pid>.jsonl' per process, and '<stem>.jsonl' from before per-process files
+        for path in glob.glob(f"{glob.escape(self.spill_root)}.*{self.spill_ext}") + [self.shared_spill_path]:
+            if path == self.spill_path:
+                continue
+            if path != self.shared_spill_path:
+                pid = path[len(self.spill_root) + 1:-len(self.spill_ext)]
+                if not pid.isdigit() or _process_alive(int(pid)):
+                    continue
+            claim = f"{path}.claimed-{os.getpid()}"
+            try:
+                os.replace(path, claim)
+            except FileNotFoundError:
+                continue  # Not there, or another worker took it
+            self._queue.extend(self._read_spill(claim))
+            claimed.append(claim)
+        return claimed
+
+    def _read_spill(self, path):
+        entries = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a crash mid-write
+                        logger.warning('Skipping truncated audit log spill line')
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _rewrite_spill(self):
+        """Replace the spill file with the entries still queued (caller holds _lock)"""
+        directory = os.path.dirname(self.spill_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for entry in self._queue:
+                f.write(json.dumps(entry, default=str) + '\n')
+        was_open = self._spill is not None
+        if was_open:
+            self._spill.close()
+        os.replace(tmp_path, self.spill_path)
+        self._spill = open(self.spill_path, 'a', encoding='utf-8') if was_open else None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    return True
+
+
+def create_log_writer(insert_batch):
+    """Create the writer configured by the AUDIT_LOG_* variables.
+
+    It is started by the app once it serves requests (or by the first log()),
+    not here: a verification worker importing the app must not replay spills.
+    """
+    spill_path = os.getenv('AUDIT_LOG_SPILL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_log_spill.jsonl'))
+    writer = AuditLogWriter(
+        insert_batch,
+        spill_path,
+        batch_size=int(os.getenv('AUDIT_LOG_BATCH_SIZE', '50')),
+        flush_interval=float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', '2')),
+        max_queue=int(os.getenv('AUDIT_LOG_MAX_QUEUE', '10000'))
+    )
+    atexit.register(writer.close)
+    return writer
+
+
+# Global audit log writer, flushing into data_log
+audit_log_writer = create_log_writer(db.add_log_entries)
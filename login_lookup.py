@@ -0,0 +1,22 @@
+def first_name_key(name):
+    """Normalized first-name key used for student login lookups"""
+    parts = (name or '').split()
+    return parts[0].lower() if parts else ''
+
+
+def match_student_login(candidates, password, roll=None):
+    """Pick the student a first-name login refers to.
+
+    `candidates` are the students whose first name matched. When several of
+    them share the password, the login is ambiguous unless `roll` narrows it
+    to one. Returns (student, None) on success, or (None, reason) where
+    reason is 'invalid_credentials' or 'ambiguous_first_name'.
+    """
+    matches = [s for s in candidates if s.get('password') == password]
+    if roll not in (None, ''):
+        matches = [s for s in matches if str(s['roll']) == str(roll)]
+    if not matches:
+        return None, 'invalid_credentials'
+    if len(matches) > 1:
+        return None, 'ambiguous_first_name'
+    return matches[0], None
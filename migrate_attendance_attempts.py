@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Database migration script to move attendance attempt history out of the
+attempt_history JSONB column into the attendance_attempts table
+"""
+
+import argparse
+import os
+from supabase import create_client, Client
+from dotenv import load_dotenv
+import logging
+from blob_store import blob_store
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Attendance rows fetched per request while backfilling
+BATCH_SIZE = 50
+
+def migrate_attendance_attempts(clear_history=False):
+    """Backfill attendance_attempts and the blob store from attempt_history"""
+    try:
+        # Initialize Supabase client
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_KEY')
+
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+
+        supabase: Client = create_client(supabase_url, supabase_key)
+        logger.info("Supabase client initialized successfully")
+
+        # Create the attempts table (see section 10 of supabase_setup.sql)
+        try:
+            migration_sql = """
+            CREATE TABLE IF NOT EXISTS attendance_attempts (
+                id SERIAL PRIMARY KEY,
+                student_roll INTEGER NOT NULL,
+                date DATE NOT NULL,
+                attempt_number INTEGER NOT NULL,
+                attempted_at TIMESTAMP DEFAULT NOW(),
+                verification_result JSONB,
+                image_ref VARCHAR(64),
+                UNIQUE(student_roll, date, attempt_number)
+            );
+            """
+            supabase.rpc('exec_sql', {'sql': migration_sql}).execute()
+            logger.info("attendance_attempts table created")
+        except Exception as e:
+            logger.warning(f"Table creation warning (run supabase_setup.sql manually if the tables are missing): {e}")
+
+        rows_migrated = 0
+        attempts_migrated = 0
+        last_id = 0
+
+        while True:
+            # Keyset pagination on id so each batch is a bounded download
+            response = supabase.table('attendance').select('id, student_roll, date, attempt_history').gt('id', last_id).order('id').limit(BATCH_SIZE).execute()
+            if not response.data:
+                break
+
+            for record in response.data:
+                last_id = record['id']
+                history = record.get('attempt_history') or []
+                if not history:
+                    continue
+
+                attempts = []
+                for number, attempt in enumerate(history, 1):
+                    # The blob store keeps one copy however many attempts reuse an image
+                    image_ref = blob_store.put_b64(attempt.get('image_data'))
+                    attempts.append({
+                        'student_roll': record['student_roll'],
+                        'date': record['date'],
+                        'attempt_number': attempt.get('attempt_number') or number,
+                        'attempted_at': attempt.get('timestamp'),
+                        'verification_result': attempt.get('verification_result'),
+                        'image_ref': image_ref
+                    })
+
+                supabase.table('attendance_attempts').upsert(
+                    attempts, on_conflict='student_roll,date,attempt_number', ignore_duplicates=True
+                ).execute()
+
+                if clear_history:
+                    supabase.table('attendance').update({'attempt_history': []}).eq('id', record['id']).execute()
+
+                rows_migrated += 1
+                attempts_migrated += len(attempts)
+
+        logger.info(f"✅ Migrated {attempts_migrated} attempts from {rows_migrated} attendance rows")
+
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clear-history', action='store_true',
+                        help='empty attempt_history on each row after it has been copied')
+    args = parser.parse_args()
+    migrate_attendance_attempts(clear_history=args.clear_history)
@@ -0,0 +1,136 @@
+import threading
+import time
+
+# Perceptual hashes are 64-bit. Postgres BIGINT is signed, so values are
+# stored in two's complement and compared as unsigned ints.
+_UINT64 = 1 << 64
+
+
+def phash_to_int(image_hash):
+    """Unsigned 64-bit int for an imagehash.ImageHash"""
+    return int(str(image_hash), 16)
+
+
+def to_signed64(value):
+    """Unsigned 64-bit phash -> value that fits a BIGINT column"""
+    return value - _UINT64 if value >= 1 << 63 else value
+
+
+def from_signed64(value):
+    """BIGINT column value -> unsigned 64-bit phash"""
+    return value + _UINT64 if value < 0 else value
+
+
+if hasattr(int, 'bit_count'):
+    def hamming(a, b):
+        """Number of differing bits between two 64-bit phashes"""
+        return (a ^ b).bit_count()
+else:  # Python < 3.10
+    def hamming(a, b):
+        """Number of differing bits between two 64-bit phashes"""
+        return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes under Hamming distance.
+
+    Each node keeps children keyed by their distance to it; a radius search
+    only descends into children whose key is within `radius` of the query's
+    distance to the node (triangle inequality), so a lookup touches a small
+    fraction of the stored hashes.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, [item], {}]
+        if self._root is None:
+            self._root = node
+            self.size += 1
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                self.size += 1
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                self.size += 1
+                return
+            current = child
+
+    def search(self, value, radius):
+        """Return [(distance, item)] for every stored hash within `radius`"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class ReplayIndex:
+    """Per-day BK-trees of submitted photo phashes, school-wide.
+
+    `load_day(date)` returns (student_roll, phash) pairs already stored for
+    a date (phash as stored, i.e. signed). A day's tree is built from it on
+    first use and rebuilt after `refresh_interval` seconds so submissions
+    made through other worker processes are picked up; submissions through
+    this process are added immediately.
+    """
+
+    def __init__(self, load_day, max_distance=5, refresh_interval=30):
+        self.load_day = load_day
+        self.max_distance = max_distance
+        self.refresh_interval = refresh_interval
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def _tree(self, date):
+        with self._lock:
+            entry = self._days.get(date)
+            if entry and time.monotonic() - entry[0] < self.refresh_interval:
+                return entry[1]
+        tree = BKTree()
+        for roll, value in self.load_day(date):
+            if value is not None:
+                tree.add(from_signed64(value), roll)
+        with self._lock:
+            # Only today's tree is ever queried; drop older days
+            self._days = {date: (time.monotonic(), tree)}
+        return tree
+
+    def add(self, date, student_roll, value):
+        if value is None:
+            return
+        tree = self._tree(date)
+        with self._lock:
+            tree.add(from_signed64(value), student_roll)
+
+    def find_replay(self, date, student_roll, value):
+        """Closest near-identical photo another student submitted on `date`, or None.
+
+        Returns {'student_roll', 'distance'}.
+        """
+        if value is None:
+            return None
+        tree = self._tree(date)
+        with self._lock:
+            matches = [(distance, roll) for distance, roll in tree.search(from_signed64(value), self.max_distance)
+                       if roll != student_roll]
+        if not matches:
+            return None
+        distance, roll = min(matches)
+        return {'student_roll': roll, 'distance': distance}
@@ -133,4 +133,161 @@ CREATE POLICY "All authenticated users can view clear log" ON clear_log
     FOR SELECT USING (auth.role() = 'authenticated');
 
 CREATE POLICY "Principals can insert clear log" ON clear_log
-    FOR INSERT WITH CHECK (auth.role() = 'authenticated'); 
\ No newline at end of file
+    FOR INSERT WITH CHECK (auth.role() = 'authenticated'); 
+
+-- 10. Atomic attendance attempt writes
+-- Attempt tracking columns (also added by migrate_database.py)
+ALTER TABLE attendance
+ADD COLUMN IF NOT EXISTS attempts_remaining INTEGER DEFAULT 3,
+ADD COLUMN IF NOT EXISTS attempt_history JSONB DEFAULT '[]',
+ADD COLUMN IF NOT EXISTS final_status VARCHAR(50) DEFAULT 'pending';
+
+-- Images live in the content-addressed blob store (blob_store.py); rows keep
+-- the SHA-256 hex digest. image_data / profile_picture remain for old rows.
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64);
+-- 64-bit perceptual hash of the image, computed once at write time (signed BIGINT)
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS image_phash BIGINT;
+ALTER TABLE students
+ADD COLUMN IF NOT EXISTS profile_picture TEXT,
+ADD COLUMN IF NOT EXISTS has_profile_picture BOOLEAN DEFAULT FALSE,
+ADD COLUMN IF NOT EXISTS profile_picture_hash VARCHAR(64);
+
+-- One row per upload attempt. image_ref is the blob store hash of the
+-- attempt image instead of a copy of it (attempt_history is kept only for old rows;
+-- migrate_attendance_attempts.py backfills it into this table).
+CREATE TABLE IF NOT EXISTS attendance_attempts (
+    id SERIAL PRIMARY KEY,
+    student_roll INTEGER NOT NULL,
+    date DATE NOT NULL,
+    attempt_number INTEGER NOT NULL,
+    attempted_at TIMESTAMP DEFAULT NOW(),
+    verification_result JSONB,
+    image_ref VARCHAR(64),
+    image_phash BIGINT,
+    UNIQUE(student_roll, date, attempt_number)
+);
+ALTER TABLE attendance_attempts ADD COLUMN IF NOT EXISTS image_phash BIGINT;
+-- Replay detection loads every phash submitted on a date
+CREATE INDEX IF NOT EXISTS idx_attendance_attempts_date ON attendance_attempts(date);
+
+ALTER TABLE attendance_attempts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow all operations on attendance_attempts" ON attendance_attempts
+    FOR ALL USING (true) WITH CHECK (true);
+
+-- Records one upload attempt keyed on UNIQUE(student_roll, date).
+-- The attempt counter is decremented server-side in a single upsert, so
+-- concurrent uploads from the same student cannot lose or double-count attempts.
+-- Returns no row once the student has no attempts left.
+DROP FUNCTION IF EXISTS record_attendance_attempt(INTEGER, DATE, TEXT, JSONB);
+DROP FUNCTION IF EXISTS record_attendance_attempt(INTEGER, DATE, TEXT, JSONB, BIGINT);
+CREATE OR REPLACE FUNCTION record_attendance_attempt(
+    p_student_roll INTEGER,
+    p_date DATE,
+    p_image_hash TEXT,
+    p_verification_result JSONB,
+    p_image_phash BIGINT DEFAULT NULL
+) RETURNS SETOF attendance AS $$
+DECLARE
+    v_verified BOOLEAN := COALESCE((p_verification_result->>'verified')::BOOLEAN, FALSE);
+    v_row attendance;
+BEGIN
+    INSERT INTO attendance AS a (
+        student_roll, date, is_present, image_data, image_hash, image_phash, verified_by, verified_at,
+        attempts_remaining, final_status
+    ) VALUES (
+        p_student_roll, p_date, v_verified, NULL, p_image_hash, p_image_phash,
+        CASE WHEN v_verified THEN 'ai_verification' END,
+        CASE WHEN v_verified THEN NOW() END,
+        2,
+        CASE WHEN v_verified THEN 'present' ELSE 'pending' END
+    )
+    ON CONFLICT (student_roll, date) DO UPDATE SET
+        is_present = v_verified,
+        image_data = NULL,
+        image_hash = EXCLUDED.image_hash,
+        image_phash = EXCLUDED.image_phash,
+        verified_by = EXCLUDED.verified_by,
+        verified_at = EXCLUDED.verified_at,
+        attempts_remaining = COALESCE(a.attempts_remaining, 3) - 1,
+        final_status = CASE
+            WHEN v_verified THEN 'present'
+            WHEN COALESCE(a.attempts_remaining, 3) - 1 <= 0 THEN 'absent'
+            ELSE 'pending'
+        END
+    WHERE COALESCE(a.attempts_remaining, 3) > 0
+    RETURNING a.* INTO v_row;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO attendance_attempts (student_roll, date, attempt_number, verification_result, image_ref, image_phash)
+    VALUES (p_student_roll, p_date, 3 - v_row.attempts_remaining, p_verification_result, p_image_hash, p_image_phash)
+    ON CONFLICT (student_roll, date, attempt_number) DO NOTHING;
+
+    RETURN NEXT v_row;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 11. Indexed first-name lookup for student login
+-- first_name_lower is maintained by DatabaseManager on create and edit;
+-- this backfills existing rows using the same rule as name.split()[0].lower().
+ALTER TABLE students ADD COLUMN IF NOT EXISTS first_name_lower VARCHAR(255);
+
+UPDATE students
+SET first_name_lower = lower(split_part(regexp_replace(trim(name), '\s+', ' ', 'g'), ' ', 1))
+WHERE first_name_lower IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_students_first_name_lower ON students(first_name_lower);
+
+-- 12. Data log pagination and filters
+-- /api/log pages newest-first on (when_timestamp, id) and filters by action,
+-- actor and student roll.
+CREATE INDEX IF NOT EXISTS idx_data_log_when_id ON data_log(when_timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_data_log_action ON data_log(action, when_timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_data_log_who ON data_log(who, when_timestamp DESC);
+-- The roll is in details.student.roll (student snapshots) or details.student_roll
+-- (attendance and profile picture entries); the filter ORs both paths.
+CREATE INDEX IF NOT EXISTS idx_data_log_student_roll ON data_log((details->'student'->>'roll'));
+CREATE INDEX IF NOT EXISTS idx_data_log_attempt_roll ON data_log((details->>'student_roll'));
+
+-- 13. Batched, replay-safe audit log writes
+-- The app's write-behind log writer tags each entry with a UUID and inserts
+-- batches with ON CONFLICT (entry_uuid) DO NOTHING, so entries replayed from
+-- its spill file after a crash are not duplicated.
+ALTER TABLE data_log ADD COLUMN IF NOT EXISTS entry_uuid UUID;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_data_log_entry_uuid ON data_log(entry_uuid);
+
+-- 14. Stored face embeddings
+-- face_embedding is the profile picture's 128-dim face_recognition encoding
+-- as base64 float32, written on profile picture upload. Backfill existing
+-- pictures with: python backfill_face_embeddings.py
+ALTER TABLE students ADD COLUMN IF NOT EXISTS face_embedding TEXT;
+
+-- 15. Asynchronous attendance verification jobs
+-- An async upload is stored in the blob store and acknowledged with a job id;
+-- a background worker verifies it and records the attempt through
+-- record_attendance_attempt. The partial unique index allows one queued or
+-- running job per student per day, so a student cannot have more uploads in
+-- flight than attempts left.
+CREATE TABLE IF NOT EXISTS attendance_jobs (
+    id UUID PRIMARY KEY,
+    student_roll INTEGER NOT NULL,
+    date DATE NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    image_hash TEXT,
+    result JSONB,
+    error TEXT,
+    submitted_by VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_jobs_active
+    ON attendance_jobs(student_roll, date) WHERE status IN ('queued', 'running');
+
+ALTER TABLE attendance_jobs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow all operations on attendance_jobs" ON attendance_jobs
+    FOR ALL USING (true) WITH CHECK (true);
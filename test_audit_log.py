@@ -0,0 +1,114 @@
+"""Tests for data log query parsing and in-memory paging"""
+
+from datetime import datetime
+
+import pytest
+
+from audit_log import decode_cursor, encode_cursor, page_entries, parse_log_query, parse_timestamp, wants_page
+
+
+def make_entries():
+    # Newest first, like data_log
+    return [
+        {'id': 4, 'action': 'edit', 'who': 'principal', 'when': '2024-03-02 10:00:00', 'student': {'roll': '5', 'name': 'A'}},
+        {'id': 3, 'action': 'add', 'who': 'teacher', 'when': '2024-03-02 09:00:00', 'student': {'roll': 6, 'name': 'B'}},
+        {'id': 2, 'action': 'add', 'who': 'principal', 'when': '2024-03-01 09:00:00', 'student': {'roll': 5, 'name': 'A'}},
+        {'id': 1, 'action': 'delete', 'who': 'principal', 'when': '2024-02-28 09:00:00'},
+    ]
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor('2024-03-02 10:00:00', 4)
+    assert decode_cursor(cursor) == (datetime(2024, 3, 2, 10), 4)
+    assert decode_cursor('2024-03-02T10:00:00|4') == (datetime(2024, 3, 2, 10), 4)
+
+
+def test_postgres_timestamps_are_normalized():
+    # Postgres drops trailing zeros; Python 3.9 only parses 3 or 6 fraction digits
+    assert encode_cursor('2024-03-02T10:00:00.12345', 7) == '2024-03-02T10:00:00.123450|7'
+    assert encode_cursor('2024-03-02T10:00:00.1', 7) == '2024-03-02T10:00:00.100000|7'
+    assert decode_cursor('2024-03-02T10:00:00.12345|7') == (datetime(2024, 3, 2, 10, 0, 0, 123450), 7)
+    assert parse_timestamp('2024-03-02T10:00:00.1234567') == datetime(2024, 3, 2, 10, 0, 0, 123456)
+    assert parse_timestamp('2024-03-02T10:00:00.5Z').utcoffset().total_seconds() == 0
+
+
+def test_pages_follow_the_cursor_with_fractional_timestamps():
+    entries = [
+        {'id': 3, 'action': 'add', 'who': 'principal', 'when': '2024-03-02 10:00:00.12345'},
+        {'id': 2, 'action': 'add', 'who': 'principal', 'when': '2024-03-02 10:00:00.1234'},
+        {'id': 1, 'action': 'add', 'who': 'principal', 'when': '2024-03-02 10:00:00'},
+    ]
+    page, cursor = page_entries(entries, parse_log_query({'limit': '1'}))
+    page, cursor = page_entries(entries, parse_log_query({'limit': '1', 'cursor': cursor}))
+    assert [e['id'] for e in page] == [2]
+    page, cursor = page_entries(entries, parse_log_query({'limit': '1', 'cursor': cursor}))
+    assert [e['id'] for e in page] == [1]
+    assert cursor is None
+
+
+@pytest.mark.parametrize('cursor', ['', 'garbage', '2024-03-02|x', "2024-03-02,id.lt.1)|4", '|4'])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+
+def test_wants_page():
+    assert not wants_page({})
+    assert wants_page({'limit': '10'})
+    assert wants_page({'compact': '1'})
+
+
+def test_parse_log_query_defaults_and_caps():
+    query = parse_log_query({'limit': '1000', 'roll': '5', 'compact': 'yes'})
+    assert query['limit'] == 200
+    assert query['student_roll'] == 5
+    assert query['compact'] is True
+    assert query['cursor'] is None
+    assert parse_log_query({})['limit'] == 50
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'limit': 'ten'}, 'limit must be an integer'),
+    ({'limit': '0'}, 'limit must be positive'),
+    ({'roll': 'x'}, 'roll must be an integer'),
+    ({'start_date': '03/01/2024'}, 'start_date must be YYYY-MM-DD'),
+    ({'cursor': 'nope'}, 'Invalid cursor'),
+])
+def test_parse_log_query_rejects_bad_input(args, message):
+    with pytest.raises(ValueError, match=message):
+        parse_log_query(args)
+
+
+def test_pages_follow_the_cursor():
+    entries = make_entries()
+    page, cursor = page_entries(entries, parse_log_query({'limit': '2'}))
+    assert [e['id'] for e in page] == [4, 3]
+    page, cursor = page_entries(entries, parse_log_query({'limit': '2', 'cursor': cursor}))
+    assert [e['id'] for e in page] == [2, 1]
+    assert cursor is None
+
+
+def test_filters():
+    entries = make_entries()
+    ids = lambda args: [e['id'] for e in page_entries(entries, parse_log_query(args))[0]]
+    assert ids({'action': 'add'}) == [3, 2]
+    assert ids({'actor': 'principal'}) == [4, 2, 1]
+    # String and int rolls both match
+    assert ids({'roll': '5'}) == [4, 2]
+    assert ids({'start_date': '2024-03-01', 'end_date': '2024-03-01'}) == [2]
+
+
+def test_roll_filter_includes_attendance_entries():
+    entries = make_entries()
+    entries.insert(0, {'id': 5, 'action': 'verify_attendance_auto', 'who': 'student_5',
+                       'when': '2024-03-03 08:00:00', 'student_roll': 5})
+    page, _ = page_entries(entries, parse_log_query({'roll': '5', 'compact': '1'}))
+    assert [e['id'] for e in page] == [5, 4, 2]
+    assert page[0]['student_roll'] == 5
+
+
+def test_compact_drops_snapshots():
+    page, _ = page_entries(make_entries(), parse_log_query({'limit': '1', 'compact': '1'}))
+    assert 'student' not in page[0]
+    assert page[0]['student_roll'] == '5'
+    assert page[0]['student_name'] == 'A'
@@ -0,0 +1,56 @@
+"""Tests for the PIL + numpy verifier used on Vercel"""
+
+import io
+
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+imagehash = pytest.importorskip('imagehash')
+
+from lean_verifier import LeanVerifier
+from phash_index import phash_to_int, to_signed64
+
+
+def sample_images():
+    """Photo-like test images. Flat or purely one-directional images are left
+    out: most of their DCT coefficients are zero up to rounding, so which side
+    of the median they fall on differs between any two DCT implementations.
+    """
+    rng = np.random.default_rng(11)
+    yield Image.fromarray(rng.integers(0, 256, size=(300, 200, 3), dtype=np.uint8))
+    gradient = np.add.outer(np.linspace(0, 120, 180), np.linspace(0, 120, 257))
+    noisy = gradient + rng.normal(scale=8, size=gradient.shape)
+    yield Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+    # Blocky pattern: mostly low frequencies, like a photo
+    blocks = rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+    yield Image.fromarray(blocks).resize((480, 360), Image.NEAREST)
+
+
+@pytest.fixture(scope='module')
+def verifier():
+    verifier = LeanVerifier()
+    assert verifier.load()
+    return verifier
+
+
+def test_image_phash_equals_imagehash_phash(verifier):
+    for image in sample_images():
+        assert verifier.image_phash(image) == phash_to_int(imagehash.phash(image))
+
+
+def test_phash_of_raw_jpeg(verifier):
+    image = next(sample_images()).resize((320, 240))
+    out = io.BytesIO()
+    image.save(out, format='JPEG')
+    expected = to_signed64(verifier.image_phash(verifier._decode(out.getvalue())[0]))
+    assert verifier.phash_of(out.getvalue()) == expected
+    assert verifier.phash_of(b'not an image') is None
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_image_phash_equals_imagehash_phash_at_any_size(verifier, seed):
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(rng.integers(3, 20), rng.integers(3, 20), 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize((int(rng.integers(100, 900)), int(rng.integers(100, 900))), Image.BILINEAR)
+    assert verifier.image_phash(image) == phash_to_int(imagehash.phash(image))
@@ -0,0 +1,33 @@
+"""Tests for first-name student login matching"""
+
+from login_lookup import first_name_key, match_student_login
+
+ALICE_5 = {'name': 'Alice Smith', 'roll': 5, 'password': 'pw'}
+ALICE_7 = {'name': 'Alice Jones', 'roll': 7, 'password': 'pw'}
+ALICE_9 = {'name': 'Alice Brown', 'roll': 9, 'password': 'other'}
+
+
+def test_first_name_key():
+    assert first_name_key('  Alice   Smith ') == 'alice'
+    assert first_name_key('') == ''
+    assert first_name_key(None) == ''
+
+
+def test_password_picks_the_student():
+    assert match_student_login([ALICE_5, ALICE_9], 'other') == (ALICE_9, None)
+
+
+def test_wrong_password():
+    assert match_student_login([ALICE_5, ALICE_7], 'nope') == (None, 'invalid_credentials')
+    assert match_student_login([], 'pw') == (None, 'invalid_credentials')
+
+
+def test_shared_password_is_ambiguous_without_roll():
+    assert match_student_login([ALICE_5, ALICE_7], 'pw') == (None, 'ambiguous_first_name')
+    assert match_student_login([ALICE_5, ALICE_7], 'pw', roll='') == (None, 'ambiguous_first_name')
+
+
+def test_roll_narrows_the_match_as_int_or_text():
+    assert match_student_login([ALICE_5, ALICE_7], 'pw', roll=7) == (ALICE_7, None)
+    assert match_student_login([ALICE_5, ALICE_7], 'pw', roll='5') == (ALICE_5, None)
+    assert match_student_login([ALICE_5, ALICE_7], 'pw', roll=9) == (None, 'invalid_credentials')
@@ -0,0 +1,71 @@
+"""Tests for the phash BK-tree and same-day replay index"""
+
+import random
+
+from phash_index import BKTree, ReplayIndex, from_signed64, hamming, to_signed64
+
+
+def test_signed_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        signed = to_signed64(value)
+        assert -(1 << 63) <= signed < (1 << 63)
+        assert from_signed64(signed) == value
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Near-duplicates so small radii find something
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    assert tree.size == len(values)
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(5)]:
+        for radius in (0, 3, 12):
+            expected = sorted((hamming(query, value), index) for index, value in enumerate(values)
+                              if hamming(query, value) <= radius)
+            assert sorted(tree.search(query, radius)) == expected
+
+
+def test_bk_tree_keeps_duplicate_hashes():
+    tree = BKTree()
+    tree.add(42, 'a')
+    tree.add(42, 'b')
+    assert sorted(tree.search(42, 0)) == [(0, 'a'), (0, 'b')]
+    assert BKTree().search(42, 5) == []
+
+
+def test_replay_is_another_students_near_identical_photo():
+    photo = to_signed64((1 << 64) - 5)
+    index = ReplayIndex(lambda date: [(1, photo)], max_distance=2)
+    assert index.find_replay('2024-03-01', 1, photo) is None
+    assert index.find_replay('2024-03-01', 2, photo ^ 1) == {'student_roll': 1, 'distance': 1}
+    assert index.find_replay('2024-03-01', 2, photo ^ 0b111) is None
+    assert index.find_replay('2024-03-01', 2, None) is None
+
+
+def test_added_submissions_are_found_without_a_reload():
+    loads = []
+
+    def load_day(date):
+        loads.append(date)
+        return [(1, None)]
+
+    index = ReplayIndex(load_day, refresh_interval=3600)
+    index.add('2024-03-01', 3, 12345)
+    assert index.find_replay('2024-03-01', 4, 12345) == {'student_roll': 3, 'distance': 0}
+    assert loads == ['2024-03-01']
+
+
+def test_day_is_reloaded_after_the_refresh_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('phash_index.time.monotonic', lambda: now[0])
+    stored = []
+    index = ReplayIndex(lambda date: list(stored), refresh_interval=30)
+    assert index.find_replay('2024-03-01', 2, 99) is None
+    # Stored by another worker process
+    stored.append((1, 99))
+    assert index.find_replay('2024-03-01', 2, 99) is None
+    now[0] = 31
+    assert index.find_replay('2024-03-01', 2, 99) == {'student_roll': 1, 'distance': 0}
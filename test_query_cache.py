@@ -0,0 +1,82 @@
+"""Tests for the read-through QueryCache"""
+
+from cache import QueryCache
+
+
+def test_get_miss_then_hit():
+    cache = QueryCache({'students': 60})
+    assert cache.get(('students', 1)) == (False, None)
+    cache.set(('students', 1), {'roll': 1})
+    assert cache.get(('students', 1)) == (True, {'roll': 1})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = QueryCache({'users': 10, 'students': 60})
+    cache.set(('users', 'teacher_1'), 'row')
+    cache.set(('students', 1), 'row')
+    now[0] += 30
+    assert cache.get(('users', 'teacher_1')) == (False, None)
+    assert cache.get(('students', 1)) == (True, 'row')
+    assert cache.stats()['size'] == 1
+
+
+def test_ttl_override_and_default(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = QueryCache({'students': 60}, default_ttl=5)
+    cache.set(('students', 1), 'short', ttl=1)
+    cache.set(('other', 1), 'default')
+    now[0] = 2
+    assert cache.get(('students', 1))[0] is False
+    assert cache.get(('other', 1))[0] is True
+    now[0] = 6
+    assert cache.get(('other', 1))[0] is False
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache({}, max_entries=2)
+    cache.set(('t', 1), 1)
+    cache.set(('t', 2), 2)
+    cache.get(('t', 1))
+    cache.set(('t', 3), 3)
+    assert cache.get(('t', 2))[0] is False
+    assert cache.get(('t', 1)) == (True, 1)
+    assert cache.get(('t', 3)) == (True, 3)
+    assert cache.evictions == 1
+
+
+def test_get_or_load_caches_only_non_empty_results():
+    cache = QueryCache({})
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return []
+
+    assert cache.get_or_load(('t', 'empty'), loader) == []
+    assert cache.get_or_load(('t', 'empty'), loader) == []
+    assert len(calls) == 2
+    assert cache.get_or_load(('t', 'kept'), loader, cache_empty=True) == []
+    assert cache.get_or_load(('t', 'kept'), loader, cache_empty=True) == []
+    assert len(calls) == 3
+    assert cache.get_or_load(('t', 'row'), lambda: {'id': 1}) == {'id': 1}
+    assert cache.get_or_load(('t', 'row'), lambda: None) == {'id': 1}
+
+
+def test_invalidate_and_invalidate_if():
+    cache = QueryCache({})
+    cache.set(('students', 'class', '5'), [1, 2])
+    cache.set(('students', 'class', '6'), [3])
+    cache.set(('users', 'class', '5'), 'other table')
+    cache.invalidate(('students', 'class', '6'), ('students', 'missing'))
+    assert cache.invalidations == 1
+    cache.invalidate_if('students', lambda key, value: 2 in value)
+    assert cache.get(('students', 'class', '5'))[0] is False
+    assert cache.get(('users', 'class', '5'))[0] is True
+    assert cache.invalidations == 2
+    cache.clear()
+    assert cache.stats()['size'] == 0
+    assert cache.invalidations == 3
@@ -0,0 +1,116 @@
+"""Tests for binary upload reading and size limits"""
+
+import base64
+import io
+
+import pytest
+
+from uploads import UploadError, check_upload_size, read_b64_image, read_image_upload, read_image_uploads
+
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 100
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+
+class FakeFiles:
+    def __init__(self, fields):
+        self.fields = fields
+
+    def get(self, name):
+        files = self.fields.get(name)
+        return files[0] if files else None
+
+    def getlist(self, name):
+        return self.fields.get(name, [])
+
+
+class FakeRequest:
+    """The parts of a Flask request the upload helpers read"""
+
+    def __init__(self, mimetype, body=b'', content_length='auto', files=None):
+        self.mimetype = mimetype
+        self.stream = io.BytesIO(body)
+        self.content_length = len(body) if content_length == 'auto' else content_length
+        self._files = {name: [FakeFile(data) for data in datas] for name, datas in (files or {}).items()}
+        self.files_read = False
+
+    @property
+    def files(self):
+        self.files_read = True
+        return FakeFiles(self._files)
+
+
+def multipart(*images, content_length=1000):
+    return FakeRequest('multipart/form-data', content_length=content_length, files={'image': list(images)})
+
+
+def test_raw_body():
+    assert read_image_upload(FakeRequest('image/jpeg', JPEG)) == JPEG
+
+
+def test_chunked_raw_body_over_the_cap_is_refused():
+    request = FakeRequest('image/jpeg', JPEG + b'\x00' * 200, content_length=None)
+    with pytest.raises(UploadError) as error:
+        read_image_upload(request, max_bytes=150)
+    assert error.value.status == 413
+
+
+def test_declared_length_over_the_cap_is_refused_before_reading():
+    request = multipart(JPEG, content_length=10_000)
+    with pytest.raises(UploadError) as error:
+        read_image_upload(request, max_bytes=1000)
+    assert error.value.status == 413
+    assert not request.files_read
+    with pytest.raises(UploadError):
+        check_upload_size(FakeRequest('image/jpeg', content_length=2000), max_bytes=1000)
+
+
+def test_multipart_upload():
+    assert read_image_upload(multipart(PNG)) == PNG
+
+
+def test_multipart_requires_content_length():
+    request = multipart(JPEG, content_length=None)
+    with pytest.raises(UploadError) as error:
+        read_image_upload(request)
+    assert error.value.status == 411
+    assert not request.files_read
+
+
+def test_multipart_requires_the_field():
+    with pytest.raises(UploadError, match='"image" is required'):
+        read_image_upload(FakeRequest('multipart/form-data', content_length=10))
+
+
+@pytest.mark.parametrize('mimetype, body, status', [
+    ('text/plain', JPEG, 415),
+    ('image/jpeg', b'GIF89a' + b'\x00' * 10, 415),
+    ('image/jpeg', b'', 400),
+])
+def test_rejected_bodies(mimetype, body, status):
+    with pytest.raises(UploadError) as error:
+        read_image_upload(FakeRequest(mimetype, body))
+    assert error.value.status == status
+
+
+def test_several_frames():
+    assert read_image_uploads(multipart(JPEG, PNG)) == [JPEG, PNG]
+    with pytest.raises(UploadError, match='At most 2 images'):
+        read_image_uploads(multipart(JPEG, JPEG, JPEG), max_files=2)
+    with pytest.raises(UploadError) as error:
+        read_image_uploads(multipart(JPEG, content_length=10_000), max_bytes=1000)
+    assert error.value.status == 413
+
+
+def test_b64_image():
+    encoded = base64.b64encode(JPEG).decode('ascii')
+    assert read_b64_image(encoded) == JPEG
+    assert read_b64_image(f'data:image/jpeg;base64,{encoded}') == JPEG
+    with pytest.raises(UploadError, match='Image data is required'):
+        read_b64_image('')
+    with pytest.raises(UploadError, match='Invalid image data'):
+        read_b64_image('not base64!')
@@ -0,0 +1,64 @@
+"""Tests for one-to-one matching of class photo faces to the gallery"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from verification_engine import decode_embedding, encode_embedding, match_faces_to_gallery
+
+
+def unit(index):
+    vector = np.zeros(128, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+
+def test_each_face_matches_its_own_student():
+    gallery = np.stack([unit(0), unit(1), unit(2)])
+    faces = np.stack([unit(2) * 0.9, unit(0) * 1.1])
+    matches = match_faces_to_gallery(faces, gallery, threshold=0.5)
+    assert sorted((face, student) for face, student, _ in matches) == [(0, 2), (1, 0)]
+    assert [distance for _, _, distance in matches] == pytest.approx([0.1, 0.1], abs=1e-5)
+
+
+def test_faces_beyond_the_threshold_are_unmatched():
+    gallery = np.stack([unit(0), unit(1)])
+    assert match_faces_to_gallery(np.stack([unit(5)]), gallery, threshold=0.6) == []
+
+
+def test_a_student_is_matched_once_closest_face_first():
+    gallery = np.stack([unit(0)])
+    faces = np.stack([unit(0) * 0.7, unit(0) * 0.95])
+    matches = match_faces_to_gallery(faces, gallery, threshold=0.5)
+    assert [(face, student) for face, student, _ in matches] == [(1, 0)]
+
+
+def test_closest_pairs_win_when_faces_compete():
+    # Face 0 is close to both students, face 1 only to student 0
+    gallery = np.stack([unit(0), unit(0) + unit(1) * 0.3])
+    faces = np.stack([unit(0) + unit(1) * 0.1, unit(0) - unit(1) * 0.05])
+    matches = match_faces_to_gallery(faces, gallery, threshold=0.5)
+    assert sorted((face, student) for face, student, _ in matches) == [(0, 1), (1, 0)]
+
+
+def test_matches_brute_force_distances():
+    rng = np.random.default_rng(3)
+    gallery = rng.normal(size=(12, 128)).astype(np.float32)
+    faces = gallery[[4, 9]] + rng.normal(scale=0.01, size=(2, 128)).astype(np.float32)
+    matches = match_faces_to_gallery(faces, gallery, threshold=1.0)
+    assert sorted((face, student) for face, student, _ in matches) == [(0, 4), (1, 9)]
+    for face, student, distance in matches:
+        assert distance == pytest.approx(float(np.linalg.norm(faces[face] - gallery[student])), abs=1e-4)
+
+
+def test_empty_inputs():
+    assert match_faces_to_gallery(np.zeros((0, 128)), np.stack([unit(0)]), 0.6) == []
+    assert match_faces_to_gallery(np.stack([unit(0)]), np.zeros((0, 128)), 0.6) == []
+
+
+def test_embedding_round_trip():
+    encoding = np.arange(128, dtype=np.float64) / 7
+    text = encode_embedding(encoding)
+    assert len(text) == 684
+    assert np.array_equal(decode_embedding(text), encoding.astype(np.float32))
+    assert decode_embedding(None) is None
@@ -0,0 +1,32 @@
+"""Tests for the verification worker pool"""
+
+import os
+
+from verification_executor import VerificationExecutor, create_verification_executor
+
+
+def test_creating_the_executor_starts_nothing(monkeypatch):
+    monkeypatch.setenv('VERIFICATION_WORKERS', '1')
+    executor = create_verification_executor()
+    assert executor.max_workers == 1
+    assert executor._pool is None
+
+
+def test_real_pool_runs_a_job():
+    executor = VerificationExecutor(max_workers=1, timeout=60)
+    try:
+        executor.start(preload=True)
+        executor.start(preload=True)
+        report = executor.capabilities()
+        assert report is not None
+        assert report['pid'] != os.getpid()
+        assert set(report['backends']) >= {'numpy', 'cv2'}
+        assert executor.stats()['failures'] == 0
+    finally:
+        executor.shutdown()
+
+
+def test_inline_executor_runs_in_process():
+    executor = VerificationExecutor(max_workers=0)
+    assert executor.capabilities()['pid'] == os.getpid()
+    assert executor.stats()['completed'] == 1
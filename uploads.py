@@ -0,0 +1,110 @@
+import os
+
+from blob_store import decode_image_b64
+
+# Largest photo accepted by the binary upload endpoints (raw bytes)
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(5 * 1024 * 1024)))
+
+# Raw-body content types accepted besides multipart/form-data
+IMAGE_MIMETYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+_READ_CHUNK = 64 * 1024
+
+
+class UploadError(ValueError):
+    """A rejected upload; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _read_capped(stream, max_bytes):
+    """Read a stream in chunks, failing as soon as it exceeds max_bytes"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadError(f'Image exceeds {max_bytes} bytes', 413)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _check_image(raw):
+    if not raw:
+        raise UploadError('Image data is required')
+    # JPEG, PNG or WebP magic bytes; anything else is not a photo
+    if not (raw[:3] == b'\xff\xd8\xff' or raw.startswith(b'\x89PNG') or (raw[:4] == b'RIFF' and raw[8:12] == b'WEBP')):
+        raise UploadError('Unsupported image format', 415)
+    return raw
+
+
+def check_upload_size(request, max_bytes=None):
+    """Refuse a request whose declared Content-Length is over the cap, before reading it"""
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise UploadError(f'Image exceeds {max_bytes} bytes', 413)
+
+
+def read_image_upload(request, field='image', max_bytes=None):
+    """Raw image bytes from a multipart/form-data or raw image/* request body.
+
+    Only a raw body is streamed: it is read from `request.stream` in chunks and
+    refused as soon as it passes the cap, even when it is chunked. A multipart
+    body is parsed in full by Werkzeug (file parts spool to a temporary file),
+    so it needs a Content-Length within the cap before parsing starts; the
+    parser never reads past that length. Raises UploadError.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    check_upload_size(request, max_bytes)
+
+    if request.mimetype == 'multipart/form-data':
+        # Without a declared length nothing bounds the form parser
+        if request.content_length is None:
+            raise UploadError('Content-Length is required for multipart uploads', 411)
+        upload = request.files.get(field)
+        if upload is None:
+            raise UploadError(f'Multipart field "{field}" is required')
+        return _check_image(_read_capped(upload.stream, max_bytes))
+
+    if request.mimetype in IMAGE_MIMETYPES:
+        return _check_image(_read_capped(request.stream, max_bytes))
+
+    raise UploadError('Expected multipart/form-data or an image/jpeg body', 415)
+
+
+def read_b64_image(image_b64):
+    """Raw bytes of a base64 / data URL image from a JSON body. Raises UploadError."""
+    if not image_b64:
+        raise UploadError('Image data is required')
+    try:
+        raw = decode_image_b64(image_b64)
+    except ValueError:
+        raise UploadError('Invalid image data')
+    if not raw:
+        raise UploadError('Invalid image data')
+    return raw
+
+
+def read_image_uploads(request, field='image', max_files=5, max_bytes=None):
+    """Raw bytes of every file in a multipart field (e.g. several class frames).
+
+    The cap applies to the whole request's Content-Length, which is checked
+    before Werkzeug parses (and spools) the form. Raises UploadError.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES * max_files
+    check_upload_size(request, max_bytes)
+    if request.mimetype != 'multipart/form-data':
+        raise UploadError('Expected multipart/form-data', 415)
+    if request.content_length is None:
+        raise UploadError('Content-Length is required for multipart uploads', 411)
+    uploads = request.files.getlist(field)
+    if not uploads:
+        raise UploadError(f'Multipart field "{field}" is required')
+    if len(uploads) > max_files:
+        raise UploadError(f'At most {max_files} images per request')
+    return [_check_image(_read_capped(upload.stream, max_bytes)) for upload in uploads]
@@ -0,0 +1,585 @@
+import base64
+import io
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from ai_capabilities import ai_registry
+from blob_store import strip_data_url_prefix
+from phash_index import phash_to_int, to_signed64, from_signed64, hamming
+
+logger = logging.getLogger(__name__)
+
+HAAR_CASCADE = 'haarcascade_frontalface_default.xml'
+
+# Longest side, in pixels, that verification stages work at. Phone uploads are
+# often 3000px+; detection and skin/quality statistics do not need that.
+WORKING_MAX_SIDE = 800
+
+# Most bits a previous attendance photo's phash may differ by to count as similar
+PREVIOUS_PHASH_MAX_DISTANCE = 15
+
+# Haar detection runs on a copy capped at this side; a selfie's face stays
+# well above the cascade's 24px window
+DETECTION_MAX_SIDE = 480
+
+# Expected selfie framing: the face spans this fraction of the short side
+DETECTION_MIN_FACE = 0.15
+DETECTION_MAX_FACE = 0.9
+
+# Wall time allowed for face detection before the remaining checks take over
+DETECTION_BUDGET_MS = 250
+
+# Class check-in frames keep more resolution: a group photo has many small faces
+GALLERY_MAX_SIDE = 1600
+
+
+def match_faces_to_gallery(face_encodings, gallery, threshold):
+    """One-to-one assignment of detected faces to a class gallery.
+
+    `face_encodings` is an (F, 128) array of faces from one frame, `gallery`
+    the (G, 128) embeddings of the class. The F x G Euclidean distance
+    matrix is computed in one vectorized step; pairs within `threshold` are
+    then taken closest first, so each face and each student is used once.
+    Returns [(face_index, gallery_index, distance)].
+    """
+    import numpy as np
+    faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+    gallery = np.asarray(gallery, dtype=np.float32).reshape(-1, 128)
+    if not len(faces) or not len(gallery):
+        return []
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, without an F x G x 128 intermediate
+    squared = (np.einsum('ij,ij->i', faces, faces)[:, None] + np.einsum('ij,ij->i', gallery, gallery)[None, :]
+               - 2 * faces @ gallery.T)
+    distances = np.sqrt(np.maximum(squared, 0))
+
+    candidates = np.argwhere(distances <= threshold)
+    candidates = candidates[np.argsort(distances[candidates[:, 0], candidates[:, 1]], kind='stable')]
+    matched_faces, matched_students, matches = set(), set(), []
+    for face_index, gallery_index in candidates.tolist():
+        if face_index in matched_faces or gallery_index in matched_students:
+            continue
+        matched_faces.add(face_index)
+        matched_students.add(gallery_index)
+        matches.append((face_index, gallery_index, float(distances[face_index, gallery_index])))
+    return matches
+
+
+def encode_embedding(encoding):
+    """Pack a face encoding as base64 float32 (128 dims -> 684 characters)"""
+    import numpy as np
+    return base64.b64encode(np.asarray(encoding, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_embedding(text):
+    """Unpack a stored face embedding, or None if there is none"""
+    if not text:
+        return None
+    import numpy as np
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class StageTimer:
+    """Wall time of each stage of one verification, in ms"""
+
+    def __init__(self):
+        self.started = self._mark = time.perf_counter()
+        self.timings = {}
+        self.over_budget = []
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round((now - self._mark) * 1000, 2)
+        self._mark = now
+
+    def finish(self, result):
+        """Attach 'timings_ms' (and 'over_budget' stages, if any) to a result"""
+        self.timings['total'] = round((time.perf_counter() - self.started) * 1000, 2)
+        result['timings_ms'] = self.timings
+        if self.over_budget:
+            result['over_budget'] = self.over_budget
+        return result
+
+
+class VerificationInput:
+    """One uploaded image, decoded once for every verification stage.
+
+    The image is decoded and downsampled to `max_side` on first use. JPEGs
+    are decoded at reduced scale directly (PIL draft mode). Derived views
+    (RGB array, gray, HSV, phash) are computed the first time a stage asks
+    for them and then reused.
+    """
+
+    def __init__(self, raw, max_side=WORKING_MAX_SIDE):
+        self._raw = raw
+        self._image_data = None
+        self.max_side = max_side
+        self._image = None
+        self._views = {}
+        self._original_size = None
+
+    @classmethod
+    def from_b64(cls, image_data, max_side=WORKING_MAX_SIDE):
+        """Wrap a base64 / data URL string; it is decoded on first use"""
+        image = cls(None, max_side)
+        image._image_data = image_data
+        return image
+
+    @property
+    def raw(self):
+        """Encoded image bytes"""
+        if self._raw is None:
+            self._raw = base64.b64decode(strip_data_url_prefix(self._image_data))
+            self._image_data = None
+        return self._raw
+
+    @classmethod
+    def coerce(cls, image, max_side=WORKING_MAX_SIDE):
+        """Accept a VerificationInput or a base64 / data URL string"""
+        return image if isinstance(image, cls) else cls.from_b64(image, max_side)
+
+    @property
+    def image(self):
+        """RGB PIL image at working resolution"""
+        if self._image is None:
+            from PIL import Image
+            image = Image.open(io.BytesIO(self.raw))
+            self._original_size = image.size
+            # For JPEG this picks a 1/2, 1/4 or 1/8 scale decode before any pixels are read
+            image.draft('RGB', (self.max_side, self.max_side))
+            image = image.convert('RGB')
+            if max(image.size) > self.max_side:
+                image.thumbnail((self.max_side, self.max_side))
+            self._image = image
+        return self._image
+
+    @property
+    def original_size(self):
+        """(width, height) as uploaded, before downsampling"""
+        self.image
+        return self._original_size
+
+    def _view(self, name, compute):
+        if name not in self._views:
+            self._views[name] = compute()
+        return self._views[name]
+
+    @property
+    def rgb(self):
+        """uint8 HxWx3 RGB array (what face_recognition expects)"""
+        import numpy as np
+        return self._view('rgb', lambda: np.asarray(self.image))
+
+    @property
+    def gray(self):
+        import cv2
+        return self._view('gray', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY))
+
+    @property
+    def hsv(self):
+        import cv2
+        return self._view('hsv', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV))
+
+    @property
+    def phash(self):
+        import imagehash
+        return self._view('phash', lambda: imagehash.phash(self.image))
+
+    @property
+    def phash_value(self):
+        """phash as the signed 64-bit int stored in image_phash columns"""
+        return to_signed64(phash_to_int(self.phash))
+
+    def try_phash_value(self):
+        """phash_value, or None if the image cannot be hashed"""
+        try:
+            return self.phash_value
+        except Exception:
+            return None
+
+
+class VerificationEngine:
+    """Owns the long-lived detectors and models used by attendance verification.
+
+    The Haar cascade XML is parsed once per detector instead of once per
+    upload. Detectors are created lazily, up to `max_detectors`, and
+    checked out for the duration of a detectMultiScale call, so concurrent
+    requests never share a classifier while it is running.
+
+    `face_threshold` is the face_recognition distance that counts as a
+    match; `phash_match_threshold` is the profile-vs-capture phash distance
+    used instead when face_recognition is not installed.
+
+    Haar detection works on a copy capped at `detection_max_side`, looking
+    only for faces between `min_face` and `max_face` of its short side,
+    with `scale_factor` between pyramid levels and `min_neighbors` overlapping
+    hits required for a detection. It stops at the first detection and
+    after `detection_budget_ms`.
+    """
+
+    def __init__(self, brightness_range=(20, 235), min_contrast=5, face_threshold=0.7,
+                 phash_match_threshold=20, max_detectors=4, detection_max_side=DETECTION_MAX_SIDE,
+                 scale_factor=1.2, min_neighbors=4, min_face=DETECTION_MIN_FACE, max_face=DETECTION_MAX_FACE,
+                 detection_budget_ms=DETECTION_BUDGET_MS):
+        self.brightness_range = brightness_range
+        self.min_contrast = min_contrast
+        self.face_threshold = face_threshold
+        self.phash_match_threshold = phash_match_threshold
+        self.max_detectors = max_detectors
+        self.detection_max_side = detection_max_side
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_face = min_face
+        self.max_face = max_face
+        self.detection_budget_ms = detection_budget_ms
+        self._detectors = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._libs = None
+        self._face_recognition = None
+
+    def _load_libs(self):
+        """The OpenCV stack (cv2, numpy, PIL.Image, imagehash); None if any is missing"""
+        if self._libs is None:
+            self._libs = ai_registry.require('cv2', 'numpy', 'PIL', 'imagehash') or False
+        return self._libs or None
+
+    @property
+    def available(self):
+        return self._load_libs() is not None
+
+    def _load_face_recognition(self):
+        """face_recognition (with its models loaded); None if it is not installed"""
+        if self._face_recognition is None:
+            self._face_recognition = ai_registry.get('face_recognition') or False
+        return self._face_recognition or None
+
+    def face_encoding(self, image):
+        """Return one face encoding from a VerificationInput, or None"""
+        face_recognition = self._load_face_recognition()
+        if not face_recognition:
+            return None
+        try:
+            encodings = face_recognition.face_encodings(image.rgb)
+            if not encodings:
+                logger.info("No faces detected in image")
+                return None
+            logger.info(f"Found {len(encodings)} face(s) in image")
+            return encodings[0]
+        except Exception as e:
+            logger.error(f"Error getting face encoding: {e}")
+            return None
+
+    def face_encodings_all(self, image):
+        """Encodings of every face in a VerificationInput ([] if none), or None if face_recognition is unavailable"""
+        face_recognition = self._load_face_recognition()
+        if not face_recognition:
+            return None
+        try:
+            encodings = face_recognition.face_encodings(image.rgb)
+            logger.info(f"Found {len(encodings)} face(s) in group image")
+            return encodings
+        except Exception as e:
+            logger.error(f"Error getting face encodings: {e}")
+            return []
+
+    def faces_match(self, profile_encoding, capture, profile=None):
+        """Compare a capture against the stored profile embedding via face_recognition when available.
+
+        Only the capture is encoded. `profile` (the decoded profile picture) is
+        needed only for the perceptual hash fallback.
+        Returns True/False if computed, or None if AI lib unavailable.
+        """
+        face_recognition = self._load_face_recognition()
+        if not face_recognition:
+            if profile is None:
+                return None
+            # Weak fallback using perceptual hash if PIL+imagehash exist
+            try:
+                hash_distance = profile.phash - capture.phash
+                logger.info(f"Perceptual hash distance: {hash_distance}")
+                return hash_distance <= self.phash_match_threshold
+            except Exception as e:
+                logger.error(f"Perceptual hash fallback failed: {e}")
+                return None
+
+        if profile_encoding is None:
+            logger.info("No face detected in profile picture")
+            return False
+        enc_capture = self.face_encoding(capture)
+        if enc_capture is None:
+            logger.info("No face detected in captured image")
+            return False
+
+        distance = face_recognition.face_distance([profile_encoding], enc_capture)[0]
+        logger.info(f"Face recognition distance: {distance}, threshold: {self.face_threshold}")
+        return bool(distance <= self.face_threshold)
+
+    def verify(self, capture, has_profile_picture=False, profile_encoding=None, profile=None,
+               load_previous_phashes=None):
+        """Verify an attendance capture: face match when the student has a
+        profile picture, enhanced verification otherwise or when AI is unavailable.
+
+        Returns a dict with 'verified' (bool), 'method' (str), 'reason' (str)
+        and 'timings_ms' (per-stage wall time) keys.
+        """
+        timer = StageTimer()
+        if has_profile_picture:
+            match = self.faces_match(profile_encoding, capture, profile=profile)
+            timer.lap('face_match')
+            if match is True:
+                return timer.finish({
+                    'verified': True,
+                    'method': 'ai_face_recognition',
+                    'reason': 'face_match_success'
+                })
+            elif match is False:
+                return timer.finish({
+                    'verified': False,
+                    'method': 'ai_face_recognition',
+                    'reason': 'face_mismatch'
+                })
+            # match is None -> AI unavailable: fall through to enhanced verification
+
+        return self.enhanced_verification(capture, load_previous_phashes, timer)
+
+    def _new_detector(self, cv2):
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + HAAR_CASCADE)
+        if detector.empty():
+            raise RuntimeError(f"Could not load {HAAR_CASCADE}")
+        return detector
+
+    @contextmanager
+    def _detector(self, cv2):
+        """Check out a face detector, creating one if all are busy and the pool has room"""
+        try:
+            detector = self._detectors.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.max_detectors
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    detector = self._new_detector(cv2)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                detector = self._detectors.get()
+        try:
+            yield detector
+        finally:
+            self._detectors.put(detector)
+
+    def warm_up(self):
+        """Import the libraries and load a detector ahead of the first upload.
+
+        Returns True when the engine is ready, False if OpenCV is unavailable.
+        """
+        self._load_face_recognition()
+        libs = self._load_libs()
+        if not libs:
+            logger.warning("Verification engine unavailable: OpenCV stack not installed")
+            return False
+        cv2, np = libs[0], libs[1]
+        try:
+            with self._detector(cv2) as detector:
+                detector.detectMultiScale(np.zeros((64, 64), dtype=np.uint8), self.scale_factor, self.min_neighbors)
+        except Exception as e:
+            logger.error(f"Verification engine warm-up failed: {e}")
+            return False
+        logger.info("Verification engine warmed up")
+        return True
+
+    def warm_up_in_background(self):
+        """Run warm_up() on a daemon thread so startup is not delayed"""
+        thread = threading.Thread(target=self.warm_up, name='verification-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def _face_bands(self, short_side):
+        """(minSize, maxSize) bands of face sides to search, largest first.
+
+        Each band spans a factor of two and overlaps the next by a pyramid
+        step, so a face on a boundary still collects its neighbours.
+        """
+        smallest = max(24, int(short_side * self.min_face))
+        largest = max(smallest, int(short_side * self.max_face))
+        bands = []
+        upper = largest
+        while True:
+            low = max(smallest, upper // 2)
+            bands.append((low, min(largest, int(upper * self.scale_factor) + 1)))
+            if low == smallest:
+                return bands
+            upper = low
+
+    def detect_faces(self, gray, deadline=None):
+        """Run the Haar face detector on a downsampled copy of a grayscale image.
+
+        Face sizes are searched band by band from a close-up selfie's down
+        to `min_face`, one detectMultiScale call each, and the search stops
+        at the first band with a detection. No band is started after
+        `deadline` (a time.perf_counter() value), so detection overruns it
+        by at most one band.
+
+        Returns (faces, complete): faces as (x, y, w, h) in `gray`'s
+        coordinates; complete is False when the deadline cut the search short.
+        """
+        cv2, np = self._load_libs()[:2]
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.detection_max_side / max(height, width))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        with self._detector(cv2) as detector:
+            for min_side, max_side in self._face_bands(min(gray.shape[:2])):
+                if deadline is not None and time.perf_counter() > deadline:
+                    return (), False
+                faces = detector.detectMultiScale(gray, self.scale_factor, self.min_neighbors,
+                                                  minSize=(min_side, min_side), maxSize=(max_side, max_side))
+                if len(faces) > 0:
+                    return np.round(np.asarray(faces) / scale).astype(int), True
+        return (), True
+
+    def enhanced_verification(self, image, load_previous_phashes=None, timer=None):
+        """Enhanced image verification using multiple AI techniques when face recognition is unavailable.
+
+        `image` is a VerificationInput (or a base64 string, decoded here).
+        `load_previous_phashes` is called only if the perceptual hash check is
+        reached and returns the stored phashes (image_phash values) of the
+        student's earlier attendance photos. `timer` continues the caller's
+        StageTimer.
+
+        Returns a dict with 'verified' (bool), 'method' (str), 'reason' (str)
+        and 'timings_ms' keys; 'over_budget' lists stages cut short.
+        """
+        timer = timer or StageTimer()
+        return timer.finish(self._enhanced_verification(image, load_previous_phashes, timer))
+
+    def _enhanced_verification(self, image, load_previous_phashes, timer):
+        libs = self._load_libs()
+        if not libs:
+            return {
+                'verified': False,
+                'method': 'none',
+                'reason': 'ai_libraries_unavailable'
+            }
+        cv2, np = libs[0], libs[1]
+
+        try:
+            image = VerificationInput.coerce(image)
+            gray = image.gray
+            timer.lap('decode')
+
+            # Method 1: Face detection using OpenCV
+            faces, complete = self.detect_faces(gray, time.perf_counter() + self.detection_budget_ms / 1000)
+            timer.lap('detection')
+            if not complete:
+                logger.warning(f"Face detection stopped after its {self.detection_budget_ms} ms budget")
+                timer.over_budget.append('detection')
+
+            if len(faces) > 0:
+                # Face detected - this is likely a valid attendance photo
+                logger.info(f"OpenCV detected {len(faces)} face(s)")
+                return {
+                    'verified': True,
+                    'method': 'opencv_face_detection',
+                    'reason': 'face_detected'
+                }
+
+            # Method 2: Image quality and content analysis
+            # Check if image has reasonable size and quality (as uploaded)
+            width, height = image.original_size
+            if height < 100 or width < 100:
+                return {
+                    'verified': False,
+                    'method': 'image_quality_check',
+                    'reason': 'image_too_small'
+                }
+
+            # Check image brightness and contrast
+            mean_brightness = np.mean(gray)
+            std_brightness = np.std(gray)
+
+            logger.info(f"Image brightness: {mean_brightness:.1f}, contrast: {std_brightness:.1f}")
+
+            min_brightness, max_brightness = self.brightness_range
+            if mean_brightness < min_brightness or mean_brightness > max_brightness:
+                return {
+                    'verified': False,
+                    'method': 'image_quality_check',
+                    'reason': 'poor_lighting'
+                }
+
+            if std_brightness < self.min_contrast:
+                return {
+                    'verified': False,
+                    'method': 'image_quality_check',
+                    'reason': 'low_contrast'
+                }
+            timer.lap('quality')
+
+            # Method 3: Check if image appears to be a selfie/portrait
+            # Look for skin tone detection and reasonable aspect ratio
+            aspect_ratio = width / height
+            if 0.5 <= aspect_ratio <= 2.0:  # Reasonable portrait/selfie ratio
+                hsv = image.hsv
+
+                # Define skin tone range
+                lower_skin = np.array([0, 20, 70], dtype=np.uint8)
+                upper_skin = np.array([20, 255, 255], dtype=np.uint8)
+
+                skin_mask = cv2.inRange(hsv, lower_skin, upper_skin)
+                skin_pixels = cv2.countNonZero(skin_mask)
+                total_pixels = skin_mask.size
+                skin_percentage = (skin_pixels / total_pixels) * 100
+                timer.lap('skin')
+
+                if skin_percentage > 5:  # At least 5% of image contains skin tones
+                    return {
+                        'verified': True,
+                        'method': 'skin_tone_analysis',
+                        'reason': 'likely_human_photo'
+                    }
+
+            # Method 4: Perceptual hash comparison with previous attendance images
+            # This is a fallback that checks if the image is similar to previous attendance photos
+            try:
+                previous_phashes = load_previous_phashes() if load_previous_phashes else []
+
+                if previous_phashes:
+                    current_hash = phash_to_int(image.phash)
+
+                    for prev_hash in previous_phashes:
+                        # Check similarity
+                        hash_distance = hamming(current_hash, from_signed64(prev_hash))
+                        if hash_distance <= PREVIOUS_PHASH_MAX_DISTANCE:
+                            timer.lap('previous')
+                            return {
+                                'verified': True,
+                                'method': 'perceptual_hash_comparison',
+                                'reason': 'similar_to_previous_attendance'
+                            }
+            except Exception:
+                pass  # Skip this method if it fails
+            timer.lap('previous')
+
+            # If all methods fail, require manual verification
+            return {
+                'verified': False,
+                'method': 'enhanced_verification',
+                'reason': 'no_verification_criteria_met'
+            }
+
+        except Exception as e:
+            return {
+                'verified': False,
+                'method': 'enhanced_verification',
+                'reason': f'verification_error: {str(e)}'
+            }
@@ -0,0 +1,368 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from ai_capabilities import ai_registry
+from verification_engine import DETECTION_BUDGET_MS, GALLERY_MAX_SIDE, VerificationEngine, VerificationInput, match_faces_to_gallery
+
+logger = logging.getLogger(__name__)
+
+# The engine of the current process: one per pool worker, or the web process
+# itself when verification runs inline
+_engine = None
+_engine_options = {}
+
+# Engine detection options that can be set from the environment
+DETECTION_SETTINGS = (
+    ('detection_max_side', 'VERIFICATION_DETECTION_MAX_SIDE', int),
+    ('scale_factor', 'VERIFICATION_DETECTION_SCALE_FACTOR', float),
+    ('min_neighbors', 'VERIFICATION_DETECTION_MIN_NEIGHBORS', int),
+    ('min_face', 'VERIFICATION_DETECTION_MIN_FACE', float),
+    ('max_face', 'VERIFICATION_DETECTION_MAX_FACE', float),
+    ('detection_budget_ms', 'VERIFICATION_DETECTION_BUDGET_MS', float),
+)
+
+
+# Pool size per web process when VERIFICATION_WORKERS is not set
+DEFAULT_WORKERS = 2
+
+
+# Modules the forkserver imports once for all workers. Setting this also
+# keeps the forkserver from re-importing __main__, i.e. the web app with its
+# database client, log writer and executor.
+FORKSERVER_PRELOAD = ['verification_executor']
+
+
+def _pool_context():
+    """forkserver where available: forking the threaded web process could copy held locks"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _get_engine():
+    global _engine
+    if _engine is None:
+        _engine = VerificationEngine(**_engine_options)
+    return _engine
+
+
+def _init_worker(engine_options):
+    """Pool worker initializer: import the AI stack and load detectors before the first job"""
+    global _engine_options
+    _engine_options = engine_options
+    _get_engine().warm_up()
+
+
+def _warm_job():
+    """No-op job used to start every worker at startup"""
+    return os.getpid()
+
+
+def _verify_job(job):
+    """Verify one attendance capture. Runs in a pool worker.
+
+    `job` holds raw image bytes and plain values only, so it pickles cheaply.
+    Returns {'result', 'image_phash', 'profile_encoding'}; profile_encoding
+    is set only when it had to be computed from job['profile_image'].
+    """
+    engine = _get_engine()
+    capture = VerificationInput(job['image'])
+    profile = VerificationInput(job['profile_image']) if job.get('profile_image') else None
+    profile_encoding = job.get('profile_encoding')
+    computed_encoding = None
+    if profile_encoding is None and profile is not None:
+        profile_encoding = computed_encoding = _as_float32(engine.face_encoding(profile))
+
+    previous_phashes = job.get('previous_phashes') or []
+    result = engine.verify(
+        capture,
+        has_profile_picture=job.get('has_profile_picture', False),
+        profile_encoding=profile_encoding,
+        profile=profile,
+        load_previous_phashes=lambda: previous_phashes
+    )
+    return {
+        'result': result,
+        'image_phash': capture.try_phash_value(),
+        'profile_encoding': computed_encoding
+    }
+
+
+def _face_embedding_job(image):
+    """Face encoding of raw image bytes, or None. Runs in a pool worker."""
+    return _as_float32(_get_engine().face_encoding(VerificationInput(image)))
+
+
+def _gallery_job(job):
+    """Match every face in a few class frames against the class gallery. Runs in a pool worker.
+
+    Frames are matched one at a time (one face per student per frame) and a
+    student seen in several frames keeps their closest match. Returns
+    {'available', 'faces', 'unmatched_faces', 'matches'}; matches maps a
+    gallery index to {'frame', 'distance'}.
+    """
+    engine = _get_engine()
+    faces = 0
+    unmatched = 0
+    matches = {}
+    for frame, image in enumerate(job['images']):
+        encodings = engine.face_encodings_all(VerificationInput(image, max_side=GALLERY_MAX_SIDE))
+        if encodings is None:
+            return {'available': False, 'faces': 0, 'unmatched_faces': 0, 'matches': {}}
+        frame_matches = match_faces_to_gallery(encodings, job['gallery'], engine.face_threshold)
+        faces += len(encodings)
+        unmatched += len(encodings) - len(frame_matches)
+        for _, gallery_index, distance in frame_matches:
+            if gallery_index not in matches or distance < matches[gallery_index]['distance']:
+                matches[gallery_index] = {'frame': frame, 'distance': distance}
+    return {'available': True, 'faces': faces, 'unmatched_faces': unmatched, 'matches': matches}
+
+
+def _capabilities_job(_=None):
+    """AI backends loaded in this process (see CapabilityRegistry.report)"""
+    return {'pid': os.getpid(), 'backends': ai_registry.report()}
+
+
+def _as_float32(encoding):
+    """Encodings are stored as float32; convert before sending one back"""
+    return encoding.astype('float32') if encoding is not None else None
+
+
+def manual_verification_result(method):
+    """Result used when a capture could not be verified automatically in time"""
+    return {
+        'verified': False,
+        'method': method,
+        'reason': 'manual_verification_required'
+    }
+
+
+class VerificationExecutor:
+    """Runs CPU-bound verification in a bounded pool of worker processes.
+
+    Workers import cv2 / PIL / imagehash / face_recognition and load their
+    detectors once, in the pool initializer. Each job waits at most
+    `timeout` seconds; a job that times out, or arrives while `max_pending`
+    jobs are already queued, gets a manual_verification_required result
+    instead of holding the request. With `max_workers=0` jobs run inline in
+    the calling thread (development, or platforms without process pools).
+
+    The pool belongs to one web process: under gunicorn every web worker
+    has its own, so the total is max_workers x web workers. The default is
+    therefore small (DEFAULT_WORKERS, capped at the CPU count). Workers are
+    started with forkserver (spawn where unavailable), never by forking the
+    web process, whose background threads may hold locks.
+    """
+
+    def __init__(self, engine_options=None, max_workers=None, timeout=20.0, max_pending=None):
+        self.engine_options = dict(engine_options or {})
+        self.max_workers = min(DEFAULT_WORKERS, os.cpu_count() or 1) if max_workers is None else max_workers
+        self.timeout = timeout
+        self.max_pending = max_pending if max_pending is not None else max(self.max_workers, 1) * 4
+        self._pool = None
+        self._started = False
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.failures = 0
+        self.cancelled = 0
+        self._stages = {}  # stage -> [count, total ms, max ms]
+
+    def start(self, preload=True):
+        """Start the workers (and warm them) without blocking; later calls do nothing.
+
+        Call it once the web process is serving (not at import: a spawned
+        process re-imports the main module, which must not start a pool).
+        With preload=False nothing is loaded until the first job: inline
+        engines import on first use and pool workers spawn (and warm) on demand.
+        """
+        global _engine_options
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            if self.max_workers == 0:
+                _engine_options = self.engine_options
+            elif preload:
+                if self._pool is None:
+                    self._create_pool()
+                # Workers are spawned on demand; one no-op per worker starts them all
+                for _ in range(self.max_workers):
+                    self._pool.submit(_warm_job)
+        if self.max_workers == 0 and preload:
+            _get_engine().warm_up_in_background()
+
+    def _create_pool(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=_pool_context(),
+            initializer=_init_worker,
+            initargs=(self.engine_options,)
+        )
+
+    def _run(self, fn, arg, fallback, timeout=None):
+        """Run fn(arg) in the pool and wait up to `timeout` (default self.timeout); return fallback(method) if it cannot finish"""
+        timeout = timeout or self.timeout
+        if self.max_workers == 0:
+            self.start(preload=False)
+            try:
+                result = fn(arg)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Verification job failed: {e}")
+                return fallback('verification_error')
+            self.completed += 1
+            return result
+
+        with self._lock:
+            if self._pool is None:
+                self._create_pool()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                logger.warning(f"Verification queue full ({self._pending} pending)")
+                return fallback('verification_busy')
+            try:
+                future = self._pool.submit(fn, arg)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); replace the pool for later jobs
+                logger.error("Verification pool broken, restarting it")
+                self._create_pool()
+                future = self._pool.submit(fn, arg)
+            self._pending += 1
+        future.add_done_callback(self._job_done)
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Still queued jobs are dropped; a running one finishes in the background
+            future.cancel()
+            self.timeouts += 1
+            logger.warning(f"Verification job exceeded {timeout}s")
+            return fallback('verification_timeout')
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Verification job failed: {e}")
+            return fallback('verification_error')
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            # Failures are counted by _run, which sees the exception
+            if future.cancelled():
+                self.cancelled += 1
+            elif future.exception() is None:
+                self.completed += 1
+
+    def verify(self, image, has_profile_picture=False, profile_encoding=None, profile_image=None,
+               previous_phashes=None):
+        """Verify raw capture bytes.
+
+        Returns {'result', 'image_phash', 'profile_encoding'} (see _verify_job).
+        """
+        job = {
+            'image': image,
+            'has_profile_picture': has_profile_picture,
+            'profile_encoding': profile_encoding,
+            'profile_image': profile_image,
+            'previous_phashes': previous_phashes
+        }
+        outcome = self._run(_verify_job, job, lambda method: {
+            'result': manual_verification_result(method),
+            'image_phash': None,
+            'profile_encoding': None
+        })
+        self._record_timings(outcome['result'].get('timings_ms'))
+        return outcome
+
+    def _record_timings(self, timings):
+        if not timings:
+            return
+        with self._lock:
+            for stage, ms in timings.items():
+                entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += ms
+                entry[2] = max(entry[2], ms)
+
+    def stage_timings(self):
+        """Per-stage call count / mean / max in ms of completed verifications"""
+        with self._lock:
+            return {
+                stage: {
+                    'calls': count,
+                    'mean_ms': round(total / count, 2),
+                    'max_ms': round(worst, 2)
+                }
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+    def face_embedding(self, image):
+        """Face encoding of raw image bytes, or None (no face, AI unavailable or timed out)"""
+        return self._run(_face_embedding_job, image, lambda method: None)
+
+    def match_class(self, images, gallery):
+        """Match the faces in raw class frames against an (N, 128) float32 gallery.
+
+        Returns the _gallery_job result, or None if it could not finish in
+        time. Each frame gets the per-job timeout.
+        """
+        job = {'images': list(images), 'gallery': gallery}
+        return self._run(_gallery_job, job, lambda method: None, timeout=self.timeout * max(len(job['images']), 1))
+
+    def capabilities(self):
+        """Backend report from a verification worker (the web process when inline), or None if none answered"""
+        return self._run(_capabilities_job, None, lambda method: None)
+
+    def queue_depth(self):
+        """Jobs submitted and not yet finished (queued or running)"""
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'queue_depth': self.queue_depth(),
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'timeout_seconds': self.timeout,
+            'detection_budget_ms': self.engine_options.get('detection_budget_ms', DETECTION_BUDGET_MS),
+            'stages': self.stage_timings()
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def create_verification_executor(**engine_options):
+    """Create the executor configured by the VERIFICATION_* variables.
+
+    Nothing is started here; the app calls start() once it serves requests,
+    and a job arriving first creates the pool itself.
+    """
+    workers = os.getenv('VERIFICATION_WORKERS')
+    max_pending = os.getenv('VERIFICATION_MAX_PENDING')
+    for option, variable, cast in DETECTION_SETTINGS:
+        if os.getenv(variable):
+            engine_options.setdefault(option, cast(os.getenv(variable)))
+    executor = VerificationExecutor(
+        engine_options,
+        max_workers=int(workers) if workers else None,
+        timeout=float(os.getenv('VERIFICATION_TIMEOUT', '20')),
+        max_pending=int(max_pending) if max_pending else None
+    )
+    return executor